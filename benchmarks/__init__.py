@@ -0,0 +1,6 @@
+"""
+Benchmarks of the profiles rest api.
+
+Every module is a script, run them from the project root, e.g.:
+    python -m benchmarks.asgi_concurrency --help
+"""
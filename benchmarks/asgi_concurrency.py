@@ -0,0 +1,94 @@
+"""
+Concurrency scaling of the async read routes under uvicorn vs the DRF routes under a WSGI server.
+
+Starts both servers on the current database, then hammers the same reads at growing
+concurrency and prints requests/s and latency percentiles for every level:
+    python -m benchmarks.asgi_concurrency --concurrency 1 8 32 128 --requests 2000 --token <key>
+
+Needs uvicorn and gunicorn installed (pip install uvicorn gunicorn). Without --token only
+the public profile routes are measured.
+"""
+import argparse
+import http.client
+import shutil
+import subprocess
+import sys
+import time
+
+from benchmarks import load, report
+
+
+def wait_for_port(port, timeout=15):
+    """ Wait until a server answers on localhost:port """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/api/')
+            connection.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'server on port {port} did not start')
+
+
+class Get(load.Scenario):
+    """ GET of one path """
+    needs_token = True
+
+    def __init__(self, path):
+        super().__init__([], bust_cache=False)
+        self.route = path
+
+    def __call__(self, client):
+        return client.request('GET', self.route)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 128])
+    parser.add_argument('--requests', type=int, default=2000, help='requests per concurrency level')
+    parser.add_argument('--token', help='auth token, to include the feed routes')
+    parser.add_argument('--wsgi-threads', type=int, default=8, help='threads of the gunicorn worker')
+    args = parser.parse_args()
+
+    for command in ('uvicorn', 'gunicorn'):
+        if shutil.which(command) is None:
+            sys.exit(f'{command} is not installed: pip install uvicorn gunicorn')
+
+    servers = [
+        ('asgi', 8011, '/api/async', subprocess.Popen(
+            ['uvicorn', 'profiles_project.asgi:application', '--port', '8011', '--log-level', 'warning'])),
+        ('wsgi', 8012, '/api', subprocess.Popen(
+            ['gunicorn', 'profiles_project.wsgi:application', '--bind', '127.0.0.1:8012',
+             '--threads', str(args.wsgi_threads), '--log-level', 'warning'])),
+    ]
+
+    routes = ['/profile/']
+    if args.token:
+        routes.append('/feed/')
+
+    try:
+        for _, port, _, _ in servers:
+            wait_for_port(port)
+
+        print(f'{"server":<6} {"route":<10} {"conc":>5} {"req/s":>9} {"p50 ms":>8} {"p99 ms":>8}')
+        for route in routes:
+            for concurrency in args.concurrency:
+                for name, port, prefix, _ in servers:
+                    result = load.run_scenario(
+                        f'http://127.0.0.1:{port}', Get(prefix + route), concurrency, args.requests, args.token
+                    )
+                    summary = report.summarize(result)
+                    print(
+                        f'{name:<6} {route:<10} {concurrency:>5} {summary["throughput"]:>9.1f} '
+                        f'{summary["p50"]:>8.2f} {summary["p99"]:>8.2f}'
+                    )
+    finally:
+        for _, _, _, process in servers:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+"""
+Load driver: hit the api of a running server with concurrent clients.
+
+    gunicorn profiles_project.wsgi:application --threads 8    (DEBUG on for query counts)
+    python -m benchmarks.load --url http://127.0.0.1:8000 --concurrency 8 --requests 500 --output run.json
+    python -m benchmarks.report run.json --baseline previous.json
+
+Scenarios (--scenarios to pick some): profile_list, profile_search, feed_list, feed_deep,
+profile_timeline and login. The feed scenarios log in as a profile created by
+benchmarks.seed. Queries per request are read from the X-Query-Count header, which the
+server sends when PROFILES_INSTRUMENTATION['SERVER_TIMING_HEADER'] is on (the DEBUG default).
+
+The throttles of the server apply to the load too: all the requests of a scenario come
+from one address and one user, so raise REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] (or set
+them to None) on the server being measured, or most requests end up as 429s.
+
+Prefer a real server over runserver: runserver does not disable Nagle on keep-alive
+connections, which adds ~40ms to every request after the first one of a connection.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import platform
+import random
+import socket
+import threading
+import time
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from benchmarks.seed import PASSWORD
+
+
+class Connection(http.client.HTTPConnection):
+    """ HTTPConnection with Nagle off, or small requests wait on delayed ACKs (~40ms each) """
+
+    def connect(self):
+        super().connect()
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class Client:
+    """ Keep-alive http client of one load thread """
+
+    def __init__(self, url, token=None, seed=None):
+        parts = urlsplit(url)
+        # the random choices of the thread, seeded so a run can be repeated
+        self.random = random.Random(seed)
+        self.connection = Connection(parts.hostname, parts.port or 80, timeout=60)
+        self.headers = {'Accept': 'application/json'}
+        if token:
+            self.headers['Authorization'] = f'Token {token}'
+
+    def request(self, method, path, body=None):
+        """ Return (status, seconds, queries, json body) """
+        headers = dict(self.headers)
+        if body is not None:
+            body = urlencode(body)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        start = time.perf_counter()
+        self.connection.request(method, path, body=body, headers=headers)
+        response = self.connection.getresponse()
+        content = response.read()
+        seconds = time.perf_counter() - start
+        queries = response.getheader('X-Query-Count')
+        try:
+            data = json.loads(content) if content else None
+        except ValueError:
+            data = None
+        return response.status, seconds, int(queries) if queries is not None else None, data
+
+    def close(self):
+        self.connection.close()
+
+
+def find_profiles(url, limit):
+    """ [(id, email)] of up to limit seeded profiles, read from the streaming export """
+    client = Client(url)
+    client.connection.request('GET', '/api/profile/export/', headers=client.headers)
+    response = client.connection.getresponse()
+    profiles = []
+    for line in response:
+        profile = json.loads(line)
+        if profile['email'].startswith('bench-'):
+            profiles.append((profile['id'], profile['email']))
+            if len(profiles) >= limit:
+                break
+    client.close()
+    if not profiles:
+        raise SystemExit('no benchmark profiles found, seed the database with benchmarks.seed first')
+    return profiles
+
+
+def login(url, email):
+    """ Token of a seeded profile """
+    client = Client(url)
+    status, _, _, data = client.request('POST', '/api/login/', {'username': email, 'password': PASSWORD})
+    client.close()
+    if status != 200:
+        raise SystemExit(f'cannot log in as {email} ({status}), seed the database with benchmarks.seed first')
+    return data['token']
+
+
+class Scenario:
+    """ Builds the requests of a scenario, one call per request """
+    needs_token = False
+
+    def __init__(self, profiles, bust_cache):
+        # [(id, email)] of seeded profiles
+        self.profiles = profiles
+        self.bust_cache = bust_cache
+        # shared by the load threads, next() on it is atomic
+        self.counter = itertools.count(1)
+
+    def path(self, path, **params):
+        if self.bust_cache:
+            # a unique query string so neither the response cache nor a 304 can answer
+            params['_'] = next(self.counter)
+        return f'{path}?{urlencode(params)}' if params else path
+
+    def __call__(self, client):
+        raise NotImplementedError
+
+
+class ProfileList(Scenario):
+    def __call__(self, client):
+        return client.request('GET', self.path('/api/profile/'))
+
+
+class ProfileSearch(Scenario):
+    def __call__(self, client):
+        _, email = client.random.choice(self.profiles)
+        return client.request('GET', self.path('/api/profile/', search=email.split('@')[0]))
+
+
+class FeedList(Scenario):
+    needs_token = True
+
+    def __call__(self, client):
+        return client.request('GET', self.path('/api/feed/'))
+
+
+class FeedDeep(Scenario):
+    """ Follow the next links of the feed for 10 pages, the cost of a page should not grow """
+    needs_token = True
+
+    def __call__(self, client):
+        cursor = getattr(client, 'feed_cursor', None)
+        params = {'cursor': cursor} if cursor else {}
+        status, seconds, queries, data = client.request('GET', self.path('/api/feed/', **params))
+        next_link = (data or {}).get('next')
+        pages = getattr(client, 'feed_pages', 0) + 1
+        if next_link and pages < 10:
+            client.feed_cursor = parse_qs(urlsplit(next_link).query)['cursor'][0]
+            client.feed_pages = pages
+        else:
+            client.feed_cursor, client.feed_pages = None, 0
+        return status, seconds, queries, data
+
+
+class ProfileTimeline(Scenario):
+    needs_token = True
+
+    def __call__(self, client):
+        profile_id, _ = client.random.choice(self.profiles)
+        return client.request('GET', self.path(f'/api/profile/{profile_id}/feed/'))
+
+
+class Login(Scenario):
+    def __call__(self, client):
+        _, email = client.random.choice(self.profiles)
+        return client.request('POST', '/api/login/', {'username': email, 'password': PASSWORD})
+
+
+SCENARIOS = {
+    'profile_list': ProfileList,
+    'profile_search': ProfileSearch,
+    'feed_list': FeedList,
+    'feed_deep': FeedDeep,
+    'profile_timeline': ProfileTimeline,
+    'login': Login,
+}
+
+
+def run_scenario(url, scenario, concurrency, total, token=None, seed=1):
+    """ Run total requests of a scenario from concurrency threads, return the raw samples """
+    samples = []
+    errors = []
+    lock = threading.Lock()
+    remaining = [total]
+
+    def worker(index):
+        client = Client(url, token if scenario.needs_token else None, seed=f'{seed}:{index}')
+        local = []
+        try:
+            while True:
+                with lock:
+                    if remaining[0] <= 0:
+                        break
+                    remaining[0] -= 1
+                status, seconds, queries, _ = scenario(client)
+                local.append((seconds, queries))
+                if status >= 400:
+                    with lock:
+                        errors.append(status)
+        finally:
+            client.close()
+            with lock:
+                samples.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'concurrency': concurrency,
+        'elapsed': elapsed,
+        'latencies': [seconds for seconds, _ in samples],
+        'queries': [queries for _, queries in samples if queries is not None],
+        'errors': len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=500, help='requests per scenario')
+    parser.add_argument('--profiles', type=int, default=1000, help='how many seeded profiles to pick users from')
+    parser.add_argument('--bust-cache', action='store_true', help='defeat the response cache with unique urls')
+    parser.add_argument('--seed', type=int, default=1, help='random seed, keep it fixed to compare runs')
+    parser.add_argument('--output', help='write the raw results as json, for benchmarks.report')
+    args = parser.parse_args()
+
+    from benchmarks import report
+
+    profiles = find_profiles(args.url, args.profiles)
+    token = None
+    if any(SCENARIOS[name].needs_token for name in args.scenarios):
+        token = login(args.url, profiles[0][1])
+
+    results = {
+        'meta': {
+            'url': args.url,
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'bust_cache': args.bust_cache,
+            'python': platform.python_version(),
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'scenarios': {},
+    }
+    print(report.HEADER)
+    for name in args.scenarios:
+        scenario = SCENARIOS[name](profiles, args.bust_cache)
+        results['scenarios'][name] = run_scenario(args.url, scenario, args.concurrency, args.requests, token, args.seed)
+        print(report.format_row(name, report.summarize(results['scenarios'][name])))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Serialization cost of the list endpoints: ModelSerializer vs the fast read serializers.
+
+    python -m benchmarks.read_serializers --rows 10000 --repeat 5
+
+Runs on a throwaway test database, seeds it with benchmarks.seed, then renders the same
+rows to JSON with both serializers. The two outputs must be byte-identical, the script
+exits with an error if they are not.
+"""
+import argparse
+import io
+import os
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'profiles_project.settings')
+
+
+def best_of(repeat, function):
+    """ (fastest seconds, result) of repeat calls """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000, help='feed items (and a tenth as many profiles)')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    django.setup()
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+    from rest_framework.renderers import JSONRenderer
+
+    from benchmarks.seed import seed
+    from profiles_api import models, serializers
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        seed(max(args.rows // 10, 1), args.rows, 2000, reset=False, out=io.StringIO())
+        renderer = JSONRenderer()
+        cases = (
+            ('profiles', models.UserProfile.objects.order_by('id'),
+             serializers.UserProfileSerializer, serializers.UserProfileReadSerializer),
+            ('feed items', models.ProfileFeedItem.objects.order_by('-created_on', '-id'),
+             serializers.ProfileFeedItemSerializer, serializers.ProfileFeedItemReadSerializer),
+        )
+        print(f'{"rows":<11} {"count":>7} {"model ms":>9} {"values ms":>10} {"speedup":>8}')
+        for name, queryset, model_serializer, read_serializer in cases:
+            model_seconds, model_json = best_of(
+                args.repeat, lambda: renderer.render(model_serializer(queryset.all(), many=True).data)
+            )
+            read_seconds, read_json = best_of(
+                args.repeat, lambda: renderer.render(read_serializer(read_serializer.rows(queryset), many=True).data)
+            )
+            if model_json != read_json:
+                raise SystemExit(f'{name}: the two serializers rendered different json')
+            print(
+                f'{name:<11} {queryset.count():>7} {model_seconds * 1000:>9.1f} {read_seconds * 1000:>10.1f} '
+                f'{model_seconds / read_seconds:>7.1f}x'
+            )
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
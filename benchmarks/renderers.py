@@ -0,0 +1,92 @@
+"""
+Rendering and parsing throughput of FastJSONRenderer/FastJSONParser vs DRF's json classes.
+
+    python -m benchmarks.renderers --page-size 500 --pages 20 --repeat 5
+
+Builds feed pages shaped like the response of /api/feed/ (a next link, a previous link and
+page-size items) and renders them with both renderers, then parses the bytes back with both
+parsers. The renderers must produce identical bytes. Without orjson installed both columns
+measure the json module.
+"""
+import argparse
+import io
+import os
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'profiles_project.settings')
+
+
+def make_pages(pages, page_size):
+    """ Feed pages with the keys and value types of the feed list endpoint """
+    from django.utils import timezone
+
+    now = timezone.now()
+    return [
+        {
+            'next': f'http://testserver/api/feed/?cursor=Znw{page}',
+            'previous': f'http://testserver/api/feed/?cursor=cnw{page}' if page else None,
+            'results': [
+                {
+                    'id': page * page_size + n,
+                    'user_profile': n % 97 + 1,
+                    'status_text': f'status number {n} of page {page}, café',
+                    'created_on': (now - timezone.timedelta(seconds=page * page_size + n)).isoformat(),
+                }
+                for n in range(page_size)
+            ],
+        }
+        for page in range(pages)
+    ]
+
+
+def timed(repeat, function, items):
+    """ Fastest seconds over repeat runs of function on every item, and the last results """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = [function(item) for item in items]
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--page-size', type=int, default=500)
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    django.setup()
+    from rest_framework.parsers import JSONParser
+    from rest_framework.renderers import JSONRenderer
+
+    from profiles_api import parsers, renderers
+
+    pages = make_pages(args.pages, args.page_size)
+    print(f'orjson {"installed" if renderers.orjson else "missing"}, {args.pages} pages of {args.page_size} items')
+    print(f'{"":<8} {"class":<18} {"ms":>8} {"pages/s":>9} {"MB/s":>8}')
+
+    rendered = {}
+    for name, renderer in (('json', JSONRenderer()), ('fast', renderers.FastJSONRenderer())):
+        seconds, rendered[name] = timed(args.repeat, renderer.render, pages)
+        size = sum(len(body) for body in rendered[name]) / 1e6
+        print(f'{"render":<8} {type(renderer).__name__:<18} {seconds * 1000:>8.1f} '
+              f'{args.pages / seconds:>9.1f} {size / seconds:>8.1f}')
+    if rendered['json'] != rendered['fast']:
+        raise SystemExit('the renderers produced different bytes')
+
+    bodies = rendered['json']
+    for json_parser in (JSONParser(), parsers.FastJSONParser()):
+        seconds, parsed = timed(args.repeat, lambda body: json_parser.parse(io.BytesIO(body)), bodies)
+        size = sum(len(body) for body in bodies) / 1e6
+        print(f'{"parse":<8} {type(json_parser).__name__:<18} {seconds * 1000:>8.1f} '
+              f'{args.pages / seconds:>9.1f} {size / seconds:>8.1f}')
+        if parsed != pages:
+            raise SystemExit(f'{type(json_parser).__name__} did not parse back the pages')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Summarize a benchmarks.load run and compare it with an earlier one.
+
+    python -m benchmarks.report run.json
+    python -m benchmarks.report run.json --baseline previous.json --tolerance 10
+
+With --baseline every scenario whose p95 latency or queries per request got worse by more
+than --tolerance percent (or whose throughput dropped by as much) is flagged, and the
+exit status is 1 so the comparison can gate CI.
+"""
+import argparse
+import json
+import sys
+
+HEADER = f'{"scenario":<18} {"req/s":>9} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"queries":>8} {"errors":>7}'
+
+
+def percentile(values, fraction):
+    """ Nearest rank percentile of a list of numbers """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def summarize(result):
+    """ Numbers of one scenario of a run """
+    latencies = result['latencies']
+    queries = result['queries']
+    return {
+        'throughput': len(latencies) / result['elapsed'] if result['elapsed'] else 0.0,
+        'p50': percentile(latencies, 0.50) * 1000,
+        'p95': percentile(latencies, 0.95) * 1000,
+        'p99': percentile(latencies, 0.99) * 1000,
+        'queries': sum(queries) / len(queries) if queries else None,
+        'errors': result['errors'],
+    }
+
+
+def format_row(name, summary):
+    queries = '-' if summary['queries'] is None else f'{summary["queries"]:.1f}'
+    return (
+        f'{name:<18} {summary["throughput"]:>9.1f} {summary["p50"]:>8.2f} {summary["p95"]:>8.2f} '
+        f'{summary["p99"]:>8.2f} {queries:>8} {summary["errors"]:>7}'
+    )
+
+
+def regressions(current, baseline, tolerance):
+    """ [(scenario, metric, before, after)] that got worse by more than tolerance percent """
+    found = []
+    factor = 1 + tolerance / 100
+    for name, summary in current.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if summary['p95'] > before['p95'] * factor:
+            found.append((name, 'p95 ms', before['p95'], summary['p95']))
+        if summary['throughput'] * factor < before['throughput']:
+            found.append((name, 'req/s', before['throughput'], summary['throughput']))
+        if summary['queries'] is not None and before['queries'] is not None and summary['queries'] > before['queries']:
+            # query counts are deterministic, any increase is a regression
+            found.append((name, 'queries', before['queries'], summary['queries']))
+    return found
+
+
+def load(path):
+    with open(path) as results:
+        run = json.load(results)
+    return run['meta'], {name: summarize(result) for name, result in run['scenarios'].items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('run')
+    parser.add_argument('--baseline', help='earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=10.0, help='percent of noise allowed')
+    args = parser.parse_args()
+
+    meta, current = load(args.run)
+    print(f'{meta["url"]}  concurrency {meta["concurrency"]}  {meta["requests"]} requests/scenario  {meta["started"]}')
+    print(HEADER)
+    for name, summary in current.items():
+        print(format_row(name, summary))
+
+    if args.baseline:
+        baseline_meta, baseline = load(args.baseline)
+        if (baseline_meta['concurrency'], baseline_meta['bust_cache']) != (meta['concurrency'], meta['bust_cache']):
+            print('warning: the runs used different settings, the comparison is not meaningful')
+        found = regressions(current, baseline, args.tolerance)
+        print()
+        if not found:
+            print(f'no regressions against {args.baseline}')
+            return
+        for name, metric, before, after in found:
+            print(f'REGRESSION {name}: {metric} {before:.2f} -> {after:.2f}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Fill the database with benchmark data.
+
+    python -m benchmarks.seed --profiles 10000 --items 200000
+
+Profiles are named bench-<n>@example.com and all have the password "benchmark". They and
+their feed items are inserted with bulk_create, so seeding a million rows takes seconds.
+--reset removes the previous benchmark profiles (and their items) first.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'profiles_project.settings')
+
+EMAIL_TEMPLATE = 'bench-{}@example.com'
+PASSWORD = 'benchmark'
+WORDS = ('hello', 'world', 'coffee', 'deploy', 'friday', 'release', 'bug', 'fixed', 'lunch', 'meeting', 'python')
+
+
+def seed(profiles, items, batch_size, reset, out=sys.stdout):
+    """ Insert profiles and feed items, return (seconds, profile ids) """
+    from django.contrib.auth.hashers import make_password
+    from django.db import transaction
+    from django.db.models import Max
+
+    from profiles_api import caching, search
+    from profiles_api.models import ProfileFeedItem, UserProfile
+
+    start = time.perf_counter()
+    if reset:
+        deleted, _ = UserProfile.objects.filter(email__startswith='bench-', email__endswith='@example.com').delete()
+        out.write(f'removed {deleted} rows\n')
+
+    # one hash for everybody, hashing every profile would take longer than the inserts
+    password = make_password(PASSWORD)
+    first = (UserProfile.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+    with transaction.atomic():
+        UserProfile.objects.bulk_create(
+            (
+                UserProfile(email=EMAIL_TEMPLATE.format(first + n), name=f'Bench User {first + n}', password=password)
+                for n in range(profiles)
+            ),
+            batch_size=batch_size,
+        )
+    created = list(
+        UserProfile.objects.filter(email__startswith='bench-').order_by('-id').values_list('id', flat=True)[:profiles]
+    )
+    # bulk_create sends no signals, do what the post_save receivers would have done
+    search.index_profiles(UserProfile.objects.filter(id__in=created).only('id', 'name', 'email').iterator())
+    caching.bump_version(UserProfile)
+    out.write(f'{profiles} profiles in {time.perf_counter() - start:.1f}s\n')
+
+    random_state = random.Random(42)
+    for offset in range(0, items, batch_size):
+        count = min(batch_size, items - offset)
+        ProfileFeedItem.objects.bulk_create_items(
+            [
+                ProfileFeedItem(
+                    user_profile_id=random_state.choice(created),
+                    status_text=' '.join(random_state.choices(WORDS, k=6)),
+                )
+                for _ in range(count)
+            ],
+            chunk_size=batch_size,
+        )
+        out.write(f'\r{offset + count}/{items} feed items')
+        out.flush()
+    out.write(f'\ndone in {time.perf_counter() - start:.1f}s\n')
+    return time.perf_counter() - start, created
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profiles', type=int, default=1000)
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, default=2000)
+    parser.add_argument('--reset', action='store_true', help='delete earlier benchmark profiles first')
+    args = parser.parse_args()
+
+    django.setup()
+    seed(args.profiles, args.items, args.batch_size, args.reset)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Cold start of a worker process: full settings vs the API only ones, with and without warm up.
+
+    python -m benchmarks.startup --repeat 5
+
+Every run is a fresh python process doing what a gunicorn worker does: import
+profiles_project.wsgi (settings, django.setup(), the warm up of profiles_api/warmup.py) and
+answer requests through the wsgi callable. Reported, as the median over the runs:
+    boot ms     from the first import to the application being ready
+    first ms    the first GET /api/profile/, which pays for whatever boot left to load
+    second ms   the same request again, the steady state
+    rss MB      resident set size after the first request
+    modules     entries of sys.modules after the first request
+The requests go to a database migrated once beforehand, in a temporary directory.
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+CONFIGURATIONS = {
+    'full': ('profiles_project.settings', False),
+    'full+warmup': ('profiles_project.settings', True),
+    'api': ('profiles_project.settings_api', False),
+    'api+warmup': ('profiles_project.settings_api', True),
+}
+
+
+def rss_mb():
+    """ Resident set size of this process """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    # peak rather than current, kilobytes on linux and bytes on macos
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def get(application, path):
+    """ GET path through a wsgi callable, return the status line """
+    from wsgiref.util import setup_testing_defaults
+
+    environ = {'PATH_INFO': path, 'REQUEST_METHOD': 'GET', 'wsgi.errors': io.StringIO()}
+    setup_testing_defaults(environ)
+    status = []
+    body = application(environ, lambda line, headers, exc_info=None: status.append(line))
+    b''.join(body)
+    body.close()
+    return status[0]
+
+
+def run_worker(warmup):
+    """ Boot like a worker and serve two requests, return the measurements """
+    start = time.perf_counter()
+    from django.conf import settings
+    settings.PROFILES_WARMUP = warmup
+    from profiles_project.wsgi import application
+    booted = time.perf_counter()
+
+    status = get(application, '/api/profile/')
+    if not status.startswith('200'):
+        raise SystemExit(f'GET /api/profile/ answered {status}')
+    first = time.perf_counter()
+    get(application, '/api/profile/')
+    second = time.perf_counter()
+
+    return {
+        'boot': (booted - start) * 1000,
+        'first': (first - booted) * 1000,
+        'second': (second - first) * 1000,
+        'rss': rss_mb(),
+        'modules': len(sys.modules),
+    }
+
+
+def run_configuration(name, repeat, database_url):
+    """ Median measurements of repeat fresh worker processes configured as name """
+    settings_module, warmup = CONFIGURATIONS[name]
+    environ = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module, DATABASE_URL=database_url)
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.startup', '--child', '1' if warmup else '0'],
+            env=environ, check=True, capture_output=True, text=True,
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='processes per configuration')
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        print(json.dumps(run_worker(bool(args.child))))
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = f'sqlite:///{os.path.join(directory, "startup.sqlite3")}'
+        subprocess.run(
+            [sys.executable, 'manage.py', 'migrate', '--verbosity', '0'],
+            env=dict(os.environ, DJANGO_SETTINGS_MODULE='profiles_project.settings', DATABASE_URL=database_url),
+            check=True,
+        )
+        print(f'{"config":<12} {"boot ms":>8} {"first ms":>9} {"second ms":>10} {"rss MB":>7} {"modules":>8}')
+        for name in CONFIGURATIONS:
+            result = run_configuration(name, args.repeat, database_url)
+            print(
+                f'{name:<12} {result["boot"]:>8.1f} {result["first"]:>9.1f} {result["second"]:>10.1f} '
+                f'{result["rss"]:>7.1f} {result["modules"]:>8.0f}'
+            )
+
+
+if __name__ == '__main__':
+    main()
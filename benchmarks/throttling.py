@@ -0,0 +1,57 @@
+"""
+Overhead of the throttles: microseconds per request counted by each counter store.
+
+    python -m benchmarks.throttling --keys 1000 --hits 200000 --threads 1 4
+
+Every hit is what a throttled request pays on top of its view: LocalCounterStore is the in
+process default, CacheCounterStore is measured on the "default" cache of the settings (a
+local memory cache unless configured otherwise, a network cache costs a round trip more).
+"""
+import argparse
+import os
+import threading
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'profiles_project.settings')
+
+
+def run(store, keys, hits, threads):
+    """ Seconds for hits counter updates spread over threads and keys """
+    per_thread = hits // threads
+
+    def worker(offset):
+        hit = store.hit
+        for n in range(per_thread):
+            hit(keys[(n + offset) % len(keys)], 1_000_000, 60)
+
+    workers = [threading.Thread(target=worker, args=(number * 7,)) for number in range(threads)]
+    start = time.perf_counter()
+    for worker_thread in workers:
+        worker_thread.start()
+    for worker_thread in workers:
+        worker_thread.join()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--keys', type=int, default=1000, help='distinct users counted')
+    parser.add_argument('--hits', type=int, default=200000)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4])
+    args = parser.parse_args()
+
+    django.setup()
+    from profiles_api import throttling
+
+    keys = [f'feed:user:{n}' for n in range(args.keys)]
+    print(f'{"store":<18} {"threads":>7} {"us/hit":>8}')
+    for threads in args.threads:
+        for store in (throttling.LocalCounterStore(), throttling.CacheCounterStore()):
+            seconds = run(store, keys, args.hits, threads)
+            print(f'{type(store).__name__:<18} {threads:>7} {seconds / args.hits * 1e6:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
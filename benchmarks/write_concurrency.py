@@ -0,0 +1,136 @@
+"""
+Feed POST throughput from concurrent writers, default SQLite settings vs the tuned ones.
+
+    python -m benchmarks.write_concurrency --threads 1 4 16 --requests 2000
+
+Every configuration runs in a fresh process on a fresh database file, with the requests
+going through the whole Django stack (middleware, token auth, serializer, insert):
+    plain   what settings.py used to give: rollback journal, synchronous=FULL, DEFERRED
+            transactions, a new connection for every request
+    tuned   the defaults of profiles_project/database.py: WAL, synchronous=NORMAL, mmap,
+            IMMEDIATE transactions, persistent connections and the connection pool
+    queued  tuned, with the write-behind queue on (profiles_api/write_behind.py); the time
+            includes draining the queue, so every item is in the database at the end
+Failed requests are mostly "database is locked" errors.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+CONFIGURATIONS = {
+    'plain': {
+        'DATABASE_CONN_MAX_AGE': '0',
+        'DATABASE_POOL_SIZE': '0',
+        'SQLITE_JOURNAL_MODE': '',
+        'SQLITE_SYNCHRONOUS': '',
+        'SQLITE_MMAP_SIZE': '',
+        'SQLITE_TRANSACTION_MODE': '',
+    },
+    'tuned': {},
+    'queued': {'BENCH_WRITE_BEHIND': '1'},
+}
+
+
+def run_writers(threads, requests):
+    """ POST requests feed items from threads clients, return (seconds, errors) """
+    import django
+    from django.conf import settings
+    from django.core.management import call_command
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+
+    django.setup()
+    from rest_framework.settings import api_settings
+
+    # one user sends every request, the feed throttle would turn most of them into 429s
+    settings.REST_FRAMEWORK = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}}
+    api_settings.reload()
+    queued = os.environ.get('BENCH_WRITE_BEHIND') == '1'
+    if queued:
+        settings.PROFILES_WRITE_BEHIND = {
+            'ENABLED': True,
+            'PATH': os.path.join(os.path.dirname(settings.DATABASES['default']['NAME']), 'queue.sqlite3'),
+            'MAX_PENDING': requests,
+        }
+    setup_test_environment()
+    call_command('migrate', verbosity=0)
+
+    from rest_framework.authtoken.models import Token
+
+    from profiles_api.models import UserProfile
+
+    user = UserProfile.objects.create_user(email='writer@example.com', name='Writer', password='benchmark')
+    token = Token.objects.create(user=user)
+
+    remaining = [requests]
+    errors = []
+    lock = threading.Lock()
+
+    def writer(number):
+        client = Client(raise_request_exception=False, HTTP_AUTHORIZATION=f'Token {token.key}')
+        sent = 0
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+            sent += 1
+            response = client.post('/api/feed/', {'status_text': f'writer {number} item {sent}'})
+            if response.status_code not in (201, 202):
+                with lock:
+                    errors.append(response.status_code)
+
+    workers = [threading.Thread(target=writer, args=(number,)) for number in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    if queued:
+        from profiles_api import write_behind
+        write_behind.drain()
+    return time.perf_counter() - start, len(errors)
+
+
+def run_configuration(name, threads, requests):
+    """ Run run_writers in a child process configured as name """
+    with tempfile.TemporaryDirectory() as directory:
+        environ = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE='profiles_project.settings',
+            DATABASE_URL=f'sqlite:///{os.path.join(directory, "bench.sqlite3")}',
+            **CONFIGURATIONS[name],
+        )
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.write_concurrency', '--child', str(threads), str(requests)],
+            env=environ, check=True, capture_output=True, text=True,
+        ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--requests', type=int, default=2000, help='feed POSTs per run')
+    parser.add_argument('--child', type=int, nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        seconds, errors = run_writers(*args.child)
+        print(json.dumps({'seconds': seconds, 'errors': errors}))
+        return
+
+    print(f'{"config":<7} {"threads":>7} {"posts/s":>9} {"errors":>7}')
+    for threads in args.threads:
+        for name in CONFIGURATIONS:
+            result = run_configuration(name, threads, args.requests)
+            print(f'{name:<7} {threads:>7} {args.requests / result["seconds"]:>9.1f} {result["errors"]:>7}')
+
+
+if __name__ == '__main__':
+    main()
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ProfilesApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'profiles_api'
+
+    def ready(self):
+        """ Connect the signal receivers and register the system checks of the app """
+        from profiles_api import checks, retention, signals, write_behind  # noqa: F401
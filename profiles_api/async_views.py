@@ -0,0 +1,227 @@
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.db import close_old_connections
+from django.http import Http404, HttpResponse
+from django.utils.http import http_date
+from rest_framework import exceptions
+from rest_framework.request import Request
+
+from profiles_api import (authentication, caching, db_routers, fieldsets, instrumentation, models, renderers, search,
+                          views)
+
+# Async read handlers for profiles and feed, for deployments running profiles_project.asgi.
+# DRF views are synchronous, so under ASGI a request to them holds a worker thread from the
+# first middleware to the last byte. These views only leave the event loop for the database
+# work itself. Django 3.2 has no async ORM yet, so every handler runs its queries in one
+# sync_to_async call on a pool thread (thread_sensitive=False, so requests don't queue up
+# behind a single thread); the token lookup is answered by the token cache whenever it can.
+#
+# The responses are the ones of the GET (and HEAD) list/retrieve routes of the viewsets: the same
+# throttles (counted in the same sliding windows), ?fields= / ?exclude=, the fast read
+# serializers, and the ETag / Last-Modified validators with the response cache. They are
+# built from the configuration of the viewsets and the functions of their mixins, the
+# viewsets themselves are never instantiated. What differs: the ETags (the url is part of
+# them) and the renderers, these routes only answer JSON.
+
+# where the feed pages carry on once the hot items run out, like UserProfileFeedViewSet
+FEED_ARCHIVE = SimpleNamespace(get_archive_queryset=models.ProfileFeedItemArchive.objects.shaped_like)
+
+
+def run_queries(function, *args, request=None):
+    """ Run function with the ORM on a pool thread, honouring CONN_MAX_AGE like a request does """
+    def wrapper():
+        close_old_connections()
+        try:
+            # counted in the metrics of request
+            with instrumentation.count_queries(request):
+                return function(*args)
+        finally:
+            close_old_connections()
+    return sync_to_async(wrapper, thread_sensitive=False)()
+
+
+async def authenticate(request):
+    """ Return the user of the token in the Authorization header, or None without one """
+    header = request.META.get('HTTP_AUTHORIZATION', '').split()
+    if not header or header[0].lower() != 'token':
+        return None
+    if len(header) != 2:
+        raise exceptions.AuthenticationFailed('Invalid token header.')
+
+    return await authenticate_key(header[1])
+
+
+async def authenticate_key(key):
+    """ Return the user of a token key, raise AuthenticationFailed for an unknown one """
+    cached = authentication.get_token_cache().get(key)
+    if cached is not None:
+        return cached[0]
+    user, _ = await run_queries(authentication.CachedTokenAuthentication().authenticate_credentials, key)
+    return user
+
+
+async def check_throttles(request, throttle_classes):
+    """ Raise Throttled like APIView.check_throttles when a throttle refuses the request """
+    waits = []
+    for throttle in [throttle_class() for throttle_class in throttle_classes]:
+        # a CacheCounterStore hit goes over the network, keep it off the event loop
+        if not await sync_to_async(throttle.allow_request, thread_sensitive=False)(request, None):
+            waits.append(throttle.wait())
+    if waits:
+        raise exceptions.Throttled(max((wait for wait in waits if wait is not None), default=None))
+
+
+def json_response(data, status=200):
+    return HttpResponse(renderers.FastJSONRenderer().render(data), status=status, content_type='application/json')
+
+
+def api_view(require_auth, throttle_classes=()):
+    """ Turn an async handler into a view with token auth, throttles and DRF style errors """
+    def decorator(handler):
+        async def view(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                response = json_response({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+                response['Allow'] = 'GET, HEAD'
+                return response
+            response = await respond(request, *args, **kwargs)
+            if request.method == 'HEAD':
+                # the headers of the GET, without its body
+                response['Content-Length'] = len(response.content)
+                response.content = b''
+            return response
+
+        async def respond(request, *args, **kwargs):
+            try:
+                user = await authenticate(request)
+                if require_auth and user is None:
+                    raise exceptions.NotAuthenticated()
+                drf_request = Request(request)
+                # the throttles count per user, the authenticators of DRF are not run again
+                drf_request.user = user or AnonymousUser()
+                await check_throttles(drf_request, throttle_classes)
+                return await handler(drf_request, *args, **kwargs)
+            except exceptions.APIException as exc:
+                # the body of DRF's exception handler
+                data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+                response = json_response(data, status=exc.status_code)
+                if getattr(exc, 'wait', None):
+                    response['Retry-After'] = '%d' % exc.wait
+                return response
+            except Http404:
+                return json_response({'detail': 'Not found.'}, status=404)
+        view.__name__ = handler.__name__
+        view.__doc__ = handler.__doc__
+        return view
+    return decorator
+
+
+def conditional(request, viewset, build):
+    """ (status, data, headers) of a read, answered like ConditionalGetMixin.conditional_response """
+    etag, last_modified = caching.get_validators(viewset.conditional_models, request, 'json')
+    headers = {'ETag': etag, 'Last-Modified': http_date(last_modified)}
+    if caching.is_not_modified(request, etag, last_modified):
+        return 304, None, headers
+
+    cache = caching.get_cache()
+    data = cache.get(caching.response_key(etag))
+    if data is not None:
+        return 200, data, headers
+    data = build()
+    if db_routers.reads_from_replica():
+        # maybe older than the version in etag, don't let it stand for that version
+        return 200, data, {}
+    cache.set(caching.response_key(etag), data, caching.get_settings()['TTL'])
+    return 200, data, headers
+
+
+def read_response(status, data, headers):
+    """ The HttpResponse of a (status, data, headers) read """
+    response = HttpResponse(status=304) if status == 304 else json_response(data, status=status)
+    for name, value in headers.items():
+        response[name] = value
+    return response
+
+
+def read_queryset(viewset, queryset, request):
+    """ (queryset loading the columns of the fieldset of request, fieldset) """
+    fieldset = fieldsets.parse_fieldset(request.query_params, list(viewset.sparse_fields))
+    return queryset.only(*fieldsets.read_columns(viewset.sparse_fields, viewset.key_columns, fieldset)), fieldset
+
+
+def render_rows(viewset, rows, fieldset, many=False):
+    """ Rows or instances rendered by the fast read serializer of viewset """
+    return viewset.read_serializer_class(rows, many=many, context={'fieldset': fieldset}).data
+
+
+@api_view(require_auth=False, throttle_classes=views.UserProfileViewSet.throttle_classes)
+async def profile_list(request):
+    """ GET /api/async/profile/ """
+    viewset = views.UserProfileViewSet
+
+    def build():
+        queryset, fieldset = read_queryset(viewset, models.UserProfile.objects.all(), request)
+        for backend in viewset.filter_backends:
+            queryset = backend().filter_queryset(request, queryset, viewset)
+        rows = viewset.read_serializer_class.rows(queryset, fieldset, viewset.key_columns)
+        return render_rows(viewset, rows, fieldset, many=True)
+
+    def fetch():
+        status, data, headers = conditional(request, viewset, build)
+        limit = search.ProfileSearchFilter().get_result_limit(request, models.UserProfile.objects.all())
+        if status == 200 and limit is not None:
+            headers = {**headers, 'X-Search-Limit': str(limit)}
+        return status, data, headers
+
+    return read_response(*await run_queries(fetch, request=request))
+
+
+@api_view(require_auth=False, throttle_classes=views.UserProfileViewSet.throttle_classes)
+async def profile_detail(request, pk):
+    """ GET /api/async/profile/{id}/ """
+    viewset = views.UserProfileViewSet
+
+    def build():
+        queryset, fieldset = read_queryset(viewset, models.UserProfile.objects.all(), request)
+        profile = queryset.filter(pk=pk).first()
+        if profile is None:
+            raise Http404
+        return render_rows(viewset, profile, fieldset)
+
+    return read_response(*await run_queries(conditional, request, viewset, build, request=request))
+
+
+@api_view(require_auth=True, throttle_classes=views.UserProfileFeedViewSet.throttle_classes)
+async def feed_list(request):
+    """ GET /api/async/feed/, paginated like /api/feed/ """
+    viewset = views.UserProfileFeedViewSet
+
+    def build():
+        queryset, fieldset = read_queryset(viewset, models.ProfileFeedItem.objects.all(), request)
+        for backend in viewset.filter_backends:
+            queryset = backend().filter_queryset(request, queryset, viewset)
+        paginator = viewset.pagination_class()
+        rows = viewset.read_serializer_class.rows(queryset, fieldset, viewset.key_columns)
+        page = paginator.paginate_queryset(rows, request, FEED_ARCHIVE)
+        return paginator.get_paginated_response(render_rows(viewset, page, fieldset, many=True)).data
+
+    return read_response(*await run_queries(conditional, request, viewset, build, request=request))
+
+
+@api_view(require_auth=True, throttle_classes=views.UserProfileFeedViewSet.throttle_classes)
+async def feed_detail(request, pk):
+    """ GET /api/async/feed/{id}/ """
+    viewset = views.UserProfileFeedViewSet
+
+    def build():
+        queryset, fieldset = read_queryset(viewset, models.ProfileFeedItem.objects.all(), request)
+        item = queryset.filter(pk=pk).first()
+        if item is None:
+            archive, _ = read_queryset(viewset, models.ProfileFeedItemArchive.objects.all(), request)
+            item = archive.filter(pk=pk).first()
+        if item is None:
+            raise Http404
+        return render_rows(viewset, item, fieldset)
+
+    return read_response(*await run_queries(conditional, request, viewset, build, request=request))
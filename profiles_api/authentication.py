@@ -0,0 +1,181 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework.authentication import TokenAuthentication
+
+from profiles_api.metrics import CallbackGauge, registry
+
+DEFAULTS = {
+    # entries kept in the in process tier of every worker
+    'MAX_ENTRIES': 10000,
+    # seconds a token stays cached, this also bounds how long another worker can
+    # keep accepting a token that was revoked through a different worker
+    'TTL': 60,
+    # optional django cache alias shared by all workers, None to disable that tier
+    'CACHE_ALIAS': None,
+    'KEY_PREFIX': 'authtoken',
+}
+
+
+def copy_entry(value):
+    """ A (user, token) pair of its own for one request """
+    # requests on other threads get the same cached pair, and a request changes its user:
+    # check_password rehashes the password, save() writes back the fields it loaded
+    user, token = copy.copy(value[0]), copy.copy(value[1])
+    token.user = user
+    return user, token
+
+
+class TokenCache:
+    """ Two tier cache of token key -> (user, token) """
+    # tier 1 is an in process LRU with a TTL, tier 2 is an optional django cache.
+    # Lookups go tier 1, tier 2 and only then to the database. Every lookup gets copies
+    # of the cached instances (copy_entry), never the cached ones.
+
+    def __init__(self, max_entries, ttl, cache_alias=None, key_prefix='authtoken'):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared = caches[cache_alias] if cache_alias else None
+        self.key_prefix = key_prefix
+        self._entries = OrderedDict()
+        # user id -> token keys of that user in the local tier, used to invalidate by user
+        self._user_keys = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def shared_key(self, key):
+        return f'{self.key_prefix}:{key}'
+
+    def get(self, key):
+        """ Return the cached (user, token) for a token key or None """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return copy_entry(value)
+                self._discard(key)
+
+        if self.shared is not None:
+            value = self.shared.get(self.shared_key(key))
+            if value is not None:
+                self._store(key, value, now)
+                with self._lock:
+                    self.shared_hits += 1
+                return copy_entry(value)
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value):
+        """ Cache the (user, token) pair of a token key """
+        self._store(key, copy_entry(value), time.monotonic())
+        if self.shared is not None:
+            self.shared.set(self.shared_key(key), value, self.ttl)
+
+    def invalidate(self, key):
+        """ Forget a token key in both tiers """
+        with self._lock:
+            self._discard(key)
+        if self.shared is not None:
+            self.shared.delete(self.shared_key(key))
+
+    def invalidate_user(self, user_id, keys=()):
+        """ Forget every cached token of a user, plus the extra keys given """
+        with self._lock:
+            keys = set(keys) | self._user_keys.get(user_id, set())
+            for key in keys:
+                self._discard(key)
+        if self.shared is not None and keys:
+            self.shared.delete_many([self.shared_key(key) for key in keys])
+
+    def clear(self):
+        """ Empty the local tier and reset the counters """
+        with self._lock:
+            self._entries.clear()
+            self._user_keys.clear()
+            self.hits = self.shared_hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """ Hit/miss counters of this process """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+            }
+
+    def _store(self, key, value, now):
+        user_id = value[0].pk
+        with self._lock:
+            self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            self._user_keys.setdefault(user_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self.evictions += 1
+
+    def _discard(self, key):
+        # caller holds the lock
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        user_id = entry[1][0].pk
+        keys = self._user_keys.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._user_keys[user_id]
+
+
+@lru_cache(maxsize=None)
+def get_token_cache():
+    """ Return the token cache of this process """
+    conf = {**DEFAULTS, **getattr(settings, 'PROFILES_TOKEN_CACHE', {})}
+    return TokenCache(conf['MAX_ENTRIES'], conf['TTL'], conf['CACHE_ALIAS'], conf['KEY_PREFIX'])
+
+
+@receiver(setting_changed)
+def reset_token_cache(setting, **kwargs):
+    """ Drop the cached instance when the settings change (tests) """
+    if setting == 'PROFILES_TOKEN_CACHE':
+        get_token_cache.cache_clear()
+
+
+registry.register(CallbackGauge(
+    'profiles_token_cache', 'Hit/miss counters and size of the token cache', 'stat', lambda: get_token_cache().stats()
+))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """ TokenAuthentication that caches the token -> user lookup """
+    # the stock class runs a Token join UserProfile query on every request,
+    # here that query only runs on a cache miss
+
+    def authenticate_credentials(self, key):
+        token_cache = get_token_cache()
+        cached = token_cache.get(key)
+        if cached is not None:
+            return cached
+
+        # raises AuthenticationFailed for unknown tokens and inactive users, those are never cached
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(key, (user, token))
+        return (user, token)
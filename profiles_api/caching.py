@@ -0,0 +1,157 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from profiles_api import db_routers
+
+# Conditional GET and response caching for the read endpoints.
+# Every model the API serves has a version counter in the cache which is bumped on every
+# write to that model (see signals.py and the bulk methods of the managers). The ETag of a
+# response is derived from those counters and the url only, so it is known before running
+# any query: a client sending a matching If-None-Match gets a 304 straight away, and the
+# serialized data of the others is cached under that same ETag. Because a write changes
+# the counter, it changes every ETag, so nothing has to be deleted from the cache.
+#
+# The counters live in the cache given by CACHE_ALIAS. With more than one worker process
+# that has to be a shared cache (redis, memcached), a local memory cache only sees the
+# writes of its own process; `manage.py check --deploy` fails on one (profiles_api.checks).
+#
+# Only successful responses get validators and are cached: a 404 of an object created
+# since would otherwise be revalidated with a 304 until the next write.
+#
+# A request reading from a lagging replica (see profiles_api.db_routers) could build an
+# older body than the counters say, so such bodies are neither cached nor given validators:
+# only reads from the primary populate the cache.
+
+DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    # seconds a serialized response is kept
+    'TTL': 300,
+    'KEY_PREFIX': 'api',
+}
+
+
+def get_settings():
+    """ Response cache settings merged over the defaults """
+    return {**DEFAULTS, **getattr(settings, 'PROFILES_RESPONSE_CACHE', {})}
+
+
+def get_cache():
+    return caches[get_settings()['CACHE_ALIAS']]
+
+
+def version_key(model):
+    return f'{get_settings()["KEY_PREFIX"]}:version:{model._meta.label_lower}'
+
+
+def modified_key(model):
+    return f'{get_settings()["KEY_PREFIX"]}:modified:{model._meta.label_lower}'
+
+
+def bump_version(*models):
+    """ Record a write to the given models, invalidating every response built from them """
+    cache = get_cache()
+    now = time.time()
+    for model in models:
+        try:
+            cache.incr(version_key(model))
+        except ValueError:
+            # not in the cache (first write or evicted), start from a value no earlier counter used
+            cache.set(version_key(model), time.time_ns(), None)
+        cache.set(modified_key(model), now, None)
+
+
+def get_versions(models):
+    """ Return [(version, last modified timestamp)] for the given models """
+    cache = get_cache()
+    keys = [key for model in models for key in (version_key(model), modified_key(model))]
+    values = cache.get_many(keys)
+
+    missing = [key for key in keys if key not in values]
+    if missing:
+        # unknown models get a fresh version, cache.add so concurrent requests agree on it
+        now = time.time()
+        for key in missing:
+            cache.add(key, time.time_ns() if ':version:' in key else now, None)
+        values = cache.get_many(keys)
+
+    return [(values.get(version_key(model)), values.get(modified_key(model))) for model in models]
+
+
+def get_validators(models, request, format):
+    """ Return (etag, last modified timestamp) of a read built from models, without touching the database """
+    versions = get_versions(models)
+    parts = [str(version) for version, _ in versions]
+    # the links in the body (pagination, urls) are absolute
+    parts.append(request.get_host())
+    parts.append(request.get_full_path())
+    parts.append(format)
+    etag = hashlib.md5('|'.join(parts).encode()).hexdigest()
+    last_modified = max(modified or 0 for _, modified in versions)
+    return quote_etag(etag), int(last_modified)
+
+
+def is_not_modified(request, etag, last_modified):
+    """ Evaluate If-None-Match, or If-Modified-Since when there is no If-None-Match """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        # weak comparison, as for every GET
+        return '*' in etags or etag in [tag[2:] if tag.startswith('W/') else tag for tag in etags]
+
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and last_modified <= if_modified_since
+
+
+def response_key(etag):
+    """ Cache key of the serialized data of the response with etag """
+    return f'{get_settings()["KEY_PREFIX"]}:response:{etag}'
+
+
+class ConditionalGetMixin:
+    """ ETag / Last-Modified validators and a versioned response cache for list and retrieve """
+    # models whose writes change the responses of the viewset
+    conditional_models = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
+
+    def get_validators(self, request):
+        """ Return (etag, last modified timestamp) for this request, without touching the database """
+        return get_validators(self.conditional_models, request, request.accepted_renderer.format)
+
+    def is_not_modified(self, request, etag, last_modified):
+        """ Whether the client has the response already """
+        return is_not_modified(request, etag, last_modified)
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request)
+
+        if self.is_not_modified(request, etag, last_modified):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            cache = get_cache()
+            cache_key = response_key(etag)
+            data = cache.get(cache_key)
+            if data is not None:
+                response = Response(data)
+            elif db_routers.reads_from_replica():
+                # maybe older than the version in etag, don't let it stand for that version
+                return handler(request, *args, **kwargs)
+            else:
+                response = handler(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                cache.set(cache_key, response.data, get_settings()['TTL'])
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
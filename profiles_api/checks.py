@@ -0,0 +1,43 @@
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, Tags, register
+
+# System checks of `manage.py check --deploy`.
+# The version counters of the response cache and the timelines have to be seen by every
+# worker process: in a cache of one process, a write made by another worker never reaches
+# it, and it goes on answering 304s and cached bodies of data that has changed since. So do
+# the replica pins, or a client that wrote through one worker reads a lagging replica
+# through the others, and the lock of the retention schedulers, or every process archives.
+
+# caches that are not shared between processes
+PROCESS_LOCAL_CACHES = (LocMemCache, DummyCache)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_caches(app_configs, **kwargs):
+    """ The caches the workers keep in sync through must be shared by them """
+    from profiles_api import caching, db_routers, retention, timeline
+
+    uses = [('PROFILES_RESPONSE_CACHE', caching.get_settings()['CACHE_ALIAS'], caching.get_cache())]
+    backend = timeline.get_backend()
+    if isinstance(backend, timeline.CacheTimelineBackend):
+        uses.append(('PROFILES_TIMELINE', backend.cache_alias, backend.cache))
+    replicas = db_routers.get_settings()
+    if db_routers.get_replicas(replicas):
+        # the read-your-writes pins
+        uses.append(('PROFILES_REPLICAS', replicas['CACHE_ALIAS'], caches[replicas['CACHE_ALIAS']]))
+    archiving = retention.get_settings()
+    if archiving['SCHEDULE_SECONDS']:
+        # the lock letting one of the scheduler threads of the processes archive at a time
+        uses.append(('PROFILES_RETENTION', archiving['CACHE_ALIAS'], caches[archiving['CACHE_ALIAS']]))
+
+    return [
+        Error(
+            f'{setting} uses the {type(cache).__name__} cache {alias!r}, which other worker processes don\'t see.',
+            hint='Point it at a cache shared by every worker, such as redis or memcached.',
+            obj=setting,
+            id='profiles_api.E001',
+        )
+        for setting, alias, cache in uses if isinstance(cache, PROCESS_LOCAL_CACHES)
+    ]
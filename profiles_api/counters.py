@@ -0,0 +1,120 @@
+from django.db.models import Count, F, IntegerField, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+# Denormalized feed counters of a profile: UserProfile.feed_count (its feed items, archived
+# ones included) and UserProfile.last_posted_at (when the newest was created), so showing or
+# sorting by them is a column read instead of a COUNT / MAX over the feed tables.
+#
+# They are kept up to date in the same transaction as the feed write, with UPDATEs computed
+# by the database (feed_count = feed_count + 1), so concurrent writes never overwrite each
+# other's counts: ProfileFeedItem.save() and .delete() for single items, bulk_create_items
+# for the bulk endpoint and the write-behind queue. Archiving moves items without changing
+# either counter. Writes that go around those paths (a queryset .delete(), raw SQL, a
+# restored backup) make them drift; the reconcile_feed_counters command repairs that.
+
+
+def newest_expression():
+    """ The created_on of the newest item of the profile of the row being updated, hot or archived """
+    from profiles_api.models import ProfileFeedItem, ProfileFeedItemArchive
+
+    # archived items are all older than the hot ones, the archive only matters without hot items
+    newest = [
+        Subquery(
+            model.objects.filter(user_profile_id=OuterRef('pk'))
+            .order_by('-created_on', '-id').values('created_on')[:1]
+        )
+        for model in (ProfileFeedItem, ProfileFeedItemArchive)
+    ]
+    return Coalesce(*newest)
+
+
+def count_expression():
+    """ The number of items, hot and archived, of the profile of the row being updated """
+    from profiles_api.models import ProfileFeedItem, ProfileFeedItemArchive
+
+    counts = [
+        Coalesce(Subquery(
+            model.objects.filter(user_profile_id=OuterRef('pk'))
+            .order_by().values('user_profile_id').annotate(count=Count('*')).values('count'),
+            output_field=IntegerField(),
+        ), Value(0))
+        for model in (ProfileFeedItem, ProfileFeedItemArchive)
+    ]
+    return counts[0] + counts[1]
+
+
+def record_posts(items, using):
+    """ Count new feed items in the counters of their profiles, one UPDATE per profile """
+    from profiles_api.models import UserProfile
+
+    per_user = {}
+    for item in items:
+        count, newest = per_user.get(item.user_profile_id, (0, item.created_on))
+        per_user[item.user_profile_id] = (count + 1, max(newest, item.created_on))
+
+    for user_id, (count, newest) in per_user.items():
+        UserProfile.objects.using(using).filter(pk=user_id).update(
+            feed_count=F('feed_count') + count,
+            # a concurrent post may have set a later time already
+            last_posted_at=Greatest(Coalesce(F('last_posted_at'), Value(newest)), Value(newest)),
+        )
+
+
+def record_delete(user_id, using):
+    """ Uncount a deleted feed item, the newest of the remaining ones is looked up """
+    from profiles_api.models import UserProfile
+
+    UserProfile.objects.using(using).filter(pk=user_id).update(
+        # drift could take it below zero, which reconcile then repairs
+        feed_count=Greatest(F('feed_count') - 1, Value(0)),
+        last_posted_at=newest_expression(),
+    )
+
+
+def find_drift(user_ids, using='default'):
+    """ The ids among user_ids whose stored counters don't match their feed items """
+    from profiles_api.models import ProfileFeedItem, ProfileFeedItemArchive, UserProfile
+
+    actual = {user_id: [0, None] for user_id in user_ids}
+    for model in (ProfileFeedItem, ProfileFeedItemArchive):
+        rows = (
+            model.objects.using(using).filter(user_profile_id__in=user_ids).order_by()
+            .values('user_profile_id').annotate(count=Count('*'), newest=Max('created_on'))
+        )
+        for row in rows:
+            counters = actual[row['user_profile_id']]
+            counters[0] += row['count']
+            counters[1] = max(counters[1], row['newest']) if counters[1] else row['newest']
+
+    stored = UserProfile.objects.using(using).filter(pk__in=user_ids).values_list('pk', 'feed_count', 'last_posted_at')
+    return [pk for pk, count, newest in stored if [count, newest] != actual[pk]]
+
+
+def reconcile(batch_size=1000, dry_run=False, using='default', progress=None):
+    """ Repair the counters of every profile, batch by batch, return (profiles checked, repaired) """
+    from profiles_api import caching
+    from profiles_api.models import UserProfile
+
+    checked = repaired = 0
+    last_id = 0
+    while True:
+        user_ids = list(
+            UserProfile.objects.using(using).filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not user_ids:
+            break
+        last_id = user_ids[-1]
+        drifted = find_drift(user_ids, using)
+        if drifted and not dry_run:
+            # recomputed by the UPDATE itself, so a post landing meanwhile is not lost
+            UserProfile.objects.using(using).filter(pk__in=drifted).update(
+                feed_count=count_expression(), last_posted_at=newest_expression(),
+            )
+        checked += len(user_ids)
+        repaired += len(drifted)
+        if progress is not None:
+            progress(checked, repaired)
+
+    if repaired and not dry_run:
+        caching.bump_version(UserProfile)
+    return checked, repaired
@@ -0,0 +1,154 @@
+import hashlib
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+
+# Read replica routing.
+# ReplicaRoutingMiddleware decides per request where reads go: GET/HEAD/OPTIONS requests read
+# from a random replica, everything else (and anything outside a request: management
+# commands, shells, workers) uses the primary. Writes always go to the primary.
+#
+# Replication lags, so a client that just wrote would not see its own write on a replica.
+# After an unsafe request the client is pinned to the primary for PIN_SECONDS: a cache key
+# is set for its token, and safe requests with a pinned token read from the primary too. A
+# login has no token yet, the login view pins the token it hands out. Never the address:
+# behind a proxy or a NAT one client writing would pin every client.
+#
+# The replicas are every alias of DATABASES but the primary unless REPLICAS lists them;
+# see DATABASE_REPLICA_URLS in profiles_project/database.py.
+
+DEFAULTS = {
+    'PRIMARY': 'default',
+    # aliases of the replicas, None for every database but the primary
+    'REPLICAS': None,
+    # seconds a client reads from the primary after writing
+    'PIN_SECONDS': 5,
+    # shared by every worker, or a client pinned by one worker is not pinned on the others
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'db',
+}
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# set by the middleware for the requests allowed to read from a replica
+read_from_replica = ContextVar('read_from_replica', default=False)
+
+
+def get_settings():
+    """ Replica settings merged over the defaults """
+    return {**DEFAULTS, **getattr(settings, 'PROFILES_REPLICAS', {})}
+
+
+def get_replicas(conf=None):
+    conf = conf or get_settings()
+    if conf['REPLICAS'] is not None:
+        return list(conf['REPLICAS'])
+    return [alias for alias in settings.DATABASES if alias != conf['PRIMARY']]
+
+
+def pin_key(token, conf):
+    # hashed, raw tokens don't belong in cache keys
+    return f'{conf["KEY_PREFIX"]}:pin:{hashlib.md5(token.encode()).hexdigest()}'
+
+
+def pin_keys(request, conf):
+    """ Cache keys identifying the client of a request: its token """
+    credentials = request.META.get('HTTP_AUTHORIZATION', '').split()
+    if len(credentials) != 2:
+        return []
+    return [pin_key(credentials[1], conf)]
+
+
+def pin(token):
+    """ Have the requests with this token read from the primary for PIN_SECONDS """
+    conf = get_settings()
+    if get_replicas(conf):
+        caches[conf['CACHE_ALIAS']].set(pin_key(token, conf), True, conf['PIN_SECONDS'])
+
+
+class ReplicaRouter:
+    """ Reads of replica enabled requests to a replica, everything else to the primary """
+
+    def db_for_read(self, model, **hints):
+        conf = get_settings()
+        primary = conf['PRIMARY']
+        if not read_from_replica.get() or connections[primary].in_atomic_block:
+            # inside a transaction reads have to see its writes
+            return primary
+        replicas = get_replicas(conf)
+        return random.choice(replicas) if replicas else primary
+
+    def db_for_write(self, model, **hints):
+        return get_settings()['PRIMARY']
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # every database holds the same data
+        conf = get_settings()
+        databases = {conf['PRIMARY'], *get_replicas(conf)}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+def reads_from_replica():
+    """ Whether the reads of the current request go to a replica """
+    return read_from_replica.get() and bool(get_replicas())
+
+
+class ReplicaRoutingMiddleware:
+    """ Let safe requests of clients that didn't just write read from the replicas """
+    # async capable like InstrumentationMiddleware, the context variable reaches the views
+    # through sync_to_async
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        conf = get_settings()
+        if not get_replicas(conf):
+            return self.get_response(request)
+
+        cache = caches[conf['CACHE_ALIAS']]
+        keys = pin_keys(request, conf)
+        safe = request.method in SAFE_METHODS
+        replica = safe and not (keys and cache.get_many(keys))
+        token = read_from_replica.set(replica)
+        try:
+            response = self.get_response(request)
+        finally:
+            read_from_replica.reset(token)
+
+        if not safe and keys:
+            cache.set_many({key: True for key in keys}, conf['PIN_SECONDS'])
+        return response
+
+    async def __acall__(self, request):
+        conf = get_settings()
+        if not get_replicas(conf):
+            return await self.get_response(request)
+
+        cache = caches[conf['CACHE_ALIAS']]
+        keys = pin_keys(request, conf)
+        safe = request.method in SAFE_METHODS
+        # the cache may be a network round trip, not on the event loop
+        replica = safe and not (keys and await sync_to_async(cache.get_many, thread_sensitive=False)(keys))
+        token = read_from_replica.set(replica)
+        try:
+            response = await self.get_response(request)
+        finally:
+            read_from_replica.reset(token)
+
+        if not safe and keys:
+            await sync_to_async(cache.set_many, thread_sensitive=False)({key: True for key in keys}, conf['PIN_SECONDS'])
+        return response
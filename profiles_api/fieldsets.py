@@ -0,0 +1,91 @@
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS
+
+# Sparse fieldsets for the read endpoints.
+# GET /api/feed/?fields=id,status_text renders only those keys of every item, and
+# ?exclude=created_on every key but those. The names are checked against the allow-list of
+# the view (sparse_fields, field name -> column): an unknown name is a 400, not silently
+# ignored, so a typo doesn't look like a missing value. The queryset then only loads the
+# columns of the chosen fields plus the key columns the view always needs (the primary key,
+# the pagination key), so a smaller fieldset means a smaller SELECT as well as a smaller body.
+#
+# The fieldset of the actions in sparse_actions reaches the serializers as
+# context['fieldset'], a tuple of field names in the order of the allow-list, or None for
+# every field. Writes ignore it: a POST or a PATCH answers with the whole object, as before.
+
+
+def parse_fieldset(query_params, allowed):
+    """ The field names chosen by ?fields= or ?exclude=, None when neither is given """
+    fields = query_params.get('fields')
+    exclude = query_params.get('exclude')
+    if fields is None and exclude is None:
+        return None
+    if fields is not None and exclude is not None:
+        raise ValidationError({'fields': ['Use either fields or exclude, not both.']})
+
+    param = 'fields' if fields is not None else 'exclude'
+    names = {name.strip() for name in query_params[param].split(',') if name.strip()}
+    if not names:
+        raise ValidationError({param: ['Name at least one field.']})
+    unknown = sorted(names.difference(allowed))
+    if unknown:
+        raise ValidationError({param: [
+            f'Unknown fields: {", ".join(unknown)}. Choose from {", ".join(allowed)}.'
+        ]})
+
+    if param == 'fields':
+        return tuple(name for name in allowed if name in names)
+    return tuple(name for name in allowed if name not in names)
+
+
+def read_columns(sparse_fields, key_columns, fieldset):
+    """ The key columns and the columns of the fields of fieldset (every field for None) """
+    columns = list(key_columns)
+    for name, column in sparse_fields.items():
+        if (fieldset is None or name in fieldset) and column not in columns:
+            columns.append(column)
+    return columns
+
+
+class SparseFieldsetSerializerMixin:
+    """ Leave out the fields missing from context['fieldset'] """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        fieldset = self.context.get('fieldset')
+        if fieldset is not None:
+            for name in list(self.fields):
+                if name not in fieldset:
+                    self.fields.pop(name)
+
+
+class SparseFieldsetMixin:
+    """ ?fields= / ?exclude= on the safe requests of a model viewset """
+    # field name -> column, the fields a client may choose from
+    sparse_fields = {}
+    # columns loaded whatever the fieldset
+    key_columns = ('id',)
+    # the viewset actions rendering sparse_fields, other actions ignore ?fields=
+    sparse_actions = ('list', 'retrieve')
+
+    def get_fieldset(self):
+        """ Tuple of the chosen field names, None for all of them, on writes and other actions """
+        if self.request.method not in SAFE_METHODS or self.action not in self.sparse_actions:
+            return None
+        if not hasattr(self, '_fieldset'):
+            self._fieldset = parse_fieldset(self.request.query_params, list(self.sparse_fields))
+        return self._fieldset
+
+    def get_read_columns(self):
+        """ Columns to load for the fieldset of the request """
+        return read_columns(self.sparse_fields, self.key_columns, self.get_fieldset())
+
+    def get_queryset(self):
+        """ Only load the columns of the fieldset (or of every allowed field) on reads """
+        queryset = super().get_queryset()
+        if self.request.method in SAFE_METHODS:
+            queryset = queryset.only(*self.get_read_columns())
+        return queryset
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), 'fieldset': self.get_fieldset()}
@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from profiles_api.metrics import registry
+
+# Bounded password hashing.
+# PBKDF2 & co are made to be slow, and run inline they are what limits how many logins
+# and signups a worker can take. Here every hash and check runs in a bounded pool:
+#   - 'thread' pool: hashlib releases the GIL while hashing, so WORKERS threads hash in
+#     parallel while the other request threads keep the interpreter
+#   - 'process' pool: for hashers that hold the GIL (e.g. pure python ones)
+# The calling thread waits for its hash, the pool frees no request thread: what it does is
+# cap the cores spent on hashing at WORKERS, so a burst of logins can't starve the other
+# requests. At most MAX_PENDING hashes can be queued, after that HashingBusy is raised
+# instead of piling up behind the pool; the api answers it with a 503
+# (views.HashingBusyMixin), management commands and the shell just see the exception.
+#
+# Which algorithm and work factor is used is Django's PASSWORD_HASHERS setting. When a
+# user logs in with a password stored with another algorithm or an older work factor it
+# is rehashed with the current one (see UserProfile.check_password).
+
+DEFAULTS = {
+    'POOL': 'thread',
+    'WORKERS': os.cpu_count() or 2,
+    'MAX_PENDING': 64,
+    # seconds a request waits for a slot in the pool
+    'TIMEOUT': 5,
+}
+
+hash_seconds = registry.histogram(
+    'profiles_password_hash_seconds',
+    'Time spent hashing or checking passwords, including the wait for the pool',
+    labelnames=('endpoint', 'operation'),
+)
+
+# endpoint the password work is done for, set by the views for the latency metric
+current_endpoint = ContextVar('password_hashing_endpoint', default='other')
+
+
+class HashingBusy(Exception):
+    """ Every slot of the hashing pool is taken """
+
+
+def get_settings():
+    """ Hashing settings merged over the defaults """
+    return {**DEFAULTS, **getattr(settings, 'PROFILES_PASSWORD_HASHING', {})}
+
+
+def init_process():
+    """ Set Django up in pool processes started with spawn """
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+
+
+@lru_cache(maxsize=None)
+def get_pool():
+    """ Return (executor, semaphore) of this process, created on first use """
+    conf = get_settings()
+    if conf['POOL'] == 'process':
+        # imports multiprocessing, which workers using the thread pool never need
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=conf['WORKERS'], initializer=init_process)
+    else:
+        executor = ThreadPoolExecutor(max_workers=conf['WORKERS'], thread_name_prefix='password-hashing')
+    return executor, threading.BoundedSemaphore(conf['MAX_PENDING'])
+
+
+@receiver(setting_changed)
+def reset_pool(setting, **kwargs):
+    """ Start a new pool when the settings change (tests) """
+    if setting == 'PROFILES_PASSWORD_HASHING':
+        get_pool.cache_clear()
+
+
+@contextmanager
+def endpoint(name):
+    """ Label the password work done inside the block with an endpoint name """
+    token = current_endpoint.set(name)
+    try:
+        yield
+    finally:
+        current_endpoint.reset(token)
+
+
+def run_in_pool(operation, function, *args):
+    """ Run function(*args) in the hashing pool and record how long it took """
+    executor, slots = get_pool()
+    start = time.perf_counter()
+    if not slots.acquire(timeout=get_settings()['TIMEOUT']):
+        raise HashingBusy()
+    try:
+        return executor.submit(function, *args).result()
+    finally:
+        slots.release()
+        hash_seconds.observe(time.perf_counter() - start, endpoint=current_endpoint.get(), operation=operation)
+
+
+def verify(raw_password, encoded):
+    """ Return (is_correct, must_update) for a password and its stored hash """
+    # the setter is only called by django when the password is correct and the hash is outdated
+    outdated = []
+    is_correct = hashers.check_password(raw_password, encoded, setter=outdated.append)
+    return is_correct, bool(outdated)
+
+
+def make_password(raw_password):
+    """ Hash a password with the preferred hasher, in the pool """
+    if raw_password is None:
+        # unusable password, nothing to compute
+        return hashers.make_password(None)
+    return run_in_pool('hash', hashers.make_password, raw_password)
+
+
+def check_password(raw_password, encoded):
+    """ Return (is_correct, must_update) for a password, checked in the pool """
+    if raw_password is None or not hashers.is_password_usable(encoded):
+        return False, False
+    return run_in_pool('check', verify, raw_password, encoded)
@@ -0,0 +1,243 @@
+import csv
+import json
+import os
+import time
+from collections import namedtuple
+
+from django.contrib.auth import hashers
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+
+from profiles_api import caching, hashing, search
+
+# Bulk import of user profiles, run by the import_profiles command.
+# UserProfileManager.create_user does one password hash and one INSERT per profile, one after
+# the other, and the hash (PBKDF2, made to be slow) is nearly all of the time. Here:
+#   - the input (CSV with a header line, or NDJSON) is read as a stream, batch by batch, so
+#     the size of the file doesn't matter
+#   - every row is checked like create_user would: normalize_email, a valid email, a name
+#   - the passwords of a batch are hashed in a process pool, one hash per core, while the
+#     previous batch is being inserted
+#   - a batch is inserted with one bulk_create in its own transaction
+# Rows that can't be imported don't stop the import, they are reported with their line
+# number: invalid ones, and duplicates of an email earlier in the input or already in the
+# database (the unique index on email). A profile signing up while the import runs is
+# caught by the index, the batch is then retried row by row to find the duplicate.
+#
+# bulk_create sends no post_save signals, so what the receivers of profiles_api.signals do
+# for a new profile is done here: the profiles are added to the search index and the cached
+# profile responses are invalidated. New profiles have no tokens and no feed items, neither
+# the token cache nor the feed counters need anything.
+
+FORMATS = ('csv', 'ndjson')
+
+ImportResult = namedtuple('ImportResult', 'read created duplicates invalid')
+
+
+class Reject(namedtuple('Reject', 'line email reason')):
+    """ A row that was not imported """
+
+    def __str__(self):
+        return f'line {self.line}: {self.email or "-"}: {self.reason}'
+
+
+def guess_format(path):
+    """ The format of an input file from its extension """
+    return 'ndjson' if os.path.splitext(path)[1].lower() in ('.ndjson', '.jsonl', '.json') else 'csv'
+
+
+def read_records(stream, format='csv'):
+    """ (line number, record or None when unreadable) for every row of a text stream """
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+        return
+
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield line_number, record if isinstance(record, dict) else None
+
+
+def clean(record):
+    """ (email, name, password) of a record, raise ValidationError when it can't be imported """
+    from profiles_api.models import UserProfile
+
+    if record is None:
+        raise ValidationError('unreadable row')
+    email, name, password = (record.get(key) for key in ('email', 'name', 'password'))
+    if not isinstance(email, str) or not email.strip():
+        raise ValidationError('missing email')
+    email = UserProfile.objects.normalize_email(email.strip())
+    validate_email(email)
+    if not isinstance(name, str) or not name.strip():
+        raise ValidationError('missing name')
+    for field, value in (('email', email), ('name', name)):
+        max_length = UserProfile._meta.get_field(field).max_length
+        if len(value) > max_length:
+            raise ValidationError(f'{field} longer than {max_length} characters')
+    if password is not None and not isinstance(password, str):
+        raise ValidationError('password must be a string')
+    # an empty password gets an unusable one, like create_user(password=None)
+    return email, name.strip(), password or None
+
+
+def hash_passwords(executor, workers, passwords):
+    """ Start hashing passwords, return a function waiting for the hashes in the same order """
+    raw = [password for password in passwords if password is not None]
+    if executor is None:
+        hashed = iter([hashers.make_password(password) for password in raw])
+    else:
+        # map submits everything now, the hashes are computed while the caller goes on;
+        # a few tasks per worker keep them all busy without one pickle per password
+        hashed = executor.map(hashers.make_password, raw, chunksize=max(1, len(raw) // (workers * 4)))
+
+    def wait():
+        return [next(hashed) if password is not None else hashers.make_password(None) for password in passwords]
+    return wait
+
+
+def batches(records, size):
+    """ Lists of size records, the last one shorter """
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def insert(profiles, using):
+    """ Insert a batch of profiles, return (created ones, duplicates) """
+    from profiles_api.models import UserProfile
+
+    try:
+        with transaction.atomic(using=using):
+            UserProfile.objects.using(using).bulk_create(profiles)
+        return profiles, []
+    except IntegrityError:
+        pass
+
+    # an email was taken since we checked, find out which one
+    created, duplicates = [], []
+    for profile in profiles:
+        try:
+            with transaction.atomic(using=using):
+                UserProfile.objects.using(using).bulk_create([profile])
+            created.append(profile)
+        except IntegrityError:
+            duplicates.append(profile)
+    return created, duplicates
+
+
+def index(profiles, using):
+    """ Add new profiles to the search index, what the post_save receiver would have done """
+    from profiles_api.models import UserProfile
+
+    backend = search.get_backend(using)
+    if backend is None or not profiles:
+        return
+    # bulk_create doesn't set the ids on every database, read them back
+    backend.index_many(
+        UserProfile.objects.using(using).filter(email__in=[profile.email for profile in profiles]).only('id', 'name', 'email'),
+        using=using,
+    )
+
+
+def import_profiles(records, batch_size=500, workers=None, using='default', dry_run=False, progress=None, reject=None):
+    """ Create profiles from (line number, record) pairs, return an ImportResult """
+    from profiles_api.models import UserProfile
+
+    read = created = duplicates = invalid = 0
+    seen = set()
+    executor = None
+    if workers is None:
+        workers = os.cpu_count() or 2
+    if workers and not dry_run:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=hashing.init_process)
+
+    def report(line, email, reason):
+        if reject is not None:
+            reject(Reject(line, email, reason))
+
+    def flush(batch):
+        """ Insert a batch whose passwords are being hashed """
+        nonlocal created, duplicates
+        rows, wait = batch
+        profiles = [
+            UserProfile(email=email, name=name, password=password)
+            for (line, email, name), password in zip(rows, wait())
+        ]
+        done, taken = insert(profiles, using)
+        index(done, using)
+        if done:
+            caching.bump_version(UserProfile)
+        lines = {email: line for line, email, name in rows}
+        for profile in taken:
+            report(lines[profile.email], profile.email, 'email already taken')
+        created += len(done)
+        duplicates += len(taken)
+
+    def process(chunk):
+        """ Check a chunk of rows, start hashing the passwords of the ones to import """
+        nonlocal created, duplicates, invalid
+        rows = []
+        for line, record in chunk:
+            try:
+                email, name, password = clean(record)
+            except ValidationError as error:
+                invalid += 1
+                report(line, (record or {}).get('email'), error.messages[0])
+                continue
+            if email in seen:
+                duplicates += 1
+                report(line, email, 'duplicate email in the input')
+                continue
+            seen.add(email)
+            rows.append((line, email, name, password))
+
+        taken = set(
+            UserProfile.objects.using(using).filter(email__in=[row[1] for row in rows]).values_list('email', flat=True)
+        )
+        for line, email, name, password in rows:
+            if email in taken:
+                duplicates += 1
+                report(line, email, 'email already taken')
+        rows = [row for row in rows if row[1] not in taken]
+        if dry_run:
+            # the ones that would be created
+            created += len(rows)
+            return None
+        return [row[:3] for row in rows], hash_passwords(executor, workers, [row[3] for row in rows])
+
+    start = time.perf_counter()
+    pending = None
+    try:
+        for chunk in batches(records, batch_size):
+            read += len(chunk)
+            batch = process(chunk)
+            # this batch is being hashed while the previous one is inserted
+            if pending is not None:
+                flush(pending)
+            pending = batch
+            if progress is not None:
+                progress(ImportResult(read, created, duplicates, invalid), time.perf_counter() - start)
+        if pending is not None:
+            flush(pending)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    result = ImportResult(read, created, duplicates, invalid)
+    if progress is not None:
+        progress(result, time.perf_counter() - start)
+    return result
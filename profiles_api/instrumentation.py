@@ -0,0 +1,297 @@
+import hmac
+import os
+import random
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+from profiles_api import query_plans
+from profiles_api.metrics import registry
+
+# Per request timings, split by phase.
+#   auth        TokenAuthentication (CachedTokenAuthentication)
+#   permission  the permission classes, object permissions included
+#   db          time spent inside SQL queries, and how many there were
+#   serialize   the rest of the view: serializers, pagination, view logic
+#   render      turning response.data into bytes with the renderer
+# The middleware times the request and the queries, the view mixin times the DRF phases.
+# Everything ends up in profiles_api.metrics and is served as Prometheus text by metrics_view,
+# to staff users and to scrapers sending `Authorization: Bearer <METRICS_TOKEN>`. The address
+# alone proves nothing: behind a reverse proxy on the host every request comes from 127.0.0.1.
+# At dev time EXPLAIN_QUERIES logs the table scans and sorts in the plans of the queries of
+# every request, with the index that would avoid them (see profiles_api.query_plans).
+
+DEFAULTS = {
+    # clients allowed to read /api/metrics/, with the token or as staff
+    'ALLOWED_IPS': ('127.0.0.1', '::1'),
+    # bearer token of the scrapers of /api/metrics/, None for staff users only
+    'METRICS_TOKEN': None,
+    # add Server-Timing and X-Query-Count headers to responses
+    'SERVER_TIMING_HEADER': False,
+    # fraction of requests run under cProfile, their stats are dumped if they are slow
+    'PROFILE_SAMPLE_RATE': 0.0,
+    'SLOW_REQUEST_SECONDS': 1.0,
+    'PROFILE_DIR': None,
+    # explain every query and log the bad plans, doubles the queries: never in production
+    'EXPLAIN_QUERIES': False,
+}
+
+PHASES = ('auth', 'permission', 'db', 'serialize', 'render')
+
+request_seconds = registry.histogram(
+    'profiles_http_request_seconds', 'Request duration', labelnames=('route', 'method', 'status'),
+)
+phase_seconds = registry.histogram(
+    'profiles_http_phase_seconds', 'Time spent per phase of a request', labelnames=('route', 'method', 'phase'),
+)
+request_queries = registry.histogram(
+    'profiles_http_request_queries', 'SQL queries per request', labelnames=('route', 'method'),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+profiled_requests = registry.counter(
+    'profiles_http_profiled_requests_total', 'Requests run under cProfile', labelnames=('route', 'dumped'),
+)
+
+
+def get_settings():
+    """ Instrumentation settings merged over the defaults """
+    return {**DEFAULTS, **getattr(settings, 'PROFILES_INSTRUMENTATION', {})}
+
+
+class RequestStats:
+    """ Timings of one request """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        # phase -> (seconds, seconds of it spent in queries)
+        self.phases = {}
+        self.duration = 0.0
+        # cProfile.Profile of a sampled request
+        self.profiler = None
+        # the queries, with EXPLAIN_QUERIES
+        self.recorded = None
+        # threads whose connections count the queries of the request, see count_queries
+        self.threads = set()
+
+    def add(self, name, seconds, db_seconds=0.0):
+        total, db_total = self.phases.get(name, (0.0, 0.0))
+        self.phases[name] = (total + seconds, db_total + db_seconds)
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook, runs around every query
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+    def breakdown(self):
+        """ Seconds per phase of PHASES """
+        auth, auth_db = self.phases.get('auth', (0.0, 0.0))
+        permission, permission_db = self.phases.get('permission', (0.0, 0.0))
+        view, view_db = self.phases.get('view', (0.0, 0.0))
+        render, _ = self.phases.get('render', (0.0, 0.0))
+        # auth and permission time include their own queries, the db phase has them all
+        return {
+            'auth': auth - auth_db,
+            'permission': permission - permission_db,
+            'db': self.db_time,
+            'serialize': max(view - auth - permission - (view_db - auth_db - permission_db), 0.0),
+            'render': render,
+        }
+
+
+def get_stats(request):
+    """ RequestStats of a django or DRF request, None if the middleware is not installed """
+    request = getattr(request, '_request', request)
+    return getattr(request, 'instrumentation', None)
+
+
+@contextmanager
+def phase(request, name):
+    """ Time the block as a phase of the request """
+    stats = get_stats(request)
+    if stats is None:
+        yield
+        return
+    start, db_start = time.perf_counter(), stats.db_time
+    try:
+        yield
+    finally:
+        stats.add(name, time.perf_counter() - start, stats.db_time - db_start)
+
+
+@contextmanager
+def count_queries(request):
+    """ Time (and record) the queries of request run by this thread inside the block """
+    # connections are per thread: under ASGI the middleware runs on the event loop and the
+    # views on other threads, so the view mixin and the async views count theirs themselves
+    stats = get_stats(request)
+    thread = threading.get_ident()
+    if stats is None or thread in stats.threads:
+        yield
+        return
+    stats.threads.add(thread)
+    queries = None
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            if stats.recorded is not None:
+                queries = stack.enter_context(query_plans.record_queries())
+            yield
+    finally:
+        stats.threads.discard(thread)
+        if queries:
+            stats.recorded.extend(queries)
+
+
+def route_of(request):
+    """ Label of the url pattern of a request, e.g. userprofilefeeditem-list """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match.route or 'unnamed'
+
+
+class InstrumentationMiddleware:
+    """ Record per route timings, query counts and sampled profiles of every request """
+    # async capable: under ASGI a sync only middleware first in the chain would make django
+    # run every request through sync_to_async, on the one thread it shares with every request
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        conf = get_settings()
+        with self.measure(request, conf) as stats:
+            response = self.get_response(request)
+        if stats.recorded:
+            query_plans.log_problems(stats.recorded, f'{request.method} {route_of(request)}')
+        return self.record(request, response, stats, conf)
+
+    async def __acall__(self, request):
+        conf = get_settings()
+        with self.measure(request, conf) as stats:
+            response = await self.get_response(request)
+        if stats.recorded:
+            # explaining runs queries, which django doesn't allow on the event loop
+            await sync_to_async(query_plans.log_problems)(stats.recorded, f'{request.method} {route_of(request)}')
+        return self.record(request, response, stats, conf)
+
+    @contextmanager
+    def measure(self, request, conf):
+        """ Time the block and its queries, profile it if sampled, record its queries with EXPLAIN_QUERIES """
+        stats = request.instrumentation = RequestStats()
+        if conf['PROFILE_SAMPLE_RATE'] and random.random() < conf['PROFILE_SAMPLE_RATE']:
+            import cProfile
+            stats.profiler = cProfile.Profile()
+
+        if conf['EXPLAIN_QUERIES']:
+            # the queries of a streaming response run later, while it is sent, they are not seen here
+            stats.recorded = []
+
+        start = time.perf_counter()
+        with count_queries(request):
+            if stats.profiler is not None:
+                stats.profiler.enable()
+            try:
+                yield stats
+            finally:
+                if stats.profiler is not None:
+                    stats.profiler.disable()
+        stats.duration = time.perf_counter() - start
+
+    def record(self, request, response, stats, conf):
+        """ Observe the metrics of a finished request, add the Server-Timing header """
+        route, method = route_of(request), request.method
+        request_seconds.observe(stats.duration, route=route, method=method, status=str(response.status_code))
+        request_queries.observe(stats.queries, route=route, method=method)
+        breakdown = stats.breakdown()
+        for name, seconds in breakdown.items():
+            phase_seconds.observe(seconds, route=route, method=method, phase=name)
+
+        if stats.profiler is not None:
+            self.save_profile(stats.profiler, route, stats.duration, conf)
+
+        if conf['SERVER_TIMING_HEADER']:
+            response['Server-Timing'] = ', '.join(
+                f'{name};dur={seconds * 1000:.2f}' for name, seconds in breakdown.items()
+            ) + f', total;dur={stats.duration * 1000:.2f}'
+            response['X-Query-Count'] = str(stats.queries)
+
+        return response
+
+    def process_template_response(self, request, response):
+        """ DRF responses are rendered after the view returns, time that as the render phase """
+        stats = getattr(request, 'instrumentation', None)
+        if stats is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                stats.add('render', time.perf_counter() - start)
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    @staticmethod
+    def save_profile(profiler, route, duration, conf):
+        """ Dump the cProfile stats of a slow request to PROFILE_DIR """
+        slow = duration >= conf['SLOW_REQUEST_SECONDS'] and conf['PROFILE_DIR']
+        if slow:
+            os.makedirs(conf['PROFILE_DIR'], exist_ok=True)
+            filename = f'{route}-{int(time.time() * 1000)}-{duration * 1000:.0f}ms.prof'
+            profiler.dump_stats(os.path.join(conf['PROFILE_DIR'], filename))
+        profiled_requests.inc(route=route, dumped='true' if slow else 'false')
+
+
+class InstrumentedViewMixin:
+    """ Time the auth, permission and view phases of a DRF view """
+
+    def dispatch(self, request, *args, **kwargs):
+        with count_queries(request), phase(request, 'view'):
+            return super().dispatch(request, *args, **kwargs)
+
+    def perform_authentication(self, request):
+        with phase(request, 'auth'):
+            super().perform_authentication(request)
+
+    def check_permissions(self, request):
+        with phase(request, 'permission'):
+            super().check_permissions(request)
+
+    def check_object_permissions(self, request, obj):
+        with phase(request, 'permission'):
+            super().check_object_permissions(request, obj)
+
+
+def may_read_metrics(request, conf):
+    """ Whether the request carries the metrics token or comes from a staff user """
+    token = conf['METRICS_TOKEN']
+    credentials = request.META.get('HTTP_AUTHORIZATION', '').split()
+    if token and len(credentials) == 2 and credentials[0].lower() == 'bearer':
+        return hmac.compare_digest(credentials[1].encode(), token.encode())
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_active and user.is_staff
+
+
+def metrics_view(request):
+    """ All metrics of this process in the Prometheus text format """
+    conf = get_settings()
+    if request.META.get('REMOTE_ADDR') not in conf['ALLOWED_IPS'] or not may_read_metrics(request, conf):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from profiles_api import retention
+
+
+class Command(BaseCommand):
+    help = (
+        'Move feed items older than the retention threshold (PROFILES_RETENTION ARCHIVE_AFTER_DAYS) '
+        'to the archive table, in short batches. Safe to run while the api is serving requests.'
+    )
+
+    def add_arguments(self, parser):
+        conf = retention.get_settings()
+        parser.add_argument('--days', type=int, default=conf['ARCHIVE_AFTER_DAYS'], help='archive items older than this')
+        parser.add_argument('--batch-size', type=int, default=conf['BATCH_SIZE'])
+        parser.add_argument('--max-batches', type=int, help='stop after this many batches')
+        parser.add_argument('--pause', type=float, default=conf['PAUSE_SECONDS'], help='seconds between batches')
+        parser.add_argument('--dry-run', action='store_true', help='only count the items to archive')
+
+    def handle(self, *args, **options):
+        from profiles_api.models import ProfileFeedItem
+
+        cutoff = retention.get_cutoff(options['days'])
+        if options['dry_run']:
+            count = ProfileFeedItem.objects.filter(created_on__lt=cutoff).count()
+            self.stdout.write(f'{count} feed items created before {cutoff:%Y-%m-%d %H:%M} would be archived')
+            return
+
+        moved = retention.archive(
+            days=options['days'],
+            batch_size=options['batch_size'],
+            max_batches=options['max_batches'],
+            pause=options['pause'],
+            progress=lambda moved: self.stdout.write(f'\r{moved} archived', ending='') if options['verbosity'] else None,
+        )
+        self.stdout.write(self.style.SUCCESS(f'\narchived {moved} feed items created before {cutoff:%Y-%m-%d %H:%M}'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from profiles_api import write_behind
+
+
+class Command(BaseCommand):
+    help = (
+        'Write the feed items waiting in the write-behind queue (PROFILES_WRITE_BEHIND PATH) to the '
+        'database, e.g. after a crash. Safe to run while servers are draining the same queue.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=write_behind.get_settings()['BATCH_SIZE'])
+
+    def handle(self, *args, **options):
+        conf = write_behind.get_settings()
+        queue = write_behind.FeedQueue(conf['PATH'], conf['MAX_PENDING'], conf['CLAIM_TIMEOUT'])
+        try:
+            self.stdout.write(f'{queue.count()} feed items queued in {queue.path}')
+            written = write_behind.drain(queue, options['batch_size'])
+        finally:
+            queue.close()
+        self.stdout.write(self.style.SUCCESS(f'wrote {written} feed items'))
@@ -0,0 +1,66 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from profiles_api import importing
+
+
+class Command(BaseCommand):
+    help = (
+        'Create user profiles from a CSV file (with an email,name,password header) or an NDJSON file '
+        '(one {"email", "name", "password"} object per line), - reads stdin. Passwords are hashed in a '
+        'process pool and profiles inserted in batches. Invalid rows and emails already taken are '
+        'reported on stderr and skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='input file, - for stdin')
+        parser.add_argument('--format', choices=importing.FORMATS, help='default: from the file extension, csv for stdin')
+        parser.add_argument('--batch-size', type=int, default=500, help='profiles inserted per batch')
+        parser.add_argument('--workers', type=int, help='password hashing processes, default one per core, 0 hashes inline')
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--dry-run', action='store_true', help='only check the rows, nothing is hashed or created')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or ('csv' if path == '-' else importing.guess_format(path))
+        verbosity = options['verbosity']
+        # whether the cursor is at the end of a progress line
+        on_progress_line = False
+
+        def progress(result, seconds):
+            nonlocal on_progress_line
+            if verbosity:
+                on_progress_line = True
+                self.stdout.write(
+                    f'\r{result.read} read, {result.created} created, {result.duplicates} duplicates, '
+                    f'{result.invalid} invalid, {result.read / seconds if seconds else 0:.0f} rows/s',
+                    ending='',
+                )
+
+        def reject(row):
+            nonlocal on_progress_line
+            if verbosity:
+                self.stderr.write(f'\n{row}' if on_progress_line else str(row))
+                on_progress_line = False
+
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            result = importing.import_profiles(
+                importing.read_records(stream, format),
+                batch_size=options['batch_size'],
+                workers=options['workers'],
+                using=options['database'],
+                dry_run=options['dry_run'],
+                progress=progress,
+                reject=reject,
+            )
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        action = 'would be created' if options['dry_run'] else 'created'
+        self.stdout.write(self.style.SUCCESS(
+            f'\n{result.read} rows read, {result.created} profiles {action}, '
+            f'{result.duplicates} duplicates and {result.invalid} invalid rows skipped'
+        ))
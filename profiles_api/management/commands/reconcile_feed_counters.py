@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from profiles_api import counters
+
+
+class Command(BaseCommand):
+    help = (
+        'Check the feed_count and last_posted_at of every profile against its feed items, hot and '
+        'archived, and repair the ones that drifted. Runs in batches of profiles, safe while the api '
+        'is serving requests.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='profiles checked per batch')
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--dry-run', action='store_true', help='only count the profiles that drifted')
+
+    def handle(self, *args, **options):
+        checked, drifted = counters.reconcile(
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+            using=options['database'],
+            progress=lambda checked, drifted: self.stdout.write(
+                f'\r{checked} checked, {drifted} drifted', ending=''
+            ) if options['verbosity'] else None,
+        )
+        action = 'would be repaired' if options['dry_run'] else 'repaired'
+        self.stdout.write(self.style.SUCCESS(f'\n{checked} profiles checked, {drifted} {action}'))
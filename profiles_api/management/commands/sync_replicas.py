@@ -0,0 +1,47 @@
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from profiles_api import db_routers
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the primary SQLite database to the SQLite replicas, a stand in for replication '
+        'to try the replica routing locally. With --interval it copies again every few seconds, '
+        'which behaves like a replica lagging behind.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, help='keep copying, every this many seconds')
+
+    def handle(self, *args, **options):
+        conf = db_routers.get_settings()
+        primary = connections[conf['PRIMARY']]
+        replicas = [connections[alias] for alias in db_routers.get_replicas(conf)]
+        if not replicas:
+            raise CommandError('no replicas configured, set DATABASE_REPLICA_URLS')
+        for connection in [primary, *replicas]:
+            if connection.vendor != 'sqlite' or connection.is_in_memory_db():
+                raise CommandError(f'{connection.alias} is not an SQLite file, use real replication for it')
+
+        while True:
+            start = time.perf_counter()
+            source = sqlite3.connect(primary.settings_dict['NAME'])
+            try:
+                for replica in replicas:
+                    target = sqlite3.connect(replica.settings_dict['NAME'])
+                    try:
+                        # online backup, consistent even while the primary is being written to
+                        source.backup(target)
+                    finally:
+                        target.close()
+            finally:
+                source.close()
+            self.stdout.write(f'copied to {len(replicas)} replicas in {time.perf_counter() - start:.2f}s')
+
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
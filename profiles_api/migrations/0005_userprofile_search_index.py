@@ -0,0 +1,49 @@
+from django.db import migrations
+
+# copies of profiles_api.search.FTS_TABLE and PG_DOCUMENT as they were when this migration was
+# written: the app may rename them, this migration must go on creating what it created
+FTS_TABLE = 'profiles_api_userprofile_fts'
+PG_DOCUMENT = "to_tsvector('simple', name || ' ' || translate(email, '@.', '  '))"
+
+
+def create_search_index(apps, schema_editor):
+    """ Create the full text index of the profile search backend of this database """
+    connection = schema_editor.connection
+
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA compile_options')
+            if 'ENABLE_FTS5' not in {row[0] for row in cursor.fetchall()}:
+                # no FTS5 in this sqlite build, search falls back to LIKE
+                return
+        schema_editor.execute(f'CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(name, email)')
+        schema_editor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, email) SELECT id, name, email FROM profiles_api_userprofile'
+        )
+
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute(f'CREATE INDEX profile_search_document_idx ON profiles_api_userprofile USING gin ({PG_DOCUMENT})')
+        schema_editor.execute('CREATE INDEX profile_name_trgm_idx ON profiles_api_userprofile USING gin (name gin_trgm_ops)')
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+
+    if connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS profile_search_document_idx')
+        schema_editor.execute('DROP INDEX IF EXISTS profile_name_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles_api', '0004_profilefeeditem_user_timeline_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
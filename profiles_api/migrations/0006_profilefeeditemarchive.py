@@ -0,0 +1,33 @@
+# Generated by Django 3.2.18 on 2026-10-18 17:50
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles_api', '0005_userprofile_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfileFeedItemArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('status_text', models.CharField(max_length=255)),
+                ('created_on', models.DateTimeField()),
+                ('archived_on', models.DateTimeField(auto_now_add=True)),
+                ('user_profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_feed_items', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='profilefeeditemarchive',
+            index=models.Index(fields=['-created_on', '-id'], name='archive_created_on_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='profilefeeditemarchive',
+            index=models.Index(fields=['user_profile', '-created_on', '-id'], name='archive_user_created_on_id_idx'),
+        ),
+    ]
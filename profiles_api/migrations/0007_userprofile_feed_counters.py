@@ -0,0 +1,50 @@
+# Generated by Django 3.2.18 on 2026-10-18 18:04
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    """ Count the feed items the profiles already have """
+    UserProfile = apps.get_model('profiles_api', 'UserProfile')
+    feed_models = [apps.get_model('profiles_api', name) for name in ('ProfileFeedItem', 'ProfileFeedItemArchive')]
+    using = schema_editor.connection.alias
+
+    counts = [
+        Coalesce(Subquery(
+            model.objects.using(using).filter(user_profile_id=OuterRef('pk')).order_by()
+            .values('user_profile_id').annotate(count=Count('*')).values('count'),
+            output_field=models.IntegerField(),
+        ), Value(0))
+        for model in feed_models
+    ]
+    newest = [
+        Subquery(
+            model.objects.using(using).filter(user_profile_id=OuterRef('pk'))
+            .order_by('-created_on', '-id').values('created_on')[:1]
+        )
+        for model in feed_models
+    ]
+    UserProfile.objects.using(using).update(feed_count=counts[0] + counts[1], last_posted_at=Coalesce(*newest))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles_api', '0006_profilefeeditemarchive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='feed_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='last_posted_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.18 on 2026-10-18 18:50
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles_api', '0007_userprofile_feed_counters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='profilefeeditem',
+            name='created_on',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
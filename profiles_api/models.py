@@ -1,7 +1,9 @@
 from django.contrib.auth.models import (AbstractBaseUser, BaseUserManager,
                                         PermissionsMixin)
-from django.db import models
+from django.db import models, router, transaction
+from django.utils import timezone
 
+from profiles_api import caching, counters, hashing, push, timeline
 from profiles_project import settings
 
 
@@ -46,12 +48,30 @@ class UserProfile(AbstractBaseUser, PermissionsMixin):
     is_active = models.BooleanField(default=True)
     # if they can have access to django admin
     is_staff = models.BooleanField(default=False)
+    # denormalized from the feed items of the profile, kept up to date by profiles_api.counters
+    feed_count = models.PositiveIntegerField(default=0, editable=False)
+    last_posted_at = models.DateTimeField(null=True, editable=False)
 
     objects = UserProfileManager()
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['name']
 
+    def set_password(self, raw_password):
+        """ Hash the password in the hashing pool instead of on the request thread """
+        self.password = hashing.make_password(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        """ Check the password in the hashing pool, rehash it if PASSWORD_HASHERS changed """
+        is_correct, must_update = hashing.check_password(raw_password, self.password)
+        if is_correct and must_update:
+            # stored with an older algorithm or work factor, upgrade it now that we know the password
+            self.set_password(raw_password)
+            self._password = None
+            self.save(update_fields=['password'])
+        return is_correct
+
     def get_full_name(self):
         """ Retrive full name of user """
         return self.name 
@@ -64,17 +84,128 @@ class UserProfile(AbstractBaseUser, PermissionsMixin):
         """ Return string representation of user  """
         return self.email
 
-class ProfileFeedItem(models.Model):
+class ProfileFeedItemManager(models.Manager):
+    """ Manager for profile feed items """
+
+    def bulk_create_items(self, items, chunk_size=500):
+        """ Insert many feed items in one transaction, chunk_size rows per INSERT """
+        with transaction.atomic(using=self.db):
+            created = self.bulk_create(items, batch_size=chunk_size)
+            counters.record_posts(created, self.db)
+
+        # bulk_create does not give us the new ids on every database, so instead of
+        # pushing the items we let the timelines of the authors rebuild on next read.
+        # Both wait for the commit when called in an outer transaction (see profiles_api.signals)
+        user_ids = {item.user_profile_id for item in created}
+
+        def invalidate():
+            for user_id in user_ids:
+                timeline.invalidate(user_id)
+            # bulk_create sends no post_save signals, the counters of the profiles changed too
+            caching.bump_version(self.model, UserProfile)
+
+        transaction.on_commit(invalidate, using=self.db)
+        push.publish_items('created', created, using=self.db)
+
+        return created
+
+    def bulk_update_items(self, items, fields, chunk_size=500):
+        """ Save fields of many feed items in one transaction """
+        with transaction.atomic(using=self.db):
+            updated = self.bulk_update(items, fields, batch_size=chunk_size)
+
+        transaction.on_commit(lambda: caching.bump_version(self.model), using=self.db)
+        push.publish_items('updated', items, using=self.db)
+        return updated
+
+
+class CountedFeedItemMixin:
+    """ Keeps the feed counters of the profile in step with saves and deletes of single items """
+    # hot and archived items both count (see profiles_api/counters.py)
+
+    def save(self, *args, **kwargs):
+        """ Save the item, a new one is counted in the counters of its profile in the same transaction """
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+            counters.record_posts([self], using)
+
+    def delete(self, using=None, keep_parents=False):
+        """ Delete the item and uncount it from its profile in the same transaction """
+        using = using or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            deleted = super().delete(using=using, keep_parents=keep_parents)
+            counters.record_delete(self.user_profile_id, using)
+        return deleted
+
+
+class ProfileFeedItem(CountedFeedItemMixin, models.Model):
     """ Profile status updates """
     user_profile = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE
     )
     status_text = models.CharField(max_length=255)
-    created_on = models.DateTimeField(auto_now_add=True)
+    # now unless given: the write-behind queue inserts its items with the time they were posted
+    created_on = models.DateTimeField(default=timezone.now, editable=False)
+
+    objects = ProfileFeedItemManager()
+
+    class Meta:
+        # the feed is paginated newest first on (created_on, id), this index lets the
+        # database seek straight to the cursor position instead of sorting the table
+        indexes = [
+            models.Index(fields=['-created_on', '-id'], name='feed_created_on_id_idx'),
+            # per user timelines are rebuilt from this one when they are not cached
+            models.Index(fields=['user_profile', '-created_on', '-id'], name='feed_user_created_on_id_idx'),
+        ]
 
     def __str__(self):
         """ Return model as string """
         return self.status_text
 
 
+class ProfileFeedItemArchiveManager(models.Manager):
+    """ Manager for archived feed items """
+
+    def shaped_like(self, queryset):
+        """ The archive on the database of a feed item queryset, with the same .values() / .only() columns """
+        archive = self.using(queryset.db)
+        if queryset.query.values_select:
+            archive = archive.values(*queryset.query.values_select)
+        else:
+            names, defer = queryset.query.deferred_loading
+            if names and not defer:
+                archive = archive.only(*names)
+        return archive
+
+
+class ProfileFeedItemArchive(CountedFeedItemMixin, models.Model):
+    """ Profile status updates moved out of the feed table by retention.archive """
+    # Same columns as ProfileFeedItem and the same ids, so an archived item keeps its url and
+    # its position in the feed. Rows are only ever inserted by the archiver, never saved by
+    # the api, hence no auto fields.
+    id = models.BigIntegerField(primary_key=True)
+    user_profile = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='archived_feed_items',
+    )
+    status_text = models.CharField(max_length=255)
+    created_on = models.DateTimeField()
+    archived_on = models.DateTimeField(auto_now_add=True)
+
+    objects = ProfileFeedItemArchiveManager()
+
+    class Meta:
+        # the archive is paginated like the feed
+        indexes = [
+            models.Index(fields=['-created_on', '-id'], name='archive_created_on_id_idx'),
+            models.Index(fields=['user_profile', '-created_on', '-id'], name='archive_user_created_on_id_idx'),
+        ]
+
+    def __str__(self):
+        """ Return model as string """
+        return self.status_text
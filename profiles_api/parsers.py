@@ -0,0 +1,27 @@
+import codecs
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+
+from profiles_api import renderers
+
+# JSON request bodies parsed with orjson when it is installed, see renderers.py.
+# orjson only reads utf-8 and rejects NaN/Infinity, so bodies in another charset, or a
+# non strict STRICT_JSON setting, are left to DRF's JSONParser.
+
+
+class FastJSONParser(JSONParser):
+    """ JSONParser using orjson when available """
+    renderer_class = renderers.FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        if renderers.orjson is None or not self.strict or codecs.lookup(encoding).name != 'utf-8':
+            return super().parse(stream, media_type, parser_context)
+
+        try:
+            return renderers.orjson.loads(stream.read())
+        except renderers.orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -25,4 +25,5 @@ class updateOwnStatus(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             return True
         
-        return obj.user_profile.id == request.user.id
\ No newline at end of file
+        # compare the foreign key column itself, obj.user_profile.id would load the whole profile row
+        return obj.user_profile_id == request.user.id
@@ -0,0 +1,315 @@
+import asyncio
+import collections
+import json
+import logging
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from profiles_api.metrics import CallbackGauge, registry
+
+logger = logging.getLogger(__name__)
+
+# Publish/subscribe of feed events for the push streams of profiles_api.streams.
+# The feed writes publish 'created', 'updated' and 'deleted' events once their transaction
+# commits: the feed views for single items, the bulk methods of ProfileFeedItemManager for
+# the bulk endpoint and the write-behind queue. The
+# broker of the process hands every event to each open stream (a Subscription) through a
+# bounded buffer, filled from whatever thread published and read by the event loop of the
+# connection. A client reading slower than events arrive fills its buffer and is cut off
+# rather than letting the buffer (and the memory of the server) grow: it reconnects and
+# resumes from the last id it saw.
+#
+# Every event has an id, increasing in publish order. The broker keeps the last HISTORY
+# events, so a client resuming with Last-Event-ID gets what it missed, and a 'reset' event
+# when it missed more than that (or the server restarted): the client then reloads
+# /api/feed/ instead.
+#
+# Where events come from is up to the backend. LocalBackend only sees the events of its own
+# process, enough for a single ASGI worker. SQLiteBackend appends them to a table in a
+# SQLite file shared by every process and each process reads them back with a polling
+# thread, so a stream of one worker sees the writes of all of them and the ids are the same
+# everywhere. Another backend (e.g. redis pub/sub) needs publish(), start() and close().
+
+DEFAULTS = {
+    'BACKEND': 'profiles_api.push.LocalBackend',
+    'OPTIONS': {},
+    # events waiting per connection, a client further behind is disconnected
+    'BUFFER_SIZE': 256,
+    # recent events kept for clients resuming with Last-Event-ID
+    'HISTORY': 1000,
+    # seconds of silence after which a stream sends a keep-alive
+    'HEARTBEAT_SECONDS': 15,
+    'MAX_CONNECTIONS': 1000,
+}
+
+Event = collections.namedtuple('Event', 'id type data')
+
+
+def get_settings():
+    """ Push settings merged over the defaults """
+    return {**DEFAULTS, **getattr(settings, 'PROFILES_PUSH', {})}
+
+
+class Subscription:
+    """ The events of one connection, a bounded buffer read from its event loop """
+
+    def __init__(self, broker, loop, buffer_size, user_profile=None):
+        self.broker = broker
+        self.loop = loop
+        self.buffer_size = buffer_size
+        self.user_profile = user_profile
+        self.buffer = collections.deque()
+        self.ready = asyncio.Event()
+        self.dropped = False
+
+    def matches(self, event):
+        return self.user_profile is None or event.data.get('user_profile') in (None, self.user_profile)
+
+    def offer(self, event):
+        """ Hand an event over from any thread """
+        self.loop.call_soon_threadsafe(self.deliver, event)
+
+    def deliver(self, event):
+        if self.dropped or not self.matches(event):
+            return
+        if len(self.buffer) >= self.buffer_size:
+            # a slow consumer, it resumes from its last event after reconnecting
+            self.dropped = True
+            self.broker.dropped += 1
+        else:
+            self.buffer.append(event)
+        self.ready.set()
+
+    async def get(self, timeout):
+        """ The next event, None after timeout seconds without one or once dropped and drained """
+        if not self.buffer and not self.dropped:
+            self.ready.clear()
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self.buffer.popleft() if self.buffer else None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class TooManyConnections(APIException):
+    """ MAX_CONNECTIONS streams are open in this process """
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many open streams, try again shortly.'
+    default_code = 'too_many_streams'
+
+
+class Broker:
+    """ Fans the events of the backend out to the subscriptions of this process """
+
+    def __init__(self, backend, options, buffer_size, history, max_connections):
+        self.lock = threading.Lock()
+        self.subscriptions = set()
+        self.history = collections.deque(maxlen=history)
+        self.buffer_size = buffer_size
+        self.max_connections = max_connections
+        self.last_id = 0
+        self.published = 0
+        self.dropped = 0
+        self.backend = import_string(backend)(self, **{key.lower(): value for key, value in options.items()})
+
+    def publish(self, event_type, data):
+        self.backend.publish(event_type, data)
+
+    def load(self, events, last_id):
+        """ Start the history over from events, called by the backend """
+        with self.lock:
+            self.history.clear()
+            self.history.extend(events)
+            self.last_id = last_id
+
+    def dispatch(self, event):
+        """ Record an event of the backend and offer it to every subscription """
+        with self.lock:
+            self.history.append(event)
+            self.last_id = event.id
+            self.published += 1
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            try:
+                subscription.offer(event)
+            except RuntimeError:
+                # its event loop is closed, the connection is gone
+                self.unsubscribe(subscription)
+
+    def missed(self, last_event_id):
+        """ The events after last_event_id, None when they aren't all in the history anymore """
+        oldest = self.history[0].id if self.history else self.last_id + 1
+        if not oldest - 1 <= last_event_id <= self.last_id:
+            return None
+        events = [event for event in self.history if event.id > last_event_id]
+        return events if len(events) <= self.buffer_size else None
+
+    def subscribe(self, loop, last_event_id=None, user_profile=None):
+        """ Open a subscription, starting after last_event_id when given """
+        self.backend.start()
+        with self.lock:
+            if len(self.subscriptions) >= self.max_connections:
+                raise TooManyConnections()
+            subscription = Subscription(self, loop, self.buffer_size, user_profile)
+            if last_event_id is not None:
+                missed = self.missed(last_event_id)
+                if missed is None:
+                    subscription.buffer.append(Event(self.last_id, 'reset', {}))
+                else:
+                    subscription.buffer.extend(event for event in missed if subscription.matches(event))
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def stats(self):
+        return {'connections': len(self.subscriptions), 'published': self.published, 'dropped': self.dropped}
+
+    def close(self):
+        self.backend.close()
+
+
+class LocalBackend:
+    """ The events of this process only """
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.lock = threading.Lock()
+        # ids start from the clock (ms), so they keep growing over restarts and a client
+        # resuming from an id of the previous run gets a reset
+        broker.load([], int(time.time() * 1000))
+
+    def start(self):
+        pass
+
+    def publish(self, event_type, data):
+        # under the lock, so the history stays in id order
+        with self.lock:
+            self.broker.dispatch(Event(self.broker.last_id + 1, event_type, data))
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend:
+    """ The events of every process sharing a SQLite file, read back by a polling thread """
+
+    def __init__(self, broker, path='push_events.sqlite3', poll_seconds=0.05, keep=10000):
+        self.broker = broker
+        self.path = str(path)
+        self.poll_seconds = poll_seconds
+        self.keep = keep
+        self.connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS push_events ('
+            '  id INTEGER PRIMARY KEY AUTOINCREMENT, type TEXT NOT NULL, data TEXT NOT NULL, created_at REAL NOT NULL'
+            ')'
+        )
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopping = threading.Event()
+        self.position = 0
+
+    def publish(self, event_type, data):
+        # the polling thread delivers it, in this process too, so every process sees the same order
+        with self.lock:
+            cursor = self.connection.execute(
+                'INSERT INTO push_events (type, data, created_at) VALUES (?, ?, ?)',
+                (event_type, json.dumps(data), time.time()),
+            )
+            if cursor.lastrowid % 1000 == 0:
+                self.connection.execute('DELETE FROM push_events WHERE id <= ?', (cursor.lastrowid - self.keep,))
+
+    def start(self):
+        """ Load the recent events and start polling, on the first subscription of the process """
+        with self.lock:
+            if self.thread is not None:
+                return
+            rows = self.connection.execute(
+                'SELECT id, type, data FROM push_events ORDER BY id DESC LIMIT ?', (self.broker.history.maxlen,)
+            ).fetchall()
+            self.position = rows[0][0] if rows else 0
+            self.broker.load([Event(pk, kind, json.loads(data)) for pk, kind, data in reversed(rows)], self.position)
+            self.thread = threading.Thread(target=self.poll, name='feed-push', daemon=True)
+            self.thread.start()
+
+    def poll(self):
+        while not self.stopping.wait(self.poll_seconds):
+            try:
+                with self.lock:
+                    rows = self.connection.execute(
+                        'SELECT id, type, data FROM push_events WHERE id > ? ORDER BY id LIMIT 1000', (self.position,)
+                    ).fetchall()
+                for pk, kind, data in rows:
+                    self.broker.dispatch(Event(pk, kind, json.loads(data)))
+                    self.position = pk
+            except Exception:
+                logger.exception('reading push events from %s failed', self.path)
+
+    def close(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+        with self.lock:
+            self.connection.close()
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    """ The broker of this process, created on first use """
+    conf = get_settings()
+    return Broker(conf['BACKEND'], conf['OPTIONS'], conf['BUFFER_SIZE'], conf['HISTORY'], conf['MAX_CONNECTIONS'])
+
+
+@receiver(setting_changed)
+def reset_broker(setting, **kwargs):
+    """ Close and drop the broker when the settings change (tests) """
+    if setting == 'PROFILES_PUSH' and get_broker.cache_info().currsize:
+        get_broker().close()
+        get_broker.cache_clear()
+
+
+def publish(event_type, data):
+    """ Push an event to the feed streams once the current transaction commits """
+    transaction.on_commit(lambda: get_broker().publish(event_type, data))
+
+
+def publish_items(event_type, items, using=None):
+    """ Publish an event per feed item, once the current transaction commits """
+    from profiles_api.serializers import ProfileFeedItemSerializer
+
+    reset = set()
+    for item in items:
+        if item.pk is None:
+            # inserted by a bulk_create that can't return ids on this database
+            reset.add(item.user_profile_id)
+        else:
+            data = dict(ProfileFeedItemSerializer(item).data)
+            transaction.on_commit(lambda data=data: get_broker().publish(event_type, data), using=using)
+    for user_id in reset:
+        # the streams of those profiles reload the feed, as when they missed events
+        data = {'user_profile': user_id}
+        transaction.on_commit(lambda data=data: get_broker().publish('reset', data), using=using)
+
+
+registry.register(CallbackGauge(
+    'profiles_push', 'Open feed streams, events published to them and streams dropped for being slow', 'stat',
+    lambda: get_broker().stats() if get_broker.cache_info().currsize else {}
+))
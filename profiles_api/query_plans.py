@@ -0,0 +1,189 @@
+import json
+import logging
+import re
+from collections import namedtuple
+from contextlib import ExitStack, contextmanager
+
+from django.apps import apps
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Query plan checks: ask the database how it runs the queries of a request and flag the
+# plans that get slower as the tables grow, before production finds them.
+#   scan  the whole table is read (SQLite "SCAN <table>", postgres "Seq Scan")
+#   sort  the rows are sorted after reading them (SQLite "USE TEMP B-TREE", postgres "Sort")
+# Walking an index (SQLite "SCAN <table> USING INDEX") is not a problem, it is how a
+# LIMITed ORDER BY on an indexed column reads only the rows it returns.
+#
+# For every problem suggest_index() proposes the Meta.indexes entry that would avoid it:
+# the columns the query filters on with =, then the ones it orders by, then the ones it
+# filters on with a range. A query with neither (a plain SELECT of the whole table) gets no
+# suggestion, no index helps there.
+#
+# Used by the query plan tests of profiles_api/tests.py, which request every endpoint and
+# fail on a problem that isn't in their allowlist, and at dev time by the instrumentation
+# middleware with PROFILES_INSTRUMENTATION EXPLAIN_QUERIES on, which logs the problems of
+# every request. Postgres picks sequential scans on small tables deliberately, its plans
+# only mean something with production sized tables (and statistics).
+
+Query = namedtuple('Query', 'sql params using')
+
+
+class Problem(namedtuple('Problem', 'kind table detail query')):
+    """ A step of a query plan that reads or sorts a whole table """
+
+    def __str__(self):
+        return f'{self.kind} of {self.table}: {self.detail}\n    {self.query.sql}'
+
+
+class QueryRecorder:
+    """ connection.execute_wrapper hook keeping the queries it sees """
+
+    def __init__(self, using):
+        self.using = using
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many:
+            self.queries.append(Query(sql, params, self.using))
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def record_queries(aliases=None):
+    """ Record the queries run inside the block, on every database or the given aliases """
+    recorders = [QueryRecorder(alias) for alias in (aliases or connections)]
+    queries = []
+    with ExitStack() as stack:
+        for recorder in recorders:
+            stack.enter_context(connections[recorder.using].execute_wrapper(recorder))
+        try:
+            yield queries
+        finally:
+            for recorder in recorders:
+                queries.extend(recorder.queries)
+
+
+def is_explainable(sql):
+    """ SELECT, UPDATE and DELETE have a plan, the rest (INSERT, SAVEPOINT, ...) is not checked """
+    return sql.lstrip().split(None, 1)[0].upper() in ('SELECT', 'UPDATE', 'DELETE')
+
+
+def sqlite_problems(query, cursor):
+    cursor.execute('EXPLAIN QUERY PLAN ' + query.sql, query.params)
+    table = main_table(query.sql)
+    problems = []
+    for row in cursor.fetchall():
+        detail = row[-1]
+        # SCAN <table>, SCAN TABLE <table> before sqlite 3.36, without USING an index
+        scan = re.match(r'SCAN (?:TABLE )?"?(\w+)"?(.*)$', detail)
+        if scan and 'USING' not in scan.group(2) and 'VIRTUAL TABLE' not in scan.group(2):
+            if scan.group(1) in table_names():
+                problems.append(Problem('scan', scan.group(1), detail, query))
+        elif detail.startswith('USE TEMP B-TREE'):
+            problems.append(Problem('sort', table, detail, query))
+    return problems
+
+
+def postgresql_problems(query, cursor):
+    cursor.execute('EXPLAIN (FORMAT JSON) ' + query.sql, query.params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    table = main_table(query.sql)
+    problems = []
+    nodes = [plan[0]['Plan']]
+    while nodes:
+        node = nodes.pop()
+        nodes.extend(node.get('Plans', ()))
+        if node['Node Type'] == 'Seq Scan':
+            problems.append(Problem('scan', node['Relation Name'], 'Seq Scan', query))
+        elif node['Node Type'] in ('Sort', 'Incremental Sort'):
+            problems.append(Problem('sort', table, ', '.join(node.get('Sort Key', ())), query))
+    return problems
+
+
+PLANNERS = {
+    'sqlite': sqlite_problems,
+    'postgresql': postgresql_problems,
+}
+
+
+def explain(queries):
+    """ The problems of the plans of queries, databases without a planner here are skipped """
+    problems = []
+    for query in queries:
+        connection = connections[query.using]
+        planner = PLANNERS.get(connection.vendor)
+        if planner is None or not is_explainable(query.sql):
+            continue
+        with connection.cursor() as cursor:
+            problems.extend(planner(query, cursor))
+    return problems
+
+
+def table_names():
+    """ db_table -> model of every installed model """
+    return {model._meta.db_table: model for model in apps.get_models()}
+
+
+def main_table(sql):
+    """ The table a query selects from, updates or deletes from """
+    match = re.search(r'\b(?:FROM|UPDATE)\s+"(\w+)"', sql)
+    return match.group(1) if match else None
+
+
+def clause(sql, start, ends):
+    """ The text of sql between the keyword start and the first of ends after it """
+    match = re.search(rf'\b{start}\b(.*?)(?:\b(?:{"|".join(ends)})\b|$)', sql, re.S)
+    return match.group(1) if match else ''
+
+
+def suggest_index(problem):
+    """ (model, models.Index) that would avoid a problem, None when no index would """
+    from django.db import models
+
+    model = table_names().get(problem.table)
+    if model is None:
+        return None
+    columns = {field.column: field.name for field in model._meta.concrete_fields}
+    sql = problem.query.sql
+    column = rf'"{problem.table}"\."(\w+)"'
+
+    where = clause(sql, 'WHERE', ('GROUP BY', 'ORDER BY', 'LIMIT'))
+    equal = re.findall(column + r'\s*(?:=|IN\b|IS\b)', where)
+    ranged = re.findall(column + r'\s*(?:<|>|BETWEEN\b)', where)
+    ordered = [
+        ('-' if direction else '') + name
+        for name, direction in re.findall(column + r'(?:\s+ASC)?(\s+DESC)?', clause(sql, 'ORDER BY', ('LIMIT', 'OFFSET')))
+    ]
+
+    fields = []
+    for name in equal + ordered + ranged:
+        field = columns.get(name.lstrip('-'))
+        if field and field not in [chosen.lstrip('-') for chosen in fields]:
+            fields.append('-' + field if name.startswith('-') else field)
+    # the primary key is the last column of every index already, and the table is in its order
+    while fields and fields[-1].lstrip('-') == model._meta.pk.name:
+        fields.pop()
+    if not fields:
+        return None
+    index = models.Index(fields=fields)
+    index.set_name_with_model(model)
+    return model, index
+
+
+def describe(problem):
+    """ A problem and the index suggested for it, as logged """
+    suggestion = suggest_index(problem)
+    if suggestion is None:
+        return str(problem)
+    model, index = suggestion
+    return f'{problem}\n    suggested: {model.__name__}.Meta.indexes += [models.Index(fields={index.fields!r}, name={index.name!r})]'
+
+
+def log_problems(queries, label):
+    """ Explain queries and log their problems, at dev time """
+    for problem in explain(queries):
+        logger.warning('%s: %s', label, describe(problem))
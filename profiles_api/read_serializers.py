@@ -0,0 +1,152 @@
+from operator import attrgetter, itemgetter
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.response import Response
+
+# Read only serializers for the list/retrieve hot path.
+# A ModelSerializer goes through get_attribute, to_representation and SkipField checks for
+# every field of every row, which is what the CPU time of a big list goes into once the
+# queries are fast. A ValuesSerializer instead works out once per class, from the fields of
+# its ModelSerializer, which database column feeds each output key and whether the value
+# needs converting at all (only datetimes do here). Rows are then read with .values()
+# and turned into dicts with that plan, giving exactly the output of the ModelSerializer.
+
+# field types whose representation of a database value is the value itself
+PASSTHROUGH_FIELDS = (
+    serializers.BooleanField,
+    serializers.CharField,
+    serializers.IntegerField,
+    serializers.ReadOnlyField,
+)
+
+
+class UnsupportedField(Exception):
+    """ The ModelSerializer has a field the plan can't reproduce """
+
+
+def plan_field(field):
+    """ (output key, column, converter or None) rendering one serializer field """
+    if '.' in field.source or field.source == '*':
+        raise UnsupportedField(field.field_name)
+
+    try:
+        model_field = field.parent.Meta.model._meta.get_field(field.source)
+    except FieldDoesNotExist:
+        raise UnsupportedField(field.field_name)
+    if isinstance(field, serializers.PrimaryKeyRelatedField):
+        # what pk-only optimization renders: the value of the foreign key column
+        return field.field_name, model_field.attname, None
+    if isinstance(field, serializers.DateTimeField):
+        return field.field_name, model_field.attname, field.to_representation
+    if isinstance(field, PASSTHROUGH_FIELDS):
+        return field.field_name, model_field.attname, None
+    raise UnsupportedField(field.field_name)
+
+
+class ValuesSerializer:
+    """ Read only serializer rendering .values() rows (or instances) like serializer_class """
+    # the ModelSerializer whose output is reproduced
+    serializer_class = None
+
+    _plans = {}
+
+    def __init__(self, instance=None, many=False, context=None):
+        self.instance = instance
+        self.many = many
+        self.context = context or {}
+
+    @classmethod
+    def get_plan(cls, fieldset=None):
+        """ [(output key, column, converter)] of the readable fields (of the fieldset), built once """
+        plan = cls._plans.get((cls, fieldset))
+        if plan is None:
+            if fieldset is None:
+                fields = cls.serializer_class().fields.values()
+                plan = [plan_field(field) for field in fields if not field.write_only]
+            else:
+                plan = [entry for entry in cls.get_plan() if entry[0] in fieldset]
+            cls._plans[(cls, fieldset)] = plan
+        return plan
+
+    @classmethod
+    def columns(cls, fieldset=None):
+        return [column for _, column, _ in cls.get_plan(fieldset)]
+
+    @classmethod
+    def rows(cls, queryset, fieldset=None, key_columns=()):
+        """ The queryset as .values() dicts holding the columns of the plan and key_columns """
+        columns = cls.columns(fieldset)
+        return queryset.values(*columns, *[column for column in key_columns if column not in columns])
+
+    def to_representation(self, row, getter):
+        values = getter(row)
+        return {
+            key: value if converter is None or value is None else converter(value)
+            for (key, _, converter), value in zip(self.get_plan(self.fieldset), values)
+        }
+
+    @property
+    def fieldset(self):
+        return self.context.get('fieldset')
+
+    @property
+    def data(self):
+        columns = self.columns(self.fieldset)
+        if not columns:
+            # ?fields= left nothing to render
+            return [{} for _ in self.instance] if self.many else {}
+        if self.many:
+            rows = list(self.instance)
+            if not rows:
+                return []
+            getter = self.getter(rows[0], columns)
+            return [self.to_representation(row, getter) for row in rows]
+        return self.to_representation(self.instance, self.getter(self.instance, columns))
+
+    @staticmethod
+    def getter(row, columns):
+        """ Function returning the column values of a row as a tuple """
+        get = itemgetter(*columns) if isinstance(row, dict) else attrgetter(*columns)
+        if len(columns) == 1:
+            return lambda item: (get(item),)
+        return get
+
+
+class FastReadMixin:
+    """ Serve GET list/retrieve of a model viewset with its read_serializer_class """
+    read_serializer_class = None
+
+    def use_fast_read(self):
+        return (
+            self.read_serializer_class is not None
+            and getattr(settings, 'PROFILES_FAST_READ', True)
+            and self.request.method == 'GET'
+        )
+
+    def get_read_rows(self, queryset):
+        """ queryset as the .values() rows read_serializer_class renders """
+        fieldset = self.get_serializer_context().get('fieldset')
+        # the rows keep the key columns (pagination) even when the fieldset leaves them out
+        return self.read_serializer_class.rows(queryset, fieldset, getattr(self, 'key_columns', ()))
+
+    def get_read_serializer(self, instance, many=False):
+        return self.read_serializer_class(instance, many=many, context=self.get_serializer_context())
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_fast_read():
+            return super().list(request, *args, **kwargs)
+
+        rows = self.get_read_rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(self.get_read_serializer(page, many=True).data)
+        return Response(self.get_read_serializer(rows, many=True).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.use_fast_read():
+            return super().retrieve(request, *args, **kwargs)
+
+        # a model instance, so object permissions see what they always see
+        return Response(self.get_read_serializer(self.get_object()).data)
@@ -0,0 +1,52 @@
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSON rendering with orjson when it is installed.
+# orjson is written in Rust and turns a big feed page into bytes several times faster than
+# the json module. FastJSONRenderer is a drop in replacement for DRF's JSONRenderer: it keeps
+# its media type and format, so content negotiation is unchanged, and renders the same bytes.
+# Everything orjson doesn't know natively (lazy translation strings, Decimal, querysets...)
+# goes through DRF's JSONEncoder.default. Whenever orjson can't give the same output (indented
+# or ascii only json, NaN allowed, ints over 64 bits) or isn't installed, the pure Python
+# JSONRenderer renders instead.
+
+LINE_SEPARATORS = ('\u2028'.encode(), '\u2029'.encode())
+
+
+class FastJSONRenderer(JSONRenderer):
+    """ JSONRenderer using orjson when available """
+
+    def use_orjson(self, accepted_media_type, renderer_context):
+        return (
+            orjson is not None
+            and not self.ensure_ascii
+            and self.compact
+            and self.strict
+            and self.get_indent(accepted_media_type, renderer_context or {}) is None
+        )
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if not self.use_orjson(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            # datetimes pass through to the encoder too, so they keep DRF's format
+            ret = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+            )
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # escaped like JSONRenderer does, so the output stays a strict javascript subset
+        separator, paragraph = LINE_SEPARATORS
+        if separator in ret or paragraph in ret:
+            ret = ret.replace(separator, b'\\u2028').replace(paragraph, b'\\u2029')
+        return ret
@@ -0,0 +1,159 @@
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import request_started
+from django.db import router, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+
+from profiles_api import caching, timeline
+
+logger = logging.getLogger(__name__)
+
+# Retention of the feed: items older than ARCHIVE_AFTER_DAYS move from ProfileFeedItem (the
+# hot table every feed request reads) to ProfileFeedItemArchive, keeping their ids.
+# They move BATCH_SIZE rows at a time, one short transaction per batch, oldest first, so
+# the write lock is never held for long and writers get a turn between two batches. Since
+# the oldest rows always go first, every archived item is older than every hot item, which
+# is what lets the feed read the hot table first and only carry on in the archive once the
+# hot rows run out (see KeysetCursorPagination).
+#
+# Run it with the archive_feed command (cron), call scheduled_archive() from a task queue,
+# or set SCHEDULE_SECONDS to have every server process start a scheduler thread. A lock in
+# the CACHE_ALIAS cache makes sure only one of them archives at a time, which takes a cache
+# the processes share (`manage.py check --deploy` says so). The thread is started by the
+# first request a process serves, not at import: a thread started in the gunicorn --preload
+# master wouldn't exist in the workers forked from it.
+
+DEFAULTS = {
+    'ARCHIVE_AFTER_DAYS': 365,
+    'BATCH_SIZE': 1000,
+    # pause between two batches, lets queued writers in
+    'PAUSE_SECONDS': 0.05,
+    # start a scheduler thread in every server process, None to schedule it yourself
+    'SCHEDULE_SECONDS': None,
+    # holds LOCK_KEY, shared by every process running scheduled_archive()
+    'CACHE_ALIAS': 'default',
+    'LOCK_KEY': 'retention:lock',
+}
+
+# (pid, thread) of the scheduler of this process
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_settings():
+    """ Retention settings merged over the defaults """
+    return {**DEFAULTS, **getattr(settings, 'PROFILES_RETENTION', {})}
+
+
+def get_cutoff(days=None):
+    """ Items created before this are archived """
+    if days is None:
+        days = get_settings()['ARCHIVE_AFTER_DAYS']
+    return timezone.now() - timedelta(days=days)
+
+
+def archive_batch(cutoff, batch_size):
+    """ Move up to batch_size of the oldest items created before cutoff, return how many moved """
+    from profiles_api.models import ProfileFeedItem, ProfileFeedItemArchive
+
+    using = router.db_for_write(ProfileFeedItem)
+    with transaction.atomic(using=using):
+        rows = list(
+            ProfileFeedItem.objects.using(using)
+            .filter(created_on__lt=cutoff)
+            .order_by('created_on', 'id')
+            .values('id', 'user_profile_id', 'status_text', 'created_on')[:batch_size]
+        )
+        if not rows:
+            return 0
+
+        ProfileFeedItemArchive.objects.using(using).bulk_create(
+            [ProfileFeedItemArchive(**row) for row in rows], batch_size=batch_size,
+        )
+        # a plain DELETE ... WHERE id IN: nothing references feed items, and delete() would
+        # load every row to send post_delete signals, whose receivers would invalidate the
+        # timeline and the responses once per row; that is done below, once per batch. The
+        # counters keep counting the items, they are archived, not gone.
+        ProfileFeedItem.objects.using(using).filter(id__in=[row['id'] for row in rows])._raw_delete(using)
+
+        user_ids = {row['user_profile_id'] for row in rows}
+
+        def invalidate():
+            for user_id in user_ids:
+                timeline.invalidate(user_id)
+            caching.bump_version(ProfileFeedItem, ProfileFeedItemArchive)
+
+        transaction.on_commit(invalidate, using=using)
+    return len(rows)
+
+
+def archive(days=None, batch_size=None, max_batches=None, pause=None, progress=None):
+    """ Archive every item older than days, batch by batch, return how many moved """
+    conf = get_settings()
+    cutoff = get_cutoff(days)
+    batch_size = batch_size or conf['BATCH_SIZE']
+    pause = conf['PAUSE_SECONDS'] if pause is None else pause
+
+    moved = batches = 0
+    while max_batches is None or batches < max_batches:
+        count = archive_batch(cutoff, batch_size)
+        if not count:
+            break
+        moved += count
+        batches += 1
+        if progress is not None:
+            progress(moved)
+        if count < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    return moved
+
+
+def scheduled_archive():
+    """ Archive unless another process is at it already, the scheduler hook """
+    conf = get_settings()
+    cache = caches[conf['CACHE_ALIAS']]
+    # one process at a time if the cache is shared; expires on its own if the process holding it dies
+    if not cache.add(conf['LOCK_KEY'], True, 3600):
+        return None
+    try:
+        return archive()
+    finally:
+        cache.delete(conf['LOCK_KEY'])
+
+
+def run_scheduler(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            moved = scheduled_archive()
+            if moved:
+                logger.info('archived %s feed items', moved)
+        except Exception:
+            logger.exception('archiving the feed failed')
+
+
+@receiver(request_started)
+def start_scheduler(**kwargs):
+    """ Start the scheduler thread of this process if SCHEDULE_SECONDS is set, on its first request """
+    global _scheduler
+    if _scheduler is not None and _scheduler[0] == os.getpid():
+        return _scheduler[1]
+    interval = get_settings()['SCHEDULE_SECONDS']
+    if not interval:
+        return None
+    with _scheduler_lock:
+        # one started before a fork belongs to the parent, the thread didn't survive the fork
+        if _scheduler is None or _scheduler[0] != os.getpid():
+            thread = threading.Thread(target=run_scheduler, args=(interval,), name='feed-retention', daemon=True)
+            thread.start()
+            _scheduler = (os.getpid(), thread)
+    return _scheduler[1]
@@ -0,0 +1,207 @@
+import re
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connections, router
+from django.db.models import Case, IntegerField, When
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from rest_framework import filters
+
+# Full text search of user profiles.
+# The SearchFilter of DRF turns ?search= into name LIKE '%term%' OR email LIKE '%term%',
+# which has to look at every row of the table. The backends here keep a full text index
+# of name and email instead: an FTS5 table on SQLite, tsvector + trigram GIN indexes on
+# postgres. A search asks the index for the best matching ids, so its cost depends on
+# the number of matches and not on the number of profiles.
+
+FTS_TABLE = 'profiles_api_userprofile_fts'
+
+# index expression of the postgres backend, the query must use the very same expression
+# for the planner to pick the GIN index. Emails are split on @ and . to index their parts.
+PG_DOCUMENT = "to_tsvector('simple', name || ' ' || translate(email, '@.', '  '))"
+
+DEFAULTS = {
+    # 'auto' picks the backend matching the database vendor, or a dotted path to a backend class
+    'BACKEND': 'auto',
+    # most matches returned for one search, best ranked first; the responses say so in their
+    # X-Search-Limit header
+    'MAX_RESULTS': 500,
+}
+
+
+def tokenize(text):
+    """ Split search terms into lowercase words, dropping any query syntax """
+    return [word for word in re.split(r'\W+', text.lower()) if word]
+
+
+class BaseSearchBackend:
+    """ Interface of the profile search backends """
+
+    def search(self, terms, limit, using='default'):
+        """ Return the ids of profiles matching all terms (as prefixes), best match first """
+        raise NotImplementedError
+
+    def index(self, profile, using='default'):
+        """ Add or refresh a profile in the index """
+
+    def index_many(self, profiles, using='default'):
+        """ Add or refresh many profiles in the index """
+        for profile in profiles:
+            self.index(profile, using=using)
+
+    def remove(self, profile_id, using='default'):
+        """ Drop a profile from the index """
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    """ SQLite FTS5 index, rowid is the profile id, ranked with bm25 """
+
+    def search(self, terms, limit, using='default'):
+        words = tokenize(' '.join(terms))
+        if not words:
+            return []
+        # "word"* is a prefix query, words separated by spaces must all match
+        match = ' '.join(f'"{word}"*' for word in words)
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY rank LIMIT %s',
+                [match, limit]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def index(self, profile, using='default'):
+        self.index_many([profile], using=using)
+
+    def index_many(self, profiles, using='default'):
+        rows = [(profile.pk, profile.name, profile.email) for profile in profiles]
+        with connections[using].cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, name, email) VALUES (%s, %s, %s)', rows)
+
+    def remove(self, profile_id, using='default'):
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [profile_id])
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """ Postgres tsvector prefix search plus trigram similarity on the name """
+    # both are expression indexes (see migration 0005), postgres keeps them up to date by itself
+
+    def search(self, terms, limit, using='default'):
+        words = tokenize(' '.join(terms))
+        if not words:
+            return []
+        tsquery = ' & '.join(f'{word}:*' for word in words)
+        text = ' '.join(words)
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                f"SELECT id FROM profiles_api_userprofile "
+                f"WHERE {PG_DOCUMENT} @@ to_tsquery('simple', %s) OR name %% %s "
+                f"ORDER BY greatest(ts_rank({PG_DOCUMENT}, to_tsquery('simple', %s)), similarity(name, %s)) DESC "
+                f"LIMIT %s",
+                [tsquery, text, tsquery, text, limit]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_settings():
+    """ Search settings merged over the defaults """
+    return {**DEFAULTS, **getattr(settings, 'PROFILES_SEARCH', {})}
+
+
+# backends found per database alias; a database without an index is not remembered, its
+# index may be created (migrate) while the process runs
+_backends = {}
+
+
+def find_backend(using='default'):
+    """ Search backend for a database alias, None when it has no full text index """
+    backend = get_settings()['BACKEND']
+    if backend != 'auto':
+        return import_string(backend)()
+
+    connection = connections[using]
+    backend_class = BACKENDS.get(connection.vendor)
+    if backend_class is SQLiteSearchBackend:
+        # the migration only creates the FTS5 table if sqlite was built with FTS5
+        with connection.cursor() as cursor:
+            if FTS_TABLE not in connection.introspection.table_names(cursor):
+                return None
+    return backend_class() if backend_class else None
+
+
+def get_backend(using='default'):
+    """ The search backend of a database alias, created once per process, None without an index """
+    backend = _backends.get(using)
+    if backend is None:
+        backend = find_backend(using)
+        if backend is not None:
+            _backends[using] = backend
+    return backend
+
+
+def clear_backends():
+    """ Forget the backends found so far """
+    _backends.clear()
+
+
+@receiver(setting_changed)
+def reset_backend(setting, **kwargs):
+    """ Drop the cached backends when the settings change (tests) """
+    if setting in ('PROFILES_SEARCH', 'DATABASES'):
+        clear_backends()
+
+
+def index_profiles(profiles):
+    """ Add profiles to the search index of the database they are written to """
+    from profiles_api.models import UserProfile
+
+    using = router.db_for_write(UserProfile)
+    backend = get_backend(using)
+    if backend is not None:
+        backend.index_many(profiles, using=using)
+
+
+def remove_profile(profile_id):
+    """ Drop a profile from the search index """
+    from profiles_api.models import UserProfile
+
+    using = router.db_for_write(UserProfile)
+    backend = get_backend(using)
+    if backend is not None:
+        backend.remove(profile_id, using=using)
+
+
+class ProfileSearchFilter(filters.SearchFilter):
+    """ ?search= backed by the full text index, ranked, every word used as a prefix """
+    # falls back to the LIKE based SearchFilter on databases without an index
+
+    def filter_queryset(self, request, queryset, view):
+        search_terms = self.get_search_terms(request)
+        if not search_terms:
+            return queryset
+
+        backend = get_backend(queryset.db)
+        if backend is None:
+            return super().filter_queryset(request, queryset, view)
+
+        ids = backend.search(search_terms, get_settings()['MAX_RESULTS'], using=queryset.db)
+        if not ids:
+            return queryset.none()
+
+        # keep the ranking of the index
+        ranking = Case(*[When(pk=pk, then=position) for position, pk in enumerate(ids)], output_field=IntegerField())
+        return queryset.filter(pk__in=ids).order_by(ranking)
+
+    def get_result_limit(self, request, queryset):
+        """ The most results a search of request can return, None when it is not capped """
+        if not self.get_search_terms(request) or get_backend(queryset.db) is None:
+            return None
+        return get_settings()['MAX_RESULTS']
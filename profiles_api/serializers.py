@@ -1,6 +1,7 @@
+from django.conf import settings
 from rest_framework import serializers
 
-from profiles_api import models
+from profiles_api import fieldsets, models, read_serializers
 
 
 class HelloSerializer(serializers.Serializer):
@@ -8,14 +9,14 @@ class HelloSerializer(serializers.Serializer):
     name = serializers.CharField(max_length=10)
 
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserProfileSerializer(fieldsets.SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     """ Serializes a user profile object """
 
     # this class sets our serializer to point to our UserProfile model.
     class Meta:
         model = models.UserProfile
         # list of fields we want to work with in our api
-        fields = ('id', 'email', 'name', 'password')
+        fields = ('id', 'email', 'name', 'password', 'feed_count', 'last_posted_at')
         # to add customization to any field like making it ready only or write onlt we use the follwing approach
         # extra_kwargs = {"field_to_add_custom_config": {}}
         extra_kwargs = {
@@ -60,14 +61,60 @@ class UserProfileSerializer(serializers.ModelSerializer):
     Once that's done, we use super().update() to pass the values to the existing DRF update() method, to handle updating the remaining fields.
     """
 
-class ProfileFeedItemSerializer(serializers.ModelSerializer):
+def get_bulk_settings():
+    """ Settings of the bulk feed endpoint """
+    return {'CHUNK_SIZE': 500, 'MAX_ITEMS': 10000, **getattr(settings, 'PROFILES_FEED_BULK', {})}
+
+
+class ProfileFeedItemListSerializer(serializers.ListSerializer):
+    """ Validates and creates a list of feed items in bulk """
+    # Unlike the default ListSerializer an invalid item does not fail the whole list:
+    # its errors are kept in item_errors and the valid items are still saved.
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            raise serializers.ValidationError({'non_field_errors': ['Expected a list of items.']})
+
+        max_items = get_bulk_settings()['MAX_ITEMS']
+        if len(data) > max_items:
+            raise serializers.ValidationError({'non_field_errors': [f'Send at most {max_items} items per request.']})
+
+        self.item_errors = []
+        validated = []
+        for index, item in enumerate(data):
+            try:
+                validated.append(self.child.run_validation(item))
+            except serializers.ValidationError as exc:
+                self.item_errors.append({'index': index, 'errors': exc.detail})
+
+        return validated
+
+    def create(self, validated_data):
+        """ Insert all valid items with chunked bulk INSERTs in one transaction """
+        items = [self.child.Meta.model(**attrs) for attrs in validated_data]
+        return self.child.Meta.model.objects.bulk_create_items(items, get_bulk_settings()['CHUNK_SIZE'])
+
+
+class ProfileFeedItemSerializer(fieldsets.SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     """ Serializes profile feed items """
 
     class Meta:
         model = models.ProfileFeedItem
         fields = ('id', 'user_profile', 'status_text', 'created_on')
+        # used when the serializer is created with many=True, e.g. by the bulk endpoint
+        list_serializer_class = ProfileFeedItemListSerializer
         extra_kwargs = {
             "user_profile": {
                 "read_only": True
             }
-        }
\ No newline at end of file
+        }
+
+
+class UserProfileReadSerializer(read_serializers.ValuesSerializer):
+    """ Fast read only version of UserProfileSerializer for GET list/retrieve """
+    serializer_class = UserProfileSerializer
+
+
+class ProfileFeedItemReadSerializer(read_serializers.ValuesSerializer):
+    """ Fast read only version of ProfileFeedItemSerializer for GET list/retrieve """
+    serializer_class = ProfileFeedItemSerializer
@@ -0,0 +1,83 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from profiles_api import caching, models, search, timeline
+from profiles_api.authentication import get_token_cache
+
+# Signal receivers keeping the caches of profiles_api in sync with the database.
+# They are connected in ProfilesApiConfig.ready().
+# Versions are bumped once the write commits: bumped before, a read in between would cache
+# the rows of before the write under the new version, and serve them until the next write.
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_token(sender, instance, **kwargs):
+    """ A token was issued, rotated or revoked """
+    get_token_cache().invalidate_user(instance.user_id, keys=(instance.key,))
+
+
+@receiver(post_save, sender=models.UserProfile)
+@receiver(post_delete, sender=models.UserProfile)
+def invalidate_profile_tokens(sender, instance, **kwargs):
+    """ A profile changed (e.g. was deactivated), drop the cached user objects """
+    token_cache = get_token_cache()
+    keys = ()
+    if token_cache.shared is not None:
+        # the local tier knows the keys of a user, the shared tier has to be told
+        keys = Token.objects.filter(user_id=instance.pk).values_list('key', flat=True)
+    token_cache.invalidate_user(instance.pk, keys=keys)
+
+
+@receiver(post_save, sender=models.UserProfile)
+def index_profile(sender, instance, update_fields=None, **kwargs):
+    """ Keep the search index in sync with name and email """
+    # saves that don't touch the indexed columns (e.g. last_login on login) are skipped
+    if update_fields is not None and not {'name', 'email'} & set(update_fields):
+        return
+    search.index_profiles([instance])
+
+
+@receiver(post_delete, sender=models.UserProfile)
+def unindex_profile(sender, instance, **kwargs):
+    """ Drop a deleted profile from the search index """
+    search.remove_profile(instance.pk)
+
+
+@receiver(post_save, sender=models.UserProfile)
+@receiver(post_delete, sender=models.UserProfile)
+def bump_profile_version(sender, instance, update_fields=None, using=None, **kwargs):
+    """ A profile changed, cached profile responses are stale once committed """
+    # last_login and password are not part of any response
+    if update_fields is not None and set(update_fields) <= {'last_login', 'password'}:
+        return
+    transaction.on_commit(lambda: caching.bump_version(models.UserProfile), using=using)
+
+
+@receiver(post_save, sender=models.ProfileFeedItem)
+@receiver(post_delete, sender=models.ProfileFeedItem)
+def bump_feed_version(sender, instance, created=False, signal=None, using=None, **kwargs):
+    """ A feed item changed, cached feed responses are stale once committed """
+    changed = (models.ProfileFeedItem,)
+    if created or signal is post_delete:
+        # and so are the feed_count / last_posted_at of profile responses
+        changed += (models.UserProfile,)
+    transaction.on_commit(lambda: caching.bump_version(*changed), using=using)
+
+
+@receiver(post_save, sender=models.ProfileFeedItem)
+def push_to_timeline(sender, instance, created=False, using=None, **kwargs):
+    """ A new feed item goes to the timeline of its owner, once committed """
+    if created:
+        user_id, item_id = instance.user_profile_id, instance.pk
+        transaction.on_commit(lambda: timeline.push(user_id, item_id), using=using)
+
+
+@receiver(post_delete, sender=models.ProfileFeedItem)
+def remove_from_timeline(sender, instance, using=None, **kwargs):
+    """ A deleted feed item leaves the timeline of its owner, once committed """
+    # the pk is cleared once the delete is done, take it now
+    user_id, item_id = instance.user_profile_id, instance.pk
+    transaction.on_commit(lambda: timeline.remove(user_id, item_id), using=using)
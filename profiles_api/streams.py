@@ -0,0 +1,227 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+from django.db import connections
+from rest_framework import exceptions
+
+from profiles_api import async_views, push
+
+# Push streams of the feed, so clients learn about new items without polling /api/feed/.
+# Django 3.2 iterates a StreamingHttpResponse synchronously, which would block the event
+# loop for as long as a stream is open, so these are plain ASGI applications that
+# PushRouter (see profiles_project/asgi.py) serves in front of django:
+#     GET /api/stream/feed/        Server-Sent Events
+#     websocket /api/stream/feed/  the same events as JSON text messages
+# Both need a token, in the Authorization header or as ?token= since browsers can't set
+# headers on EventSource and WebSocket. ?user_profile=<id> narrows the stream to the items of
+# one profile. A client resumes after the last event it saw with the Last-Event-ID header
+# (EventSource sends it by itself when it reconnects) or ?last_event_id=.
+#
+# Events:
+#     created  the item as /api/feed/ renders it
+#     updated  the item as /api/feed/ renders it
+#     deleted  {"id", "user_profile"}
+#     reset    {} events were missed, reload /api/feed/; {"user_profile"} items of that
+#              profile were created without ids (bulk inserts on SQLite), reload its feed
+# A client too slow to keep up with the events is disconnected (see profiles_api.push).
+#
+# The same goes for the streaming responses django itself makes, the exports of
+# /api/profile/export/ and /api/feed/export/: their rows come from a lazy queryset, read
+# while the body is sent, which may not touch the database on the event loop.
+# StreamingASGIHandler sends them with each chunk read in a thread of the response's own.
+
+STREAM_PATH = '/api/stream/feed/'
+
+# milliseconds an EventSource waits before reconnecting
+RETRY_MS = 3000
+
+
+def get_params(scope):
+    """ (query parameters, headers) of an ASGI scope, the last value of each """
+    query = {key: values[-1] for key, values in parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+    headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope.get('headers', [])}
+    return query, headers
+
+
+async def open_subscription(scope):
+    """ Authenticate the client and subscribe it to the feed events """
+    query, headers = get_params(scope)
+
+    header = headers.get('authorization', '').split()
+    if header and header[0].lower() == 'token' and len(header) == 2:
+        key = header[1]
+    else:
+        key = query.get('token')
+    if not key:
+        raise exceptions.NotAuthenticated()
+    await async_views.authenticate_key(key)
+
+    user_profile = query.get('user_profile')
+    if user_profile is not None:
+        if not user_profile.isdigit():
+            raise exceptions.ParseError('user_profile must be an integer.')
+        user_profile = int(user_profile)
+
+    last_event_id = headers.get('last-event-id', query.get('last_event_id'))
+    if last_event_id is not None:
+        # an id we never gave out gets a reset
+        last_event_id = int(last_event_id) if last_event_id.isdigit() else -1
+
+    return push.get_broker().subscribe(asyncio.get_running_loop(), last_event_id, user_profile)
+
+
+async def wait_for_message(receive, message_type):
+    while (await receive())['type'] != message_type:
+        pass
+
+
+async def pump(subscription, receive, disconnect_type, write):
+    """ write() the events of subscription until the client leaves (False) or is dropped (True) """
+    heartbeat = push.get_settings()['HEARTBEAT_SECONDS']
+    disconnected = asyncio.ensure_future(wait_for_message(receive, disconnect_type))
+    try:
+        while True:
+            next_event = asyncio.ensure_future(subscription.get(heartbeat))
+            await asyncio.wait({next_event, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                next_event.cancel()
+                return False
+            event = next_event.result()
+            if event is None and subscription.dropped:
+                return True
+            # None: nothing for a while, write a keep-alive
+            await write(event)
+    except OSError:
+        # the server noticed the client left before we did
+        return False
+    finally:
+        disconnected.cancel()
+
+
+async def send_error(send, exc):
+    body = json.dumps({'detail': exc.detail}).encode()
+    await send({'type': 'http.response.start', 'status': exc.status_code, 'headers': [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(body)).encode()),
+    ]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def format_event(event):
+    """ An event in the text/event-stream format """
+    data = json.dumps(event.data, separators=(',', ':'))
+    return f'id: {event.id}\nevent: {event.type}\ndata: {data}\n\n'.encode()
+
+
+async def sse_feed(scope, receive, send):
+    """ GET /api/stream/feed/ """
+    if scope['method'] != 'GET':
+        return await send_error(send, exceptions.MethodNotAllowed(scope['method']))
+    try:
+        subscription = await open_subscription(scope)
+    except exceptions.APIException as exc:
+        return await send_error(send, exc)
+
+    async def write(event):
+        body = format_event(event) if event is not None else b': keep-alive\n\n'
+        await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            # nginx would buffer the stream otherwise
+            (b'x-accel-buffering', b'no'),
+        ]})
+        await send({'type': 'http.response.body', 'body': f'retry: {RETRY_MS}\n\n'.encode(), 'more_body': True})
+        if await pump(subscription, receive, 'http.disconnect', write):
+            # dropped, end the response so the client reconnects and resumes
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        subscription.close()
+
+
+async def websocket_feed(scope, receive, send):
+    """ websocket /api/stream/feed/ """
+    if (await receive())['type'] != 'websocket.connect':
+        return
+    try:
+        subscription = await open_subscription(scope)
+    except exceptions.APIException:
+        # closing before accepting answers the handshake with a 403
+        return await send({'type': 'websocket.close'})
+
+    async def write(event):
+        if event is not None:
+            text = json.dumps({'id': event.id, 'event': event.type, 'data': event.data}, separators=(',', ':'))
+            await send({'type': 'websocket.send', 'text': text})
+
+    try:
+        await send({'type': 'websocket.accept'})
+        if await pump(subscription, receive, 'websocket.disconnect', write):
+            # 1013 try again later: reconnect with ?last_event_id=
+            await send({'type': 'websocket.close', 'code': 1013})
+    finally:
+        subscription.close()
+
+
+def read_part(parts):
+    """ The next part of a streaming body, None at its end """
+    return next(parts, None)
+
+
+def close_connections():
+    """ Close the database connections of this thread, which is about to go away """
+    connections.close_all()
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """ Django's ASGI handler, reading the body of streaming responses off the event loop """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+
+        headers = [(header.encode('ascii'), value.encode('latin1')) for header, value in response.items()]
+        headers += [(b'Set-Cookie', cookie.output(header='').encode('ascii').strip())
+                    for cookie in response.cookies.values()]
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+
+        # one thread for the whole body: a queryset iterator keeps reading from the cursor of
+        # the connection it opened, which belongs to the thread it was opened in
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='streaming-response')
+        read = sync_to_async(read_part, thread_sensitive=False, executor=executor)
+        parts = iter(response)
+        try:
+            part = await read(parts)
+            while part is not None:
+                for chunk, _ in self.chunk_bytes(part):
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                part = await read(parts)
+            await send({'type': 'http.response.body'})
+        finally:
+            await sync_to_async(close_connections, thread_sensitive=False, executor=executor)()
+            executor.shutdown(wait=False)
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+
+class PushRouter:
+    """ ASGI application serving the feed streams and handing everything else to app """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == STREAM_PATH:
+            return await sse_feed(scope, receive, send)
+        if scope['type'] == 'websocket':
+            if scope['path'] == STREAM_PATH:
+                return await websocket_feed(scope, receive, send)
+            # django itself doesn't speak websocket
+            await receive()
+            return await send({'type': 'websocket.close'})
+        return await self.app(scope, receive, send)
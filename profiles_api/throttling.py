@@ -0,0 +1,221 @@
+import math
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from profiles_api.metrics import registry
+
+# Rate limiting of the api.
+# The throttles count requests with a sliding window counter: per key they keep the count
+# of the current fixed window and of the previous one, and estimate the requests of the
+# last `duration` seconds as previous * (part of the previous window still covered) +
+# current. That is O(1) time and memory per key, unlike DRF's SimpleRateThrottle which
+# keeps (and rewrites to the cache) the timestamp of every request.
+#
+# The counters live in a store. LocalCounterStore keeps them in process, split in shards
+# with a lock each so concurrent requests rarely wait on each other; a hit costs a few
+# microseconds. With several workers each one counts on its own, so the effective limit is
+# workers * rate; use CacheCounterStore (a shared django cache, e.g. redis) when that matters.
+#
+# Rates come from REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], by scope, like DRF's own throttles.
+
+DEFAULTS = {
+    'STORE': 'profiles_api.throttling.LocalCounterStore',
+    'OPTIONS': {
+        'SHARDS': 64,
+        # keys per shard before stale ones are dropped
+        'MAX_KEYS': 10000,
+    },
+}
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+throttled_requests = registry.counter(
+    'profiles_throttled_requests_total', 'Requests rejected by a throttle', labelnames=('scope',),
+)
+
+
+def get_settings():
+    """ Throttle settings merged over the defaults """
+    return {**DEFAULTS, **getattr(settings, 'PROFILES_THROTTLE', {})}
+
+
+def parse_rate(rate):
+    """ (requests, seconds) of a rate like '100/min', None for no limit """
+    if rate is None:
+        return None
+    num, period = rate.split('/')
+    return int(num), PERIODS[period[0]]
+
+
+def sliding_window(previous, current, limit, duration, elapsed):
+    """ (allowed, seconds to wait) for one more request, elapsed seconds into the current window """
+    if limit <= 0:
+        return False, duration - elapsed
+    covered = 1 - elapsed / duration
+    if previous * covered + current + 1 <= limit:
+        return True, 0.0
+    if current + 1 <= limit:
+        # wait for enough of the previous window to slide out
+        return False, max((1 - (limit - 1 - current) / previous - (1 - covered)) * duration, 0.0)
+    # wait for the next window, and for enough of this one to slide out of that
+    return False, (duration - elapsed) + (1 - (limit - 1) / current) * duration
+
+
+class LocalCounterStore:
+    """ Sliding window counters in process, sharded by key """
+
+    def __init__(self, shards=64, max_keys=10000):
+        self.shards = [({}, threading.Lock()) for _ in range(shards)]
+        self.max_keys = max_keys
+
+    def hit(self, key, limit, duration, now=None):
+        """ Count a request for key if allowed, return (allowed, seconds to wait) """
+        now = time.time() if now is None else now
+        window = int(now // duration)
+        counters, lock = self.shards[hash(key) % len(self.shards)]
+        with lock:
+            entry = counters.get(key)
+            if entry is None:
+                if len(counters) >= self.max_keys:
+                    self.prune(counters, now)
+                entry = counters[key] = [window, 0, 0, duration]
+            elif entry[0] != window:
+                # [window, current, previous, duration]
+                entry[2] = entry[1] if entry[0] == window - 1 else 0
+                entry[0], entry[1] = window, 0
+
+            allowed, wait = sliding_window(entry[2], entry[1], limit, duration, now - window * duration)
+            if allowed:
+                entry[1] += 1
+            return allowed, wait
+
+    @staticmethod
+    def prune(counters, now):
+        """ Drop the keys whose counters can't limit anything anymore """
+        for key in [key for key, entry in counters.items() if entry[0] < int(now // entry[3]) - 1]:
+            del counters[key]
+
+    def clear(self):
+        for counters, lock in self.shards:
+            with lock:
+                counters.clear()
+
+
+class CacheCounterStore:
+    """ Sliding window counters in a django cache shared by every worker """
+
+    def __init__(self, cache_alias='default', key_prefix='throttle'):
+        self.cache = caches[cache_alias]
+        self.key_prefix = key_prefix
+
+    def hit(self, key, limit, duration, now=None):
+        now = time.time() if now is None else now
+        window = int(now // duration)
+        current_key = f'{self.key_prefix}:{key}:{window}'
+        previous_key = f'{self.key_prefix}:{key}:{window - 1}'
+        counts = self.cache.get_many([current_key, previous_key])
+
+        allowed, wait = sliding_window(
+            counts.get(previous_key, 0), counts.get(current_key, 0), limit, duration, now - window * duration
+        )
+        if allowed:
+            # the window is still needed as the previous one of the next window
+            if not self.cache.add(current_key, 1, duration * 2):
+                try:
+                    self.cache.incr(current_key)
+                except ValueError:
+                    self.cache.set(current_key, 1, duration * 2)
+        return allowed, wait
+
+    def clear(self):
+        pass
+
+
+@lru_cache(maxsize=None)
+def get_store():
+    """ Return the configured counter store, created once per process """
+    conf = get_settings()
+    store_class = import_string(conf['STORE'])
+    options = {key.lower(): value for key, value in conf['OPTIONS'].items()}
+    return store_class(**options)
+
+
+@receiver(setting_changed)
+def reset_store(setting, **kwargs):
+    """ Drop the cached store when the settings change (tests) """
+    if setting == 'PROFILES_THROTTLE':
+        get_store.cache_clear()
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """ Throttle of scope's rate, counted per user (or per client address when anonymous) """
+    scope = None
+
+    def get_rate(self):
+        # read on every request so REST_FRAMEWORK overrides apply
+        return parse_rate(api_settings.DEFAULT_THROTTLE_RATES.get(self.scope))
+
+    def get_cache_key(self, request, view):
+        """ The key requests are counted under, None to not throttle the request """
+        if request.user and request.user.is_authenticated:
+            return f'{self.scope}:user:{request.user.pk}'
+        return f'{self.scope}:ip:{self.get_ident(request)}'
+
+    def allow_request(self, request, view):
+        self.wait_seconds = None
+        rate = self.get_rate()
+        if rate is None:
+            return True
+        key = self.get_cache_key(request, view)
+        if key is None:
+            return True
+
+        allowed, wait = get_store().hit(key, *rate)
+        if not allowed:
+            self.wait_seconds = math.ceil(wait)
+            throttled_requests.inc(scope=self.scope)
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class ProfileThrottle(SlidingWindowThrottle):
+    scope = 'profile'
+
+
+class FeedThrottle(SlidingWindowThrottle):
+    scope = 'feed'
+
+
+class LoginThrottle(SlidingWindowThrottle):
+    """ Logins per client address """
+    scope = 'login'
+
+    def get_cache_key(self, request, view):
+        return f'{self.scope}:ip:{self.get_ident(request)}'
+
+
+class LoginAccountThrottle(SlidingWindowThrottle):
+    """ Logins per account and client address (password guessing) """
+    # Keyed on the account alone, anyone could lock its owner out by failing logins for it.
+    # Per address, an attacker only locks themselves out of that account; LoginThrottle
+    # limits the accounts one address can try.
+    scope = 'login_account'
+
+    def get_cache_key(self, request, view):
+        if request.method != 'POST':
+            return None
+        username = request.data.get('username')
+        if not isinstance(username, str) or not username:
+            return None
+        return f'{self.scope}:{username.strip().lower()}:{self.get_ident(request)}'
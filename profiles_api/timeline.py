@@ -0,0 +1,381 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db.models import Q, Subquery
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+# Materialized per user timelines.
+# For every user profile we keep a bounded list of their feed item ids, newest first,
+# so reading "the feed of profile X" is a slice of that list plus one pk lookup instead
+# of a filter + sort over the whole feed table. The list is a cache: if a backend does
+# not have the timeline of a user (cold start, eviction, restart) it is rebuilt from the
+# database with a single indexed query.
+#
+# The timelines follow the feed through the post_save / post_delete receivers of
+# profiles_api.signals, once the write is committed, whoever wrote (the api, the admin, a
+# shell); the bulk paths and the archiver invalidate the timelines they touch. Every worker
+# has to see those updates, so the default backend keeps the timelines in a SQLite file that
+# the worker processes of a host share, with a TTL bounding how long a timeline that missed a
+# write (raw SQL, a rebuild racing a write) is served. Several hosts share RedisTimelineBackend,
+# or CacheTimelineBackend on a redis/memcached cache; the process local caches (locmem, dummy)
+# are only good for a single process, `manage.py check --deploy` says so.
+
+DEFAULTS = {
+    'BACKEND': 'profiles_api.timeline.SQLiteTimelineBackend',
+    # max number of item ids we keep per user, older items fall off the end
+    'MAX_LENGTH': 1000,
+    'OPTIONS': {},
+}
+
+
+class BaseTimelineBackend:
+    """ Interface every timeline backend implements """
+
+    def __init__(self, max_length, **options):
+        self.max_length = max_length
+
+    def push(self, user_id, item_id):
+        """ Add a new item to the head of a timeline that is already loaded """
+        raise NotImplementedError
+
+    def remove(self, user_id, item_id):
+        """ Drop an item from a timeline """
+        raise NotImplementedError
+
+    def range(self, user_id, start, stop):
+        """ Return item ids [start:stop] or None if the timeline is not loaded """
+        raise NotImplementedError
+
+    def replace(self, user_id, item_ids):
+        """ Store the full timeline of a user, newest first """
+        raise NotImplementedError
+
+    def invalidate(self, user_id):
+        """ Forget a timeline so it is rebuilt from the database on next read """
+        raise NotImplementedError
+
+
+class CacheTimelineBackend(BaseTimelineBackend):
+    """ Timelines stored in a django cache, shared by the workers if the cache is (redis, memcached) """
+    # Pushing to a cached list is a read-modify-write, two workers pushing at once would lose
+    # one of the items, so a write forgets the timeline and the next read rebuilds it.
+
+    def __init__(self, max_length, cache_alias='default', ttl=300, key_prefix='timeline', **options):
+        super().__init__(max_length)
+        self.cache_alias = cache_alias
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def key(self, user_id):
+        return f'{self.key_prefix}:{user_id}'
+
+    def push(self, user_id, item_id):
+        self.invalidate(user_id)
+
+    def remove(self, user_id, item_id):
+        self.invalidate(user_id)
+
+    def range(self, user_id, start, stop):
+        timeline = self.cache.get(self.key(user_id))
+        return None if timeline is None else timeline[start:stop]
+
+    def replace(self, user_id, item_ids):
+        self.cache.set(self.key(user_id), list(item_ids[:self.max_length]), self.ttl)
+
+    def invalidate(self, user_id):
+        self.cache.delete(self.key(user_id))
+
+
+class SQLiteTimelineBackend(BaseTimelineBackend):
+    """ Timelines stored in a SQLite file of their own, shared by the worker processes of a host """
+    # An item of a timeline is a (user_id, position, item_id) row, the newest has the highest
+    # position. A loaded timeline has a row in timeline_users, which tells an empty timeline
+    # from a cold one. Every write is a transaction of its own that SQLite serializes across
+    # the processes, so unlike a cached list a push can't lose an item pushed meanwhile.
+
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS timeline_users ('
+        '  user_id INTEGER PRIMARY KEY, loaded_at REAL NOT NULL'
+        ')',
+        'CREATE TABLE IF NOT EXISTS timeline_items ('
+        '  user_id INTEGER NOT NULL, position INTEGER NOT NULL, item_id INTEGER NOT NULL,'
+        '  PRIMARY KEY (user_id, position)'
+        ') WITHOUT ROWID',
+    )
+
+    def __init__(self, max_length, path='timelines.sqlite3', ttl=300, **options):
+        super().__init__(max_length)
+        self.path = str(path)
+        self.ttl = ttl
+        self._connection = None  # (pid, connection)
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self):
+        """ The connection of this process, shared by its threads under self._lock """
+        # opened on first use in the process: a process forked from one that had it would
+        # share the SQLite handle
+        if self._connection is None or self._connection[0] != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = NORMAL')
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+            self._connection = (os.getpid(), connection)
+        return self._connection[1]
+
+    def transaction(self, statements, write=True):
+        """ Run statements(connection) in one transaction, return what it returns """
+        with self._lock:
+            connection = self.connection
+            connection.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+            try:
+                result = statements(connection)
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+            return result
+
+    def is_loaded(self, connection, user_id):
+        row = connection.execute('SELECT loaded_at FROM timeline_users WHERE user_id = ?', (user_id,)).fetchone()
+        return row is not None and row[0] > time.time() - self.ttl
+
+    def push(self, user_id, item_id):
+        def statements(connection):
+            # a cold timeline stays cold, the next read loads it with the item
+            if not self.is_loaded(connection, user_id):
+                return
+            connection.execute(
+                'INSERT INTO timeline_items (user_id, position, item_id) SELECT ?, COALESCE(MAX(position), 0) + 1, ?'
+                ' FROM timeline_items WHERE user_id = ?', (user_id, item_id, user_id),
+            )
+            connection.execute(
+                'DELETE FROM timeline_items WHERE user_id = ? AND position <= ('
+                '  SELECT position FROM timeline_items WHERE user_id = ? ORDER BY position DESC LIMIT 1 OFFSET ?'
+                ')', (user_id, user_id, self.max_length),
+            )
+        self.transaction(statements)
+
+    def remove(self, user_id, item_id):
+        self.transaction(lambda connection: connection.execute(
+            'DELETE FROM timeline_items WHERE user_id = ? AND item_id = ?', (user_id, item_id),
+        ))
+
+    def range(self, user_id, start, stop):
+        def statements(connection):
+            if not self.is_loaded(connection, user_id):
+                return None
+            rows = connection.execute(
+                'SELECT item_id FROM timeline_items WHERE user_id = ? ORDER BY position DESC LIMIT ? OFFSET ?',
+                (user_id, max(stop - start, 0), start),
+            )
+            return [item_id for item_id, in rows]
+        return self.transaction(statements, write=False)
+
+    def replace(self, user_id, item_ids):
+        item_ids = item_ids[:self.max_length]
+
+        def statements(connection):
+            connection.execute('DELETE FROM timeline_items WHERE user_id = ?', (user_id,))
+            connection.executemany(
+                'INSERT INTO timeline_items (user_id, position, item_id) VALUES (?, ?, ?)',
+                [(user_id, len(item_ids) - index, item_id) for index, item_id in enumerate(item_ids)],
+            )
+            connection.execute(
+                'INSERT OR REPLACE INTO timeline_users (user_id, loaded_at) VALUES (?, ?)', (user_id, time.time()),
+            )
+        self.transaction(statements)
+
+    def invalidate(self, user_id):
+        def statements(connection):
+            connection.execute('DELETE FROM timeline_users WHERE user_id = ?', (user_id,))
+            connection.execute('DELETE FROM timeline_items WHERE user_id = ?', (user_id,))
+        self.transaction(statements)
+
+
+class LocalTimelineBackend(BaseTimelineBackend):
+    """ In process timelines, kept for the most recently used MAX_USERS users """
+    # only for a single process: the other workers never see the writes of this one
+
+    def __init__(self, max_length, max_users=10000, **options):
+        super().__init__(max_length)
+        self.max_users = max_users
+        self._timelines = OrderedDict()
+        self._lock = threading.Lock()
+
+    def push(self, user_id, item_id):
+        with self._lock:
+            timeline = self._timelines.get(user_id)
+            if timeline is None:
+                return
+            timeline.insert(0, item_id)
+            del timeline[self.max_length:]
+
+    def remove(self, user_id, item_id):
+        with self._lock:
+            timeline = self._timelines.get(user_id)
+            if timeline is not None and item_id in timeline:
+                timeline.remove(item_id)
+
+    def range(self, user_id, start, stop):
+        with self._lock:
+            timeline = self._timelines.get(user_id)
+            if timeline is None:
+                return None
+            self._timelines.move_to_end(user_id)
+            return timeline[start:stop]
+
+    def replace(self, user_id, item_ids):
+        with self._lock:
+            self._timelines[user_id] = list(item_ids[:self.max_length])
+            self._timelines.move_to_end(user_id)
+            while len(self._timelines) > self.max_users:
+                self._timelines.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._timelines.pop(user_id, None)
+
+
+class RedisTimelineBackend(BaseTimelineBackend):
+    """ Timelines stored as redis lists, shared by every worker process """
+    # Works with any client exposing the redis list commands, pass one in as CLIENT
+    # or give a URL and the redis package is used to connect.
+
+    def __init__(self, max_length, client=None, url=None, key_prefix='timeline', **options):
+        super().__init__(max_length)
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url or 'redis://localhost:6379/0')
+        self.client = client
+        self.key_prefix = key_prefix
+
+    def key(self, user_id):
+        return f'{self.key_prefix}:{user_id}'
+
+    def push(self, user_id, item_id):
+        key = self.key(user_id)
+        # LPUSHX only pushes on an existing list, a cold timeline stays cold
+        if self.client.lpushx(key, item_id):
+            self.client.ltrim(key, 0, self.max_length - 1)
+
+    def remove(self, user_id, item_id):
+        self.client.lrem(self.key(user_id), 0, item_id)
+
+    def range(self, user_id, start, stop):
+        key = self.key(user_id)
+        if not self.client.exists(key):
+            return None
+        return [int(item_id) for item_id in self.client.lrange(key, start, stop - 1)]
+
+    def replace(self, user_id, item_ids):
+        key = self.key(user_id)
+        pipe = self.client.pipeline()
+        pipe.delete(key)
+        if item_ids:
+            pipe.rpush(key, *item_ids[:self.max_length])
+        pipe.execute()
+
+    def invalidate(self, user_id):
+        self.client.delete(self.key(user_id))
+
+
+def get_settings():
+    """ Timeline settings merged over the defaults """
+    return {**DEFAULTS, **getattr(settings, 'PROFILES_TIMELINE', {})}
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    """ Return the configured timeline backend, created once per process """
+    conf = get_settings()
+    backend_class = import_string(conf['BACKEND'])
+    options = {key.lower(): value for key, value in conf['OPTIONS'].items()}
+    return backend_class(conf['MAX_LENGTH'], **options)
+
+
+@receiver(setting_changed)
+def reset_backend(setting, **kwargs):
+    """ Drop the cached backend when the settings change (tests) """
+    if setting == 'PROFILES_TIMELINE':
+        get_backend.cache_clear()
+
+
+def push(user_id, item_id):
+    """ Add a freshly created feed item to its owner's timeline """
+    get_backend().push(user_id, item_id)
+
+
+def remove(user_id, item_id):
+    """ Remove a deleted feed item from its owner's timeline """
+    get_backend().remove(user_id, item_id)
+
+
+def invalidate(user_id):
+    """ Make the timeline of a user rebuild from the database on next read """
+    get_backend().invalidate(user_id)
+
+
+def load(backend, user_id):
+    """ Rebuild the timeline of a user from the (user_profile, created_on, id) index, return it """
+    from profiles_api.models import ProfileFeedItem
+
+    item_ids = list(
+        ProfileFeedItem.objects
+        .filter(user_profile_id=user_id)
+        .order_by('-created_on', '-id')
+        .values_list('id', flat=True)[:backend.max_length]
+    )
+    backend.replace(user_id, item_ids)
+    return item_ids
+
+
+def get_older_item_ids(user_id, last_id, offset, limit):
+    """ Return ids [offset:offset + limit] of the items of a user older than item last_id, newest first """
+    from profiles_api.models import ProfileFeedItem
+
+    items = ProfileFeedItem.objects.filter(user_profile_id=user_id).order_by('-created_on', '-id')
+    if last_id is not None:
+        # keyset on the (user_profile, created_on, id) index, from the last item of the timeline
+        last = Subquery(ProfileFeedItem.objects.filter(pk=last_id).values('created_on'))
+        items = items.filter(Q(created_on__lt=last) | Q(created_on=last, id__lt=last_id))
+    return list(items.values_list('id', flat=True)[offset:offset + limit])
+
+
+def get_item_ids(user_id, start, stop, count=None):
+    """ Return feed item ids [start:stop] of a user's items, newest first """
+    # The timeline has the newest MAX_LENGTH items, the older ones are read from the database.
+    # count, how many items the user has if known, spares looking for more past a short timeline.
+    backend = get_backend()
+    window = None
+    item_ids = backend.range(user_id, start, stop)
+    if item_ids is None:
+        # cold timeline
+        window = load(backend, user_id)
+        item_ids = window[start:stop]
+    if len(item_ids) == stop - start:
+        return item_ids
+
+    # the timeline ends before stop, where does it end
+    if item_ids:
+        length, last_id = start + len(item_ids), item_ids[-1]
+    else:
+        if window is None:
+            window = backend.range(user_id, 0, backend.max_length) or []
+        length, last_id = len(window), window[-1] if window else None
+    if count is not None and count <= length:
+        return item_ids
+    return item_ids + get_older_item_ids(user_id, last_id, max(start - length, 0), stop - start - len(item_ids))
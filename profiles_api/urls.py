@@ -1,6 +1,7 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
+from profiles_api import async_views, instrumentation
 from profiles_api.views import (HelloApiView, HelloViewSet, UserLoginApiView,
                                 UserProfileFeedViewSet, UserProfileViewSet)
 
@@ -15,6 +16,13 @@ router.register('feed', UserProfileFeedViewSet)
 urlpatterns = [
     path('hello/', HelloApiView.as_view()),
     path('login/', UserLoginApiView.as_view()),
+    # async versions of the read routes, for ASGI deployments (profiles_project/asgi.py)
+    path('async/profile/', async_views.profile_list),
+    path('async/profile/<int:pk>/', async_views.profile_detail),
+    path('async/feed/', async_views.feed_list),
+    path('async/feed/<int:pk>/', async_views.feed_detail),
+    # per route timings in the prometheus text format, only for local clients
+    path('metrics/', instrumentation.metrics_view),
     # as we register new routes with router it generates list of all urls for our viewset
     path('', include(router.urls))
 ]
@@ -1,15 +1,19 @@
 
-from django.shortcuts import render
+from django.http import Http404
+from django.shortcuts import get_object_or_404, render
 from rest_framework import filters, status, viewsets
-from rest_framework.authentication import TokenAuthentication
+from rest_framework.decorators import action
+from rest_framework.exceptions import APIException
 from rest_framework.authtoken.views import ObtainAuthToken
-from rest_framework.permissions import (IsAuthenticated,
-                                        IsAuthenticatedOrReadOnly)
+from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
 from rest_framework.response import Response
 from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.views import APIView
 
-from profiles_api import models, permissions, serializers
+from profiles_api import (authentication, caching, db_routers, export, fieldsets, hashing, instrumentation,
+                          models, pagination, permissions, push, read_serializers, search,
+                          serializers, throttling, timeline, write_behind)
 
 # we will use this to tell our apiview what data to expect when making post put and patch request to our api
 
@@ -116,35 +120,156 @@ class HelloViewSet(viewsets.ViewSet):
         return Response({'http_method': 'DELETE'})
 
 
-class UserProfileViewSet(viewsets.ModelViewSet):
+class HashingUnavailable(APIException):
+    """ The password hashing pool is full (hashing.HashingBusy) """
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many password operations in progress, try again shortly.'
+    default_code = 'hashing_busy'
+
+
+class HashingBusyMixin:
+    """ Answer 503 when the password hashing pool has no room for the request """
+
+    def handle_exception(self, exc):
+        if isinstance(exc, hashing.HashingBusy):
+            exc = HashingUnavailable()
+        return super().handle_exception(exc)
+
+
+class UserProfileViewSet(instrumentation.InstrumentedViewMixin, HashingBusyMixin, caching.ConditionalGetMixin,
+                         read_serializers.FastReadMixin, fieldsets.SparseFieldsetMixin,
+                         export.StreamingExportMixin, viewsets.ModelViewSet):
     """ Handle creating and updating profiles """
 
     # 1. connect model view set to a serializer class.
     serializer_class = serializers.UserProfileSerializer
+    throttle_classes = (throttling.ProfileThrottle,)
+    # GET list/retrieve skip the ModelSerializer machinery, same output
+    read_serializer_class = serializers.UserProfileReadSerializer
     # 2. provide a query set to the model view set so that it know which object in db are going to be managed through this viewset
     queryset = models.UserProfile.objects.all()
 
     # 3. add authentication classes (create permission beofre this step). We can configur 1 or more types of authentication. This sets how user will be authenticated.
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (authentication.CachedTokenAuthentication,)
     #4. add permissions classes that will set how user gets permission to do certain things.
     permission_classes = (permissions.UpdateOwnProfile,)
 
-    # add search filters
-    filter_backends = (filters.SearchFilter,)
-    # which field to search on
+    # add search filters, ?search= goes through the full text index of profiles_api.search
+    filter_backends = (search.ProfileSearchFilter, filters.OrderingFilter)
+    # which field to search on (used when the database has no full text index)
     search_fields = ('name', 'email',)
+    # ?ordering=-feed_count lists the most active profiles first, no COUNT needed as the counters are columns
+    ordering_fields = ('id', 'name', 'feed_count', 'last_posted_at')
+    # ?fields= / ?exclude= choose from these (field -> column), reads never load the password hash and the flags
+    sparse_fields = {
+        'id': 'id',
+        'email': 'email',
+        'name': 'name',
+        'feed_count': 'feed_count',
+        'last_posted_at': 'last_posted_at',
+    }
+    # list and retrieve answer with 304 / a cached response until a profile is written
+    conditional_models = (models.UserProfile,)
+    # columns of /api/profile/export/
+    export_fields = {'id': 'id', 'email': 'email', 'name': 'name'}
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        """ Tell the client of a search that its results are capped """
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.action == 'list' and response.status_code == status.HTTP_200_OK:
+            limit = search.ProfileSearchFilter().get_result_limit(request, self.get_queryset())
+            if limit is not None:
+                response['X-Search-Limit'] = str(limit)
+        return response
 
-
-class UserLoginApiView(ObtainAuthToken):
+    def perform_create(self, serializer):
+        """ Create the profile, labelling its password hashing as signup """
+        with hashing.endpoint('signup'):
+            serializer.save()
+
+    def perform_update(self, serializer):
+        """ Update the profile, labelling its password hashing as profile_update """
+        with hashing.endpoint('profile_update'):
+            serializer.save()
+
+    # extra route /api/profile/{id}/feed/ with the status updates of one profile.
+    # It reads the materialized timeline of the profile so the cost depends on the page size only;
+    # pages past the newest MAX_LENGTH items continue from the database.
+    @action(detail=True, methods=['get'], permission_classes=(IsAuthenticated,))
+    def feed(self, request, pk=None):
+        """ List the feed items of a profile, newest first """
+        profile = self.get_object()
+
+        try:
+            offset = max(int(request.query_params.get('offset', 0)), 0)
+            limit = min(max(int(request.query_params.get('limit', 50)), 1), 500)
+        except ValueError:
+            return Response({'detail': 'offset and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # ask for one more id than needed so we know if there is a next page
+        item_ids = timeline.get_item_ids(profile.id, offset, offset + limit + 1, count=profile.feed_count)
+        has_next = len(item_ids) > limit
+        item_ids = item_ids[:limit]
+
+        items = models.ProfileFeedItem.objects.in_bulk(item_ids)
+        # keep the timeline order, skip ids of items deleted since they were cached
+        items = [items[item_id] for item_id in item_ids if item_id in items]
+        serializer = serializers.ProfileFeedItemSerializer(items, many=True, context=self.get_serializer_context())
+
+        url = request.build_absolute_uri()
+        next_url = replace_query_param(url, 'offset', offset + limit) if has_next else None
+        previous_url = replace_query_param(url, 'offset', max(offset - limit, 0)) if offset else None
+        return Response({'next': next_url, 'previous': previous_url, 'results': serializer.data})
+
+
+class UserLoginApiView(instrumentation.InstrumentedViewMixin, HashingBusyMixin, ObtainAuthToken):
     """ Handle creating user authentication tokens"""
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    # per address, and per account and address against password guessing
+    throttle_classes = (throttling.LoginThrottle, throttling.LoginAccountThrottle)
 
+    def post(self, request, *args, **kwargs):
+        """ Log in, labelling the password check as login """
+        with hashing.endpoint('login'):
+            response = super().post(request, *args, **kwargs)
+        # the token was just written, the requests using it must not miss it on a replica
+        db_routers.pin(response.data['token'])
+        return response
 
-class UserProfileFeedViewSet(viewsets.ModelViewSet):
+
+class UserProfileFeedViewSet(instrumentation.InstrumentedViewMixin, caching.ConditionalGetMixin,
+                             read_serializers.FastReadMixin, fieldsets.SparseFieldsetMixin,
+                             export.StreamingExportMixin, viewsets.ModelViewSet):
     """ Handles crud profile feed items """
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (authentication.CachedTokenAuthentication,)
     serializer_class = serializers.ProfileFeedItemSerializer
+    throttle_classes = (throttling.FeedThrottle,)
+    # GET list/retrieve skip the ModelSerializer machinery, same output
+    read_serializer_class = serializers.ProfileFeedItemReadSerializer
+    # The serializer and updateOwnStatus only read user_profile_id, so no join with the profile table is needed.
+    # If the serializer starts exposing nested profile data add .select_related('user_profile') with an .only() projection here.
     queryset = models.ProfileFeedItem.objects.all()
+    # the feed is too big to return in one response, page through it with an opaque cursor
+    pagination_class = pagination.KeysetCursorPagination
+    # list and retrieve answer with 304 / a cached response until a feed item is written or archived
+    conditional_models = (models.ProfileFeedItem, models.ProfileFeedItemArchive)
+    # ?fields= / ?exclude= choose from these (field -> column) on list, retrieve and archive
+    sparse_fields = {
+        'id': 'id',
+        'user_profile': 'user_profile_id',
+        'status_text': 'status_text',
+        'created_on': 'created_on',
+    }
+    # the pagination cursor is built from them, so they are loaded whatever the fieldset
+    key_columns = ('id', 'created_on')
+    sparse_actions = ('list', 'retrieve', 'archive')
+    # columns of /api/feed/export/
+    export_fields = {
+        'id': 'id',
+        'user_profile': 'user_profile_id',
+        'status_text': 'status_text',
+        'created_on': 'created_on',
+    }
     permission_classes = (
         permissions.updateOwnStatus, 
         IsAuthenticated #makes sure that a user must to authenticated ot perform any request that is not read req.
@@ -157,3 +282,134 @@ class UserProfileFeedViewSet(viewsets.ModelViewSet):
         # When a new obj is created drf calls perform_create and it passes in serializer that we use to create obj. This is a model serializer so it has a save function assigned to it.
         # This save function is used to save the contents of the serializer to an obj in the db.
         serializer.save(user_profile=self.request.user)
+        # streams of /api/stream/feed/ get the item once it is committed
+        push.publish('created', dict(serializer.data))
+
+    def create(self, request, *args, **kwargs):
+        """ Create the item, or queue it and answer 202 when write-behind is on """
+        if not write_behind.enabled():
+            return super().create(request, *args, **kwargs)
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        status_text = serializer.validated_data['status_text']
+        # the item gets its id (and created_on) when the queue is written, the queue id identifies it until then
+        queue_id = write_behind.enqueue(request.user.id, status_text)
+        return Response(
+            {'queue_id': queue_id, 'user_profile': request.user.id, 'status_text': status_text},
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+    def perform_update(self, serializer):
+        """ Update the item and tell the streams """
+        serializer.save()
+        push.publish('updated', dict(serializer.data))
+
+    def perform_destroy(self, instance):
+        """ Delete the item and tell the streams """
+        user_id, item_id = instance.user_profile_id, instance.id
+        instance.delete()
+        push.publish('deleted', {'id': item_id, 'user_profile': user_id})
+
+    # Old items are moved to the archive by profiles_api.retention. The feed reads the hot
+    # table first and the pagination carries on in the archive when the hot items run out,
+    # and /api/feed/{id}/ still finds an archived item. Archived items are read only.
+    def get_archive_queryset(self, queryset):
+        """ The archived items, in the shape of queryset, where the feed carries on """
+        return models.ProfileFeedItemArchive.objects.shaped_like(queryset)
+
+    def get_object(self):
+        """ The feed item of the url, looked up in the archive too when retrieving it """
+        try:
+            return super().get_object()
+        except Http404:
+            if self.action != 'retrieve':
+                raise
+        archive = models.ProfileFeedItemArchive.objects.only(*self.get_read_columns())
+        item = get_object_or_404(archive, pk=self.kwargs['pk'])
+        self.check_object_permissions(self.request, item)
+        return item
+
+    # GET /api/feed/archive/ pages through the archived items only, newest first,
+    # ?user_profile=<id> narrows it to the items of one profile
+    @action(detail=False)
+    def archive(self, request):
+        """ List the archived feed items """
+        queryset = models.ProfileFeedItemArchive.objects.only(*self.get_read_columns())
+        user_profile = request.query_params.get('user_profile')
+        if user_profile is not None:
+            if not user_profile.isdigit():
+                return Response({'user_profile': ['A valid integer is required.']}, status=status.HTTP_400_BAD_REQUEST)
+            queryset = queryset.filter(user_profile_id=user_profile)
+
+        if self.use_fast_read():
+            page = self.paginator.paginate_queryset(self.get_read_rows(queryset), request)
+            data = self.get_read_serializer(page, many=True).data
+        else:
+            page = self.paginator.paginate_queryset(queryset, request)
+            data = self.get_serializer(page, many=True).data
+        return self.paginator.get_paginated_response(data)
+
+    # POST /api/feed/bulk/ with a list of items creates them all in one transaction.
+    # Invalid items are reported by their index in the payload, the valid ones are still saved.
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """ Create many feed items at once """
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        created = serializer.save(user_profile=request.user) if serializer.validated_data else []
+
+        return self.bulk_response({'created': len(created), 'errors': serializer.item_errors})
+
+    # PATCH /api/feed/bulk/ with a list of {"id": ..., "status_text": ...} updates the user's own items
+    @bulk.mapping.patch
+    def bulk_partial_update(self, request):
+        """ Update many of the user's feed items at once """
+        if not isinstance(request.data, list):
+            return Response({'non_field_errors': ['Expected a list of items.']}, status=status.HTTP_400_BAD_REQUEST)
+
+        bulk_settings = serializers.get_bulk_settings()
+        if len(request.data) > bulk_settings['MAX_ITEMS']:
+            return Response(
+                {'non_field_errors': [f'Send at most {bulk_settings["MAX_ITEMS"]} items per request.']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        item_ids = [entry.get('id') for entry in request.data if isinstance(entry, dict)]
+        # only the user's own items can be found, so nobody can update someone else's status
+        instances = self.get_queryset().filter(user_profile_id=request.user.id).in_bulk(
+            [item_id for item_id in item_ids if isinstance(item_id, int)]
+        )
+
+        errors = []
+        updated = []
+        for index, entry in enumerate(request.data):
+            instance = instances.get(entry.get('id')) if isinstance(entry, dict) else None
+            if instance is None:
+                errors.append({'index': index, 'errors': {'id': ['Not found.']}})
+                continue
+
+            serializer = self.get_serializer(instance, data=entry, partial=True)
+            if not serializer.is_valid():
+                errors.append({'index': index, 'errors': serializer.errors})
+                continue
+
+            for attr, value in serializer.validated_data.items():
+                setattr(instance, attr, value)
+            updated.append(instance)
+
+        if updated:
+            models.ProfileFeedItem.objects.bulk_update_items(updated, ['status_text'], bulk_settings['CHUNK_SIZE'])
+
+        return self.bulk_response({'updated': len(updated), 'errors': errors})
+
+    def bulk_response(self, data):
+        """ 200/201 if every item went through, 207 for a partial success, 400 if nothing did """
+        done = data.get('created', data.get('updated'))
+        if not data['errors']:
+            code = status.HTTP_201_CREATED if 'created' in data else status.HTTP_200_OK
+        elif done:
+            code = status.HTTP_207_MULTI_STATUS
+        else:
+            code = status.HTTP_400_BAD_REQUEST
+        return Response(data, status=code)
@@ -0,0 +1,71 @@
+import logging
+import time
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.db import connections
+from django.urls import URLPattern, URLResolver, get_resolver
+from django.utils import translation
+
+logger = logging.getLogger(__name__)
+
+# Warm up of a server process, run by profiles_project/wsgi.py and asgi.py before the first
+# request. Django loads most of what a request needs on first use: the URLconf (and with it
+# every view, serializer, renderer and throttle module), the reverse lookup tables, the
+# fields of the serializers, the plans of the fast read serializers, the translation
+# catalogs, the password hashers. Left alone, the first request of every worker pays for all
+# of it. Done here, it happens at boot, and with gunicorn --preload only once, in the master,
+# whose memory the forked workers share.
+#
+# No database connection is opened: a connection made before the fork would be shared by
+# every worker. Nor is anything else the entry points import: the write-behind queue, the
+# retention scheduler, the push broker and the hashing pool are all made per process, on
+# first use after the fork.
+
+
+def iter_views(patterns):
+    """ The view functions of a list of url patterns, included ones too """
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from iter_views(pattern.url_patterns)
+        elif isinstance(pattern, URLPattern):
+            yield pattern.callback
+
+
+def warm_view(callback):
+    """ Build the serializers of a DRF view, which builds their fields from the model meta """
+    view_class = getattr(callback, 'cls', None)
+    if view_class is None:
+        return
+    view = view_class(**getattr(callback, 'initkwargs', {}))
+    serializer_class = getattr(view, 'serializer_class', None)
+    if serializer_class is not None:
+        serializer_class().fields
+    read_serializer_class = getattr(view, 'read_serializer_class', None)
+    if read_serializer_class is not None:
+        read_serializer_class.get_plan()
+
+
+def warm_up():
+    """ Load what the first request would otherwise load, return the seconds it took (None when off) """
+    if not getattr(settings, 'PROFILES_WARMUP', True):
+        return None
+    start = time.perf_counter()
+
+    resolver = get_resolver()
+    # imports the views, and fills the reverse lookup tables
+    resolver.reverse_dict
+    for callback in set(iter_views(resolver.url_patterns)):
+        warm_view(callback)
+
+    with translation.override(settings.LANGUAGE_CODE):
+        # loads the catalogs of every app, what the first error message would do
+        translation.gettext('Not found.')
+    hashers.get_hashers()
+    for alias in connections:
+        # imports the database backends, without connecting
+        connections[alias]
+
+    seconds = time.perf_counter() - start
+    logger.info('warmed up in %.0f ms', seconds * 1000)
+    return seconds
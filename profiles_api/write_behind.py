@@ -0,0 +1,308 @@
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.signals import request_started, setting_changed
+from django.db import close_old_connections
+from django.dispatch import receiver
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from profiles_api.metrics import CallbackGauge, registry
+
+logger = logging.getLogger(__name__)
+
+# Write-behind creation of feed items.
+# With ENABLED on, POST /api/feed/ validates the item as usual but, instead of inserting it
+# on the request thread (one write transaction per request, all waiting on the database
+# write lock under a burst), appends it to a queue and answers 202 with the queue id. A
+# worker thread drains the queue every FLUSH_SECONDS in bulk_create transactions of up to
+# BATCH_SIZE items, so a burst of requests costs a handful of transactions.
+#
+# The queue is a table in a SQLite file of its own (PATH), committed before the 202 is
+# sent, so a queued item survives a crash of the process. Rows are claimed by the worker
+# draining them and deleted once their items are committed, so they are delivered at
+# least once: a crash between the two inserts a batch twice. Several processes can share
+# one PATH, a claim left by a dead process is taken over after CLAIM_TIMEOUT seconds.
+#
+# Backpressure: with MAX_PENDING items waiting the endpoint answers 503 instead of letting
+# the queue grow without bound. On shutdown (atexit) the worker stops and the queue is
+# drained; `manage.py drain_feed_queue` drains it by hand, e.g. after a crash.
+#
+# The queue connection and the worker thread belong to one process. They are made on first
+# use in the process, the first feed item queued or the first request it serves (which also
+# drains what a previous run left queued), never at import: a process forked from one that
+# had them (gunicorn --preload) would share the SQLite handle and have no thread.
+
+DEFAULTS = {
+    'ENABLED': False,
+    'PATH': 'feed_queue.sqlite3',
+    'BATCH_SIZE': 500,
+    'FLUSH_SECONDS': 0.2,
+    'MAX_PENDING': 10000,
+    'CLAIM_TIMEOUT': 60,
+    # run a worker thread in the process, off to only drain with drain_feed_queue
+    'WORKER': True,
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS feed_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_profile_id INTEGER NOT NULL,
+    status_text TEXT NOT NULL,
+    enqueued_at REAL NOT NULL,
+    claim TEXT,
+    claimed_at REAL
+)
+"""
+
+
+class QueueFull(APIException):
+    """ MAX_PENDING feed items are waiting to be written """
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many feed items waiting to be saved, try again shortly.'
+    default_code = 'feed_queue_full'
+
+
+def get_settings():
+    """ Write-behind settings merged over the defaults """
+    return {**DEFAULTS, **getattr(settings, 'PROFILES_WRITE_BEHIND', {})}
+
+
+def enabled():
+    return get_settings()['ENABLED']
+
+
+class FeedQueue:
+    """ Durable queue of feed items to insert, a table in its own SQLite file """
+
+    def __init__(self, path, max_pending, claim_timeout):
+        self.path = str(path)
+        self.max_pending = max_pending
+        self.claim_timeout = claim_timeout
+        # shared by the request threads and the worker, self.lock serializes them
+        self.connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+        self.connection.execute(SCHEMA)
+        self.lock = threading.Lock()
+        self.pending = self.count()
+        self.written = 0
+        self.rejected = 0
+
+    def count(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM feed_queue').fetchone()[0]
+
+    def put(self, user_profile_id, status_text):
+        """ Append an item, return its queue id """
+        with self.lock:
+            if self.pending >= self.max_pending:
+                # another process (or drain_feed_queue) may have drained it meanwhile
+                self.pending = self.connection.execute('SELECT COUNT(*) FROM feed_queue').fetchone()[0]
+                if self.pending >= self.max_pending:
+                    self.rejected += 1
+                    raise QueueFull()
+            cursor = self.connection.execute(
+                'INSERT INTO feed_queue (user_profile_id, status_text, enqueued_at) VALUES (?, ?, ?)',
+                (user_profile_id, status_text, time.time()),
+            )
+            self.pending += 1
+            return cursor.lastrowid
+
+    def take(self, limit):
+        """ Claim up to limit of the oldest unclaimed items, [(id, user_profile_id, status_text, enqueued_at)] """
+        claim = uuid.uuid4().hex
+        now = time.time()
+        with self.lock:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                self.connection.execute(
+                    'UPDATE feed_queue SET claim = ?, claimed_at = ? WHERE id IN ('
+                    '  SELECT id FROM feed_queue WHERE claim IS NULL OR claimed_at < ? ORDER BY id LIMIT ?'
+                    ')',
+                    (claim, now, now - self.claim_timeout, limit),
+                )
+                rows = self.connection.execute(
+                    'SELECT id, user_profile_id, status_text, enqueued_at FROM feed_queue WHERE claim = ? ORDER BY id',
+                    (claim,),
+                ).fetchall()
+                self.connection.execute('COMMIT')
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+        return rows
+
+    def ack(self, ids):
+        """ Forget items whose feed items are committed """
+        with self.lock:
+            self.connection.executemany('DELETE FROM feed_queue WHERE id = ?', [(pk,) for pk in ids])
+            self.written += len(ids)
+            # other processes sharing the file drain it too, recount instead of subtracting
+            self.pending = self.connection.execute('SELECT COUNT(*) FROM feed_queue').fetchone()[0]
+
+    def release(self, ids):
+        """ Give claimed items back, they are taken again by the next drain """
+        with self.lock:
+            self.connection.executemany('UPDATE feed_queue SET claim = NULL WHERE id = ?', [(pk,) for pk in ids])
+
+    def stats(self):
+        return {'pending': self.pending, 'written': self.written, 'rejected': self.rejected}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def write_batch(rows):
+    """ Insert the feed items of claimed queue rows, skipping those of deleted profiles """
+    from profiles_api.models import ProfileFeedItem, UserProfile
+
+    user_ids = {row[1] for row in rows}
+    existing = set(UserProfile.objects.filter(id__in=user_ids).values_list('id', flat=True))
+    if existing != user_ids:
+        logger.warning('dropping queued feed items of deleted profiles %s', sorted(user_ids - existing))
+    # posted when queued, not when drained: they sort among the items posted meanwhile
+    items = [
+        ProfileFeedItem(
+            user_profile_id=user_id, status_text=status_text,
+            created_on=datetime.fromtimestamp(enqueued_at, tz=timezone.utc),
+        )
+        for _, user_id, status_text, enqueued_at in rows if user_id in existing
+    ]
+    if items:
+        ProfileFeedItem.objects.bulk_create_items(items, chunk_size=len(items))
+
+
+def drain(queue=None, batch_size=None, max_batches=None):
+    """ Write queued items until the queue is empty, return how many were written """
+    queue = queue or get_queue()
+    batch_size = batch_size or get_settings()['BATCH_SIZE']
+    written = batches = 0
+    while max_batches is None or batches < max_batches:
+        rows = queue.take(batch_size)
+        if not rows:
+            break
+        ids = [row[0] for row in rows]
+        try:
+            write_batch(rows)
+        except Exception:
+            queue.release(ids)
+            raise
+        queue.ack(ids)
+        written += len(rows)
+        batches += 1
+    return written
+
+
+class QueueWorker(threading.Thread):
+    """ Drains the queue every FLUSH_SECONDS, or as soon as a batch is full """
+
+    def __init__(self, queue, flush_seconds, batch_size):
+        super().__init__(name='feed-write-behind', daemon=True)
+        self.queue = queue
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+
+    def run(self):
+        while not self.stopping.is_set():
+            self.wakeup.wait(self.flush_seconds)
+            self.wakeup.clear()
+            try:
+                drain(self.queue, self.batch_size)
+            except Exception:
+                logger.exception('writing queued feed items failed, retrying')
+                time.sleep(self.flush_seconds)
+            finally:
+                close_old_connections()
+
+    def stop(self, timeout=None):
+        self.stopping.set()
+        self.wakeup.set()
+        self.join(timeout)
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_worker():
+    """ The queue of this process and its worker thread (None with WORKER off), started on first use """
+    global _worker
+    with _worker_lock:
+        # one made before a fork belongs to the parent, its thread didn't survive the fork
+        if _worker is None or _worker[0] != os.getpid():
+            conf = get_settings()
+            queue = FeedQueue(conf['PATH'], conf['MAX_PENDING'], conf['CLAIM_TIMEOUT'])
+            worker = None
+            if conf['WORKER']:
+                worker = QueueWorker(queue, conf['FLUSH_SECONDS'], conf['BATCH_SIZE'])
+                worker.start()
+            atexit.register(shutdown, queue, worker)
+            _worker = (os.getpid(), queue, worker)
+        return _worker[1:]
+
+
+def started():
+    """ Whether this process has its queue already """
+    return _worker is not None and _worker[0] == os.getpid()
+
+
+def get_queue():
+    return get_worker()[0]
+
+
+def enqueue(user_profile_id, status_text):
+    """ Queue a validated feed item, return its queue id or raise QueueFull """
+    queue, worker = get_worker()
+    queue_id = queue.put(user_profile_id, status_text)
+    if worker is not None and queue.pending >= get_settings()['BATCH_SIZE']:
+        # a full batch is waiting, no need to wait for the timer
+        worker.wakeup.set()
+    return queue_id
+
+
+@receiver(request_started)
+def start_worker(**kwargs):
+    """ Start the worker on the first request of a process if write-behind is on """
+    if not started() and enabled():
+        get_worker()
+
+
+def shutdown(queue, worker):
+    """ Stop the worker and write everything still queued """
+    if worker is not None:
+        worker.stop()
+    try:
+        drain(queue)
+    except Exception:
+        logger.exception('feed items left in %s, run manage.py drain_feed_queue', queue.path)
+    finally:
+        queue.close()
+
+
+@receiver(setting_changed)
+def reset_worker(setting, **kwargs):
+    """ Stop and drop the queue when the settings change (tests) """
+    global _worker
+    if setting == 'PROFILES_WRITE_BEHIND' and started():
+        queue, worker = get_worker()
+        atexit.unregister(shutdown)
+        if worker is not None:
+            worker.stop()
+        queue.close()
+        _worker = None
+
+
+registry.register(CallbackGauge(
+    'profiles_feed_queue', 'Feed items waiting in, written from and rejected by the write-behind queue', 'stat',
+    lambda: get_queue().stats() if started() else {}
+))
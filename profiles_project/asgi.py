@@ -9,8 +9,18 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'profiles_project.settings')
 
-application = get_asgi_application()
+# what django.core.asgi.get_asgi_application() does, for our own handler below
+django.setup(set_prefix=False)
+
+from profiles_api import streams, warmup  # noqa: E402
+
+# load the urls, views and serializers now rather than on the first request (PROFILES_WARMUP)
+warmup.warm_up()
+
+# the push streams of the feed (/api/stream/feed/, SSE and websocket) are served next to django,
+# whose streaming responses (the exports) are read off the event loop
+application = streams.PushRouter(streams.StreamingASGIHandler())
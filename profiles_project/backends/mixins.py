@@ -0,0 +1,148 @@
+import queue
+import threading
+
+# Connection handling shared by the database backends of the project.
+#
+# Health checks: with persistent connections (CONN_MAX_AGE > 0) a connection can die between
+# two requests (database restart, idle timeout of a proxy...) and the next request would fail
+# on it. With CONN_HEALTH_CHECKS on, the first use of a connection in every request checks
+# it with is_usable() and reconnects when it's gone, like Django 4.1 does.
+#
+# Pool: Django keeps (at most) one connection per thread, so servers that don't keep their
+# threads (async views running on pool threads, runserver, thread per request servers) or
+# run with CONN_MAX_AGE = 0 connect again for every request. With POOL_SIZE set, closing a
+# connection hands the DB-API connection to a process wide pool instead, and the next
+# connect() of any thread takes it from there.
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """ Bounded stack of idle DB-API connections, the most recently used is handed out first """
+
+    def __init__(self, size):
+        self.size = size
+        self.connections = queue.LifoQueue(maxsize=size)
+
+    def get(self):
+        try:
+            return self.connections.get_nowait()
+        except queue.Empty:
+            return None
+
+    def put(self, connection):
+        """ Keep connection, False when the pool is full """
+        try:
+            self.connections.put_nowait(connection)
+            return True
+        except queue.Full:
+            return False
+
+    def clear(self):
+        while True:
+            connection = self.get()
+            if connection is None:
+                return
+            close_quietly(connection)
+
+
+def get_pool(alias, name, size):
+    """ The pool of the connections of one database """
+    key = (alias, str(name))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool.size != size:
+            pool = _pools[key] = ConnectionPool(size)
+        return pool
+
+
+def close_quietly(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+def ping(connection):
+    """ Whether a DB-API connection still answers """
+    try:
+        cursor = connection.cursor()
+        try:
+            cursor.execute('SELECT 1')
+        finally:
+            cursor.close()
+    except Exception:
+        return False
+    return True
+
+
+class HealthCheckMixin:
+    """ Check a reused connection once per request before using it (CONN_HEALTH_CHECKS) """
+    health_check_done = False
+
+    def ensure_connection(self):
+        if (
+            self.connection is not None
+            and self.settings_dict.get('CONN_HEALTH_CHECKS')
+            and not self.health_check_done
+            and not self.in_atomic_block
+        ):
+            self.health_check_done = True
+            if not self.is_usable():
+                self.close()
+        super().ensure_connection()
+
+    def close_if_unusable_or_obsolete(self):
+        # called when a request starts and ends, the next use of the connection checks it again
+        self.health_check_done = False
+        super().close_if_unusable_or_obsolete()
+
+    def connect(self):
+        super().connect()
+        # a brand new (or just pinged pooled) connection needs no check
+        self.health_check_done = True
+
+
+class PoolMixin:
+    """ Reuse closed connections through a ConnectionPool of POOL_SIZE connections """
+
+    def pool_enabled(self):
+        return bool(self.settings_dict.get('POOL_SIZE'))
+
+    def get_pool(self):
+        if not self.pool_enabled():
+            return None
+        return get_pool(self.alias, self.settings_dict['NAME'], self.settings_dict['POOL_SIZE'])
+
+    def get_new_connection(self, conn_params):
+        pool = self.get_pool()
+        while pool is not None:
+            connection = pool.get()
+            if connection is None:
+                break
+            if not self.settings_dict.get('CONN_HEALTH_CHECKS') or ping(connection):
+                return connection
+            close_quietly(connection)
+
+        connection = super().get_new_connection(conn_params)
+        self.setup_new_connection(connection)
+        return connection
+
+    def setup_new_connection(self, connection):
+        """ Prepare a connection the first time it's opened, it keeps that state in the pool """
+
+    def _close(self):
+        pool = self.get_pool()
+        reusable = (
+            pool is not None
+            and not self.in_atomic_block
+            and (not self.errors_occurred or self.is_usable())
+        )
+        if reusable:
+            with self.wrap_database_errors:
+                # nothing of this connection's work must leak into the next user's
+                self.connection.rollback()
+            if pool.put(self.connection):
+                return
+        super()._close()
@@ -0,0 +1,10 @@
+from django.db.backends.postgresql import base
+
+from profiles_project.backends.mixins import HealthCheckMixin, PoolMixin
+
+# PostgreSQL backend with health checks and the connection pool, see profiles_project/database.py.
+# The pool is per process, put pgbouncer in front when many processes share one server.
+
+
+class DatabaseWrapper(HealthCheckMixin, PoolMixin, base.DatabaseWrapper):
+    pass
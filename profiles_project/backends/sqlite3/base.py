@@ -0,0 +1,44 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+from profiles_project.backends.mixins import HealthCheckMixin, PoolMixin
+
+# SQLite backend tuned for concurrent requests, see profiles_project/database.py.
+# Two OPTIONS on top of the ones of sqlite3.connect(), both named like in Django 5.1:
+#   init_command      ";" separated statements run once on every new connection, the
+#                     PRAGMAs (journal_mode=WAL, synchronous=NORMAL, mmap_size...) go here
+#   transaction_mode  DEFERRED (the default), IMMEDIATE or EXCLUSIVE, how atomic() blocks
+#                     BEGIN. IMMEDIATE takes the write lock up front, so two writers wait
+#                     on the busy timeout instead of one failing with "database is locked"
+#                     when it upgrades its read lock.
+
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(HealthCheckMixin, PoolMixin, base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop('init_command', None)
+        mode = params.pop('transaction_mode', None)
+        if mode is not None and mode.upper() not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(
+                f"settings.DATABASES transaction_mode must be one of {', '.join(TRANSACTION_MODES)}, not {mode!r}"
+            )
+        return params
+
+    def pool_enabled(self):
+        # every connection to an in-memory database is a database of its own
+        return super().pool_enabled() and not self.is_in_memory_db()
+
+    def setup_new_connection(self, connection):
+        init_command = self.settings_dict['OPTIONS'].get('init_command')
+        if init_command:
+            for statement in init_command.split(';'):
+                if statement.strip():
+                    connection.execute(statement)
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.settings_dict['OPTIONS'].get('transaction_mode')
+        self.cursor().execute(f'BEGIN {mode.upper()}' if mode else 'BEGIN')
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 
 from pathlib import Path
 
+from profiles_project import database
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -43,6 +45,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so it times everything else
+    'profiles_api.instrumentation.InstrumentationMiddleware',
+    # before anything that reads the database
+    'profiles_api.db_routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -75,14 +81,16 @@ WSGI_APPLICATION = 'profiles_project.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
+# Read from DATABASE_URL and friends, see profiles_project/database.py for the variables.
 
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': database.config(f'sqlite:///{BASE_DIR / "db.sqlite3"}'),
+    **database.replicas(),
 }
 
+# Safe requests read from the replicas, if there are any, see profiles_api/db_routers.py
+DATABASE_ROUTERS = ['profiles_api.db_routers.ReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -127,4 +135,172 @@ STATIC_URL = '/static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-AUTH_USER_MODEL = "profiles_api.UserProfile"
\ No newline at end of file
+AUTH_USER_MODEL = "profiles_api.UserProfile"
+
+# Per user feed timelines used by /api/profile/{id}/feed/, kept in a SQLite file shared by the
+# workers of this host. With several hosts use profiles_api.timeline.RedisTimelineBackend with
+# OPTIONS {'URL': ...}, or CacheTimelineBackend with OPTIONS {'CACHE_ALIAS': ...} on a shared cache
+# (the default cache is local to each process).
+
+PROFILES_TIMELINE = {
+    'BACKEND': 'profiles_api.timeline.SQLiteTimelineBackend',
+    'MAX_LENGTH': 1000,
+    'OPTIONS': {'PATH': BASE_DIR / 'timelines.sqlite3', 'TTL': 300},
+}
+
+
+# Cache of token -> user lookups done by profiles_api.authentication.CachedTokenAuthentication
+# Set CACHE_ALIAS to a shared cache (e.g. redis/memcached) to share the second tier between workers.
+
+PROFILES_TOKEN_CACHE = {
+    'MAX_ENTRIES': 10000,
+    'TTL': 60,
+    'CACHE_ALIAS': None,
+}
+
+
+# POST/PATCH /api/feed/bulk/: rows per INSERT/UPDATE statement and max items per request
+
+PROFILES_FEED_BULK = {
+    'CHUNK_SIZE': 500,
+    'MAX_ITEMS': 10000,
+}
+
+
+# Rows fetched per database round trip by the /export/ endpoints
+
+PROFILES_EXPORT_CHUNK_SIZE = 2000
+
+
+# Full text profile search (?search= on /api/profile/)
+# 'auto' uses FTS5 on SQLite and tsvector/trigram indexes on PostgreSQL, LIKE scans otherwise.
+
+PROFILES_SEARCH = {
+    'BACKEND': 'auto',
+    'MAX_RESULTS': 500,
+}
+
+
+# ETag / conditional GET and response cache of the profile and feed viewsets.
+# With several worker processes CACHE_ALIAS must point to a cache they share.
+
+PROFILES_RESPONSE_CACHE = {
+    'CACHE_ALIAS': 'default',
+    'TTL': 300,
+}
+
+
+# Password hashing pool of profiles_api.hashing (POOL is 'thread' or 'process').
+# The algorithm and work factor are PASSWORD_HASHERS, passwords stored with an older
+# one are rehashed on the next login.
+
+PROFILES_PASSWORD_HASHING = {
+    'POOL': 'thread',
+    'MAX_PENDING': 64,
+    'TIMEOUT': 5,
+}
+
+
+# Request instrumentation, see profiles_api/instrumentation.py. Metrics are served on /api/metrics/
+# to the ALLOWED_IPS, with METRICS_TOKEN or a staff session.
+# Set PROFILE_SAMPLE_RATE > 0 to run that fraction of requests under cProfile; the ones slower
+# than SLOW_REQUEST_SECONDS are dumped to PROFILE_DIR (open them with snakeviz or pstats).
+# EXPLAIN_QUERIES logs the table scans and sorts of the query plans of every request, dev only.
+
+PROFILES_INSTRUMENTATION = {
+    'ALLOWED_IPS': ('127.0.0.1', '::1'),
+    # the scrapers send it as `Authorization: Bearer <token>`, staff users log in to the admin
+    'METRICS_TOKEN': None,
+    'SERVER_TIMING_HEADER': DEBUG,
+    'PROFILE_SAMPLE_RATE': 0.0,
+    'SLOW_REQUEST_SECONDS': 1.0,
+    'PROFILE_DIR': BASE_DIR / 'request_profiles',
+    'EXPLAIN_QUERIES': False,
+}
+
+
+# Serve GET list/retrieve of the profile and feed viewsets with their fast read serializers
+
+PROFILES_FAST_READ = True
+
+
+# Load the urls, views and serializers when a server process starts instead of on its first
+# request, see profiles_api/warmup.py. settings_api.py is a lighter profile for api workers.
+
+PROFILES_WARMUP = True
+
+
+# Django REST framework
+# https://www.django-rest-framework.org/api-guide/settings/
+# FastJSONRenderer/FastJSONParser use orjson when it is installed and fall back to the json module.
+# A viewset can pick its own with renderer_classes/parser_classes.
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'profiles_api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'profiles_api.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    # requests per user (per address when anonymous), see profiles_api/throttling.py
+    'DEFAULT_THROTTLE_RATES': {
+        'profile': '1000/min',
+        'feed': '1000/min',
+        'login': '60/min',
+        'login_account': '10/min',
+    },
+}
+
+
+# Read replica routing, the replicas are the DATABASES besides default
+
+PROFILES_REPLICAS = {
+    'PRIMARY': 'default',
+    'PIN_SECONDS': 5,
+}
+
+
+# Feed items older than ARCHIVE_AFTER_DAYS are moved to the archive table by
+# `manage.py archive_feed`, or by a thread of the server process every SCHEDULE_SECONDS; the
+# threads of the processes take turns through a lock in CACHE_ALIAS, which has to be shared
+
+PROFILES_RETENTION = {
+    'ARCHIVE_AFTER_DAYS': 365,
+    'BATCH_SIZE': 1000,
+    'SCHEDULE_SECONDS': None,
+}
+
+
+# Counter store of the throttles, in process by default.
+# profiles_api.throttling.CacheCounterStore with OPTIONS {'CACHE_ALIAS': ...} shares the counts between workers.
+
+PROFILES_THROTTLE = {
+    'STORE': 'profiles_api.throttling.LocalCounterStore',
+    'OPTIONS': {'SHARDS': 64},
+}
+
+
+# Write-behind feed creation: POST /api/feed/ queues the item in PATH and answers 202,
+# a worker thread inserts the queue in batches. See profiles_api/write_behind.py.
+
+PROFILES_WRITE_BEHIND = {
+    'ENABLED': False,
+    'PATH': BASE_DIR / 'feed_queue.sqlite3',
+    'BATCH_SIZE': 500,
+    'MAX_PENDING': 10000,
+}
+
+
+# Push streams of the feed (/api/stream/feed/, served by asgi.py). LocalBackend only sees the
+# writes of its own process, profiles_api.push.SQLiteBackend with OPTIONS {'PATH': ...} those
+# of every process sharing the file. See profiles_api/push.py.
+
+PROFILES_PUSH = {
+    'BACKEND': 'profiles_api.push.LocalBackend',
+    'OPTIONS': {},
+    'BUFFER_SIZE': 256,
+    'HISTORY': 1000,
+}
@@ -0,0 +1,48 @@
+"""
+API only settings for the worker processes serving profiles_api to token authenticated clients.
+
+    DJANGO_SETTINGS_MODULE=profiles_project.settings_api gunicorn --preload profiles_project.wsgi
+
+Everything of settings.py except what only the admin and the browsable api use: the admin,
+sessions, messages and staticfiles apps, their middleware, the template engine and the
+BrowsableAPIRenderer. A worker imports a good deal less and boots faster with a smaller
+resident set, see benchmarks/startup.py. The api answers JSON only and authenticates with
+tokens only (no session logins, so no CSRF either).
+
+Run migrations, the admin and the management commands with the full settings.py.
+"""
+
+from profiles_project.settings import *  # noqa: F401,F403
+from profiles_project.settings import INSTALLED_APPS, MIDDLEWARE, REST_FRAMEWORK
+
+INSTALLED_APPS = [
+    app for app in INSTALLED_APPS
+    if app not in (
+        'django.contrib.admin',
+        'django.contrib.sessions',
+        'django.contrib.messages',
+        'django.contrib.staticfiles',
+    )
+]
+
+MIDDLEWARE = [
+    middleware for middleware in MIDDLEWARE
+    if middleware not in (
+        'django.contrib.sessions.middleware.SessionMiddleware',
+        'django.middleware.csrf.CsrfViewMiddleware',
+        'django.contrib.auth.middleware.AuthenticationMiddleware',
+        'django.contrib.messages.middleware.MessageMiddleware',
+        'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    )
+]
+
+ROOT_URLCONF = 'profiles_project.urls_api'
+
+# nothing renders html
+TEMPLATES = []
+
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    'DEFAULT_RENDERER_CLASSES': ['profiles_api.renderers.FastJSONRenderer'],
+    'DEFAULT_AUTHENTICATION_CLASSES': ['profiles_api.authentication.CachedTokenAuthentication'],
+}
@@ -0,0 +1,9 @@
+"""profiles_project URL Configuration of the API only settings (settings_api.py)
+
+The api of profiles_api and nothing else: no admin, whose apps are not installed there.
+"""
+from django.urls import include, path
+
+urlpatterns = [
+    path('api/', include('profiles_api.urls'))
+]
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'profiles_project.settings')
 
 application = get_wsgi_application()
+
+from profiles_api import warmup  # noqa: E402
+
+# load the urls, views and serializers now rather than on the first request (PROFILES_WARMUP)
+warmup.warm_up()